@@ -2,11 +2,74 @@
 # bridge/crew.py
 
 import core.raven as raven
-from .tools.tools import get_tool_description, list_tools, run_tool
-from pydantic import BaseModel, Field
-from typing import List, Dict, Optional, Any
+from .tools.tools import get_tool_description, list_tools, submit_tool, tool_resource
+from .tools.grammar import ToolCallStream, max_command_tokens, tool_call_grammar
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Callable, List, Dict, Optional, Any
+from core import metrics, tracing
+from core.env import env_float, env_int, env_str
 from core.raven import get_raven_prompt
-import re # <-- Ensure re is imported
+from core.scheduler import DeadlineExceeded, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+import contextvars
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+class ContextWindow:
+    """
+    Keeps a crew's history inside the model's context: the system prompt is pinned and the oldest
+    turns slide out so that prompt + max_tokens fits n_ctx.
+    Each message is tokenized once, with the model's own tokenizer, when it enters the window; its count
+    is kept alongside it, so trimming only subtracts counts instead of re-tokenizing the history.
+    """
+
+    def __init__(self, messages, count_tokens, n_ctx):
+        self.messages = messages  # the crew's list; messages[0] is the pinned system prompt
+        self._count_tokens = count_tokens
+        self.n_ctx = n_ctx
+        self._counts = deque(self._tokens(message) for message in messages[1:])
+        self.pinned = self._tokens(messages[0]) + self._count(raven.GENERATION_PROMPT)
+        self.total = self.pinned + sum(self._counts)
+        self.trimmed = 0
+
+    def _count(self, text):
+        try:
+            return self._count_tokens(text)
+        except Exception:
+            # Tokenizer unreachable (e.g. server restarting): over-estimate rather than overflow.
+            return len(text.encode("utf-8")) // 3 + 1
+
+    def _tokens(self, message):
+        return self._count(raven.format_message(message))
+
+    def append(self, message):
+        n = self._tokens(message)
+        self.messages.append(message)
+        self._counts.append(n)
+        self.total += n
+
+    def pop(self):
+        """Removes the newest message (a turn the model never answered)."""
+        self.total -= self._counts.pop()
+        return self.messages.pop()
+
+    def fit(self, max_tokens):
+        """
+        Drops the oldest turns until the prompt leaves `max_tokens` free, always keeping the newest message.
+        Returns the generation budget, which is only below `max_tokens` when that message alone does not fit.
+        """
+        while self.total + max_tokens > self.n_ctx and len(self._counts) > 1:
+            del self.messages[1]
+            self.total -= self._counts.popleft()
+            self.trimmed += 1
+        return max(1, min(max_tokens, self.n_ctx - self.total))
+
+    def reset(self):
+        del self.messages[1:]
+        self._counts.clear()
+        self.total = self.pinned
+
+MIN_STEP_TOKENS = 16  # a follow-up step with a smaller budget is skipped
 
 class Crew(BaseModel):
     name: str
@@ -19,109 +82,300 @@ class Crew(BaseModel):
     repetition_penalty: float = 1.15
     messages: List[Dict[str, str]] = []
     available_tools: List[str] = []
+    priority: int = PRIORITY_NORMAL  # Scheduler priority; lower runs first
+    deadline_s: Optional[float] = None  # Give up if a turn is still queued after this many seconds
+    tool_grammar: bool = False  # Constrain every reply to exactly one tool command
+    semantic_threshold: Optional[float] = None  # Reuse replies to paraphrased turns above this cosine similarity (None: never; ignored with tool_grammar)
+    gguf: Optional[str] = None  # Local model this crew runs on: a registry name ('small') or a .gguf path; None uses the activated model
+    lora_path: Optional[str] = None  # LoRA adapter (GGUF) applied to the shared base model for this crew's turns
+    lora_scale: float = 1.0
+    max_steps: int = Field(default=3, gt=0)  # Generate/tool rounds per turn; the model sees tool results between them
+    turn_deadline_s: Optional[float] = None  # Wall-clock limit of a whole turn, all steps included (None: no limit)
+    turn_token_budget: Optional[int] = None  # Tokens a whole turn may generate (None: max_tokens per step only)
+    last_turn: List[Dict[str, Any]] = []  # Per-step breakdown of the latest turn: tokens, generate_ms, tool_ms, ...
+    _window: Optional[ContextWindow] = PrivateAttr(default=None)
+    _tokens_per_s: Optional[float] = PrivateAttr(default=None)  # moving average, sizes steps to the time left
 
     def __init__(self, **data):
         super().__init__(**data)
         self.messages = [{"role": "system", "content": self.system_prompt}]
 
+    @property
+    def context(self) -> ContextWindow:
+        """The token-counted window over `messages`, built on first use so the model can still be loading."""
+        if self._window is None or self._window.messages is not self.messages:
+            self._window = ContextWindow(self.messages, lambda text: raven.count_tokens(self.model, text, self.gguf),
+                                         raven.context_size(self.model, self.gguf))
+        return self._window
+
 # bridge/crew.py
 
 # ... (imports and class definition remain the same) ...
 
-    def chat(self, user_input: str) -> str:
-        """Chats with the crew, maintaining conversation history and handling tool execution."""
-        self.messages.append({"role": "user", "content": user_input})
+    def chat(self, user_input: str, on_token: Optional[Callable[[raven.TokenChunk], None]] = None) -> str:
+        """
+        Chats with the crew, maintaining conversation history and handling tool execution.
+        `on_token` receives the response chunks (tool commands included, `<think>` blocks left out) while they are generated.
+        Each `run_tool` command starts as soon as its line is complete; generation stops once the model moves on from its commands.
+        """
+        with tracing.span("chat", crew=self.name) as span:
+            reply = self._chat(user_input, on_token)
+            span.set_attribute("reply_chars", len(reply))
+            return reply
+
+    def _step_budget(self, tokens_left, turn_deadline):
+        """Tokens the next step may generate: `max_tokens`, shrunk to what is left of the turn's token and time budgets."""
+        budget = self.max_tokens
+        if tokens_left is not None:
+            budget = min(budget, tokens_left)
+        if turn_deadline is not None and self._tokens_per_s:
+            budget = min(budget, int((turn_deadline - time.monotonic()) * self._tokens_per_s))
+        return max(0, budget)
+
+    def _chat(self, user_input, on_token):
+        try:
+            # A model still loading in the background queues the turn here until it is ready.
+            raven.wait_until_ready(self.model)
+        except raven.ModelNotReady as e:
+            return f"Error: {e}"
+        self.context.append({"role": "user", "content": user_input})
         output_responses = []
+        # A tool crew's reply is executed: a paraphrase with other arguments ("a file called notes" / "... todo") would
+        # replay the wrong command, so those crews never use the semantic cache.
+        use_semantic = self.semantic_threshold is not None and not self.tool_grammar
+        semantic_cache = self.model.get("semantic_cache") if use_semantic else None
+        turn_deadline = time.monotonic() + self.turn_deadline_s if self.turn_deadline_s else None
+        tokens_left = self.turn_token_budget
+        previous_calls = None
+        self.last_turn = []
+
+        # generate -> tools -> generate: the model sees its tool results within the same turn, until it answers
+        # without a command, repeats its last commands, or the turn runs out of steps, tokens or time.
+        for step in range(1, self.max_steps + 1):
+            max_tokens = self._step_budget(tokens_left, turn_deadline)
+            if step > 1 and (max_tokens < MIN_STEP_TOKENS or (turn_deadline is not None and time.monotonic() >= turn_deadline)):
+                break  # too little left for a useful follow-up: the turn keeps what it has
+            max_tokens = self.context.fit(max(1, max_tokens))
+            response = vector = None
+            cache_hit = False
+            reader = ToolCallStream()
+            started_tools = []
+            generated = [0]
+            stopped = [False]  # set once consume() ends generation early: the reply is then a fragment
+            chat_context = contextvars.copy_context()  # tool spans nest under this chat, whichever thread reads the stream
+
+            def deliver(visible, calls, index=0, elapsed=0.0):
+                for tool_name, params in calls:
+                    print(f"Executing tool: {tool_name} with params: {params}") # Debug print
+                    # Calls run concurrently; one on the same resource as an earlier call (Tool.resource) waits for it.
+                    resource = tool_resource(tool_name)
+                    after = [run for earlier, _, run in started_tools if resource and tool_resource(earlier) == resource]
+                    started_tools.append((tool_name, params, chat_context.copy().run(submit_tool, tool_name, after=after, **params)))
+                if visible and on_token:
+                    on_token(raven.TokenChunk(visible, index, elapsed))
 
-        while True:
-            response = raven.generate_response(
-                self.model,
-                self.messages,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                top_k=self.top_k,
-                top_p=self.top_p,
-                repetition_penalty=self.repetition_penalty,
-                stream=False
-            )
-
-            # --- ADDED: STRIP <think> TAGS ---
-            # Remove the <think>...</think> block before any other processing.
-            response = re.sub(r'<think>.*?</think>\s*', '', response, flags=re.DOTALL).strip()
-
-
-            # --- ROBUST TOOL PARSING LOGIC ---
-            # Use regex to find all "run_tool" commands in the response.
-            tool_calls = re.finditer(r'run_tool\s+([a-zA-Z0-9_]+)\s*(.*)', response)
-            commands_found = list(tool_calls) # Materialize iterator to check if it's empty
-            
-            # --- MODIFIED TOOL HANDLING LOGIC ---
-            if commands_found:
-                # Extract conversational text that might appear before the command
-                preamble = response.split("run_tool")[0].strip()
-                if preamble:
-                    output_responses.append(preamble)
-                    # Add only the conversational part back to history, not the tool command
-                    self.messages.append({"role": "assistant", "content": preamble})
-
-                for match in commands_found:
-                    tool_name = match.group(1).strip()
-                    params_str = match.group(2).strip()
-                    params = {}
-
-                    if params_str:
-                        # Improved parsing for key="value" or key=value pairs
-                        param_pairs = re.findall(r'(\w+)\s*=\s*("([^"]*)"|\'([^\']*)\'|([^,]+))', params_str)
-                        for key, full_value, quoted_val1, quoted_val2, unquoted_val in param_pairs:
-                            # Prioritize quoted values, then fall back to unquoted
-                            value = quoted_val1 if quoted_val1 is not None else quoted_val2
-                            if value is None:
-                                value = unquoted_val.strip()
-                            params[key.strip()] = value
+            def consume(chunk):
+                generated[0] += 1
+                deliver(*reader.feed(chunk.text), chunk.index, chunk.elapsed)
+                if turn_deadline is not None and time.monotonic() >= turn_deadline:
+                    stopped[0] = True
+                    return False  # out of time: keep what was generated so far
+                stopped[0] = reader.finished
+                return not reader.finished  # False stops generation: the rest of the reply would be discarded
 
+            with tracing.span("step", crew=self.name, step=step, max_tokens=max_tokens) as step_span:
+                started = time.perf_counter()
+                if semantic_cache and step == 1:
+                    # A paraphrase of an earlier turn gets that turn's reply without inference.
+                    with tracing.span("semantic_lookup") as span:
+                        try:
+                            response, vector = semantic_cache.lookup(self.name, user_input, self.semantic_threshold)
+                        except Exception as e:
+                            print(f"WARNING: Semantic cache lookup failed ({e}); generating instead.")
+                        span.set_attribute("hit", response is not None)
+                    cache_hit = response is not None
+                    if cache_hit:
+                        metrics.record(self.name, raven.backend_name(self.model), cache="semantic")
+                        consume(raven.TokenChunk(response, 0, 0.0))
+                        generated[0] = 0
+                if response is None:
+                    # Queue through the model's scheduler instead of hitting the shared model directly.
+                    deadline = time.monotonic() + self.deadline_s if self.deadline_s else None
+                    if turn_deadline is not None:
+                        deadline = min(deadline, turn_deadline) if deadline is not None else turn_deadline
                     try:
-                        print(f"Executing tool: {tool_name} with params: {params}") # Debug print
-                        result = run_tool(tool_name, **params)
-                        tool_message = f"Tool '{tool_name}' executed successfully. Result: {result}"
-                        self.messages.append({"role": "system", "content": tool_message})
-                        # FIX: Add the tool result to the user-facing output
-                        output_responses.append(f"TOOL RESULT: {result}")
+                        with raven.crew_model(self.model, self.gguf) as engine:
+                            response = raven.scheduled_response(
+                                engine,
+                                self.messages,
+                                priority=self.priority,
+                                deadline=deadline,
+                                max_tokens=max_tokens,
+                                temperature=self.temperature,
+                                top_k=self.top_k,
+                                top_p=self.top_p,
+                                repetition_penalty=self.repetition_penalty,
+                                stream=False,
+                                crew_name=self.name,
+                                on_token=consume,
+                                grammar=tool_call_grammar(self.available_tools or None) if self.tool_grammar else None,
+                                lora=(self.lora_path, self.lora_scale) if self.lora_path else None
+                            )
+                    except DeadlineExceeded as e:
+                        step_span.set_attribute("deadline_exceeded", True)
+                        if step == 1:
+                            self.context.pop()  # The model never saw this turn
+                            return f"Error: {e}"
+                        break  # a follow-up step missed the turn's deadline; the turn keeps what it has
+                generate_s = time.perf_counter() - started
+                if generated[0] and generate_s > 0:
+                    rate = generated[0] / generate_s  # prefill included: a conservative rate for sizing later steps
+                    self._tokens_per_s = rate if self._tokens_per_s is None else 0.7 * self._tokens_per_s + 0.3 * rate
+                if tokens_left is not None:
+                    tokens_left -= generated[0]
+
+                with tracing.span("parse") as span:
+                    # The stream was parsed while it arrived (<think> blocks dropped, commands started);
+                    # a command on the last, unterminated line completes here. A failed or cut-off generation is not parsed.
+                    if response is not None:
+                        deliver(*reader.close())
+                    span.set_attribute("tool_calls", len(started_tools))
+                if semantic_cache and step == 1 and response and not (cache_hit or stopped[0] or started_tools):
+                    # Only a finished prose answer is stored: a fragment cut off by the turn, or a reply whose
+                    # commands ran, must not be replayed for a paraphrase.
+                    try:
+                        semantic_cache.store(self.name, user_input, response, generate_s, vector)
                     except Exception as e:
-                        error_message = f"Error executing tool '{tool_name}': {str(e)}"
-                        print(f"ERROR: {error_message}") # Debug print
-                        self.messages.append({"role": "system", "content": error_message})
-                        # FIX: Also add the error to the user-facing output
-                        output_responses.append(error_message)
-                
-                # FIX: Break the loop after tool execution to prevent infinite loops.
-                break
-
-            else:
-                # No tool command found, treat as a final response
-                if response:
+                        print(f"WARNING: Semantic cache store failed ({e}); the reply is not cached.")
+                if response is None and not started_tools:
+                    # The backend failed or rejected a cut-off reply and printed why; the user sees it too.
+                    step_span.set_attribute("failed", True)
+                    error_message = f"Error: {self.name} got no reply from the model (see the log above)."
+                    if step == 1:
+                        self.context.pop()  # The model never answered this turn
+                        return error_message
+                    output_responses.append(error_message)
+                    break
+                response = reader.text.strip()
+
+                tool_s = 0.0  # waiting on the tools only; the history appends around it tokenize and are not tool time
+                if started_tools:
+                    # Extract conversational text that might appear before the command
+                    preamble = reader.preamble
+                    if preamble:
+                        output_responses.append(preamble)
+                        # Add only the conversational part back to history, not the tool command
+                        self.context.append({"role": "assistant", "content": preamble})
+
+                    # Results in command order; the tools have been running since their lines streamed in.
+                    for tool_name, params, run in started_tools:
+                        waiting = time.perf_counter()
+                        try:
+                            result = run.result()
+                        except Exception as e:
+                            tool_s += time.perf_counter() - waiting
+                            error_message = f"Error executing tool '{tool_name}': {str(e)}"
+                            print(f"ERROR: {error_message}") # Debug print
+                            self.context.append({"role": "system", "content": error_message})
+                            output_responses.append(error_message)
+                        else:
+                            tool_s += time.perf_counter() - waiting
+                            tool_message = f"Tool '{tool_name}' executed successfully. Result: {result}"
+                            self.context.append({"role": "system", "content": tool_message})
+                            output_responses.append(f"TOOL RESULT: {result}")
+                elif response:
+                    # No tool command: the final answer of the turn
                     output_responses.append(response)
-                    self.messages.append({"role": "assistant", "content": response})
-                break
+                    self.context.append({"role": "assistant", "content": response})
+                for error_message in reader.errors:
+                    # A command cut off mid-line was not run; the model and the user both see why.
+                    print(f"ERROR: {error_message}") # Debug print
+                    self.context.append({"role": "system", "content": error_message})
+                    output_responses.append(error_message)
+
+                record = {"step": step, "max_tokens": max_tokens, "tokens": generated[0], "tool_calls": len(started_tools),
+                          "generate_ms": round(generate_s * 1000, 1), "tool_ms": round(tool_s * 1000, 1)}
+                self.last_turn.append(record)
+                for key, value in record.items():
+                    step_span.set_attribute(key, value)
+
+            calls = [(tool_name, params) for tool_name, params, _ in started_tools]
+            if not calls or calls == previous_calls:
+                break  # answered, or the model is repeating itself
+            previous_calls = calls
 
         return "\n\n".join(output_responses)
 
 # ... (rest of the file remains the same) ...    
 
+    def chat_stream(self, user_input: str, on_token: Callable[[raven.TokenChunk], None]) -> str:
+        """Same as `chat`, but hands every generated chunk to `on_token` as soon as it is decoded."""
+        return self.chat(user_input, on_token=on_token)
+
     def reset(self):
         """Resets the crew's conversation history."""
-        self.messages = [{"role": "system", "content": self.system_prompt}]
+        if self._window is not None and self._window.messages is self.messages:
+            self._window.reset()  # keeps the pinned prompt's token count
+        else:
+            self.messages = [{"role": "system", "content": self.system_prompt}]
 
 
 # ... (rest of crew.py remains the same) ...
 
 
 
+def ask_all(crews: Dict[str, Crew], query: str, names: Optional[List[str]] = None):
+    """
+    Sends `query` to several crews at once and yields `(name, reply, seconds)` in the order they finish.
+    `names` defaults to every crew that answers in prose (grammar-constrained tool crews are left out).
+    The turns run concurrently: on llama-server each crew holds its own slot and the slots decode in one
+    batch, so the whole fan-out takes about as long as the slowest answer. Crews sharing one local model
+    still take turns on it.
+    """
+    names = names or [name for name, crew in crews.items() if not crew.tool_grammar]
+
+    def timed_chat(name):
+        started = time.perf_counter()
+        try:
+            reply = crews[name].chat(query)
+        except Exception as e:
+            reply = f"Error: {e}"
+        return name, reply, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="ask-all") as pool:
+        for future in as_completed([pool.submit(timed_chat, name) for name in names]):
+            yield future.result()
+
+def split_ask_all(crews: Dict[str, Crew], text: str):
+    """
+    Parses the arguments of the `ask_all` command: an optional comma-separated crew list, then the query
+    ("captain_raven,code_expert How do we ..."). Returns `(names or None, query)`.
+    """
+    first, _, rest = text.strip().partition(" ")
+    names = [name.strip() for name in first.split(",") if name.strip()]
+    if names and rest.strip() and all(name in crews for name in names):
+        return names, rest.strip()
+    return None, text.strip()
+
+def crew_lora(key):
+    """LoRA settings of a crew from .env: LORA_PATH_<KEY> and LORA_SCALE_<KEY> (default 1.0)."""
+    return {"lora_path": env_str(f"LORA_PATH_{key}"), "lora_scale": env_float(f"LORA_SCALE_{key}", 1.0)}
+
+def turn_budget():
+    """Agent-loop limits shared by the crews, from .env: CREW_MAX_STEPS (default 3), CREW_TURN_DEADLINE_S and CREW_TURN_TOKEN_BUDGET (0: none)."""
+    return {"max_steps": max(1, env_int("CREW_MAX_STEPS", 3)),
+            "turn_deadline_s": env_float("CREW_TURN_DEADLINE_S", 0.0) or None,
+            "turn_token_budget": env_int("CREW_TURN_TOKEN_BUDGET", 0) or None}
+
 def initialize_crew(model_obj, max_tokens_console):
     """Initializes a dictionary of crews and ship main bridge."""
     crew: Dict[str, Crew] = {}
     tool_descriptions = "\n".join([get_tool_description(tool_name) for tool_name in list_tools() if get_tool_description(tool_name)])
-    system_prompt = get_raven_prompt()
+    raven_lora = crew_lora("RAVEN")
+    # An adapter trained on the persona carries it; the prompt then only needs the tool instructions.
+    system_prompt = get_raven_prompt(persona=not raven_lora["lora_path"])
     initial_message = [{"role": "system", "content": system_prompt}]
+    budget = turn_budget()
 
     crew["captain_raven"] = Crew(
         name="Raven",
@@ -129,7 +383,10 @@ def initialize_crew(model_obj, max_tokens_console):
         model=model_obj,
         max_tokens=1024,
         temperature=0.8,
-        available_tools=list_tools()
+        available_tools=list_tools(),
+        semantic_threshold=0.95,
+        **budget,
+        **raven_lora
     )
 
     crew["code_expert"] = Crew(
@@ -138,6 +395,9 @@ def initialize_crew(model_obj, max_tokens_console):
         model=model_obj,
         max_tokens=512,
         temperature=0.1,
+        gguf="small",  # RAVEN_GGUF_MODEL_PATH_SMALL when set, else the main model
+        **budget,
+        **crew_lora("CODE_EXPERT")
     )
 
     # --- MODIFIED TOOL CREW ---
@@ -145,7 +405,7 @@ def initialize_crew(model_obj, max_tokens_console):
         name="tool_crew",
         system_prompt=f"""Your only function is to translate user requests into tool commands.
     - Respond with ONLY the tool command.
-    - The command format is: `run_tool tool_name param1=value1, param2=value2`
+    - The command format is: `run_tool tool_name param1="value1", param2="value2"`
     - Do not provide any explanation, preamble, or additional text.
     
     Here are the available tools:
@@ -156,18 +416,24 @@ def initialize_crew(model_obj, max_tokens_console):
     AI: run_tool open_notes
     ---
     User: Make a new file called 'report.txt' with 'Sales are up!' inside.
-    AI: run_tool create_file filename=report.txt, content="Sales are up!"
+    AI: run_tool create_file filename="report.txt", content="Sales are up!"
     ---
     User: Fire the laser at the asteroid.
-    AI: run_tool fire_laser target=asteroid
+    AI: run_tool fire_laser target="asteroid", power_level="full"
     ---
     User: What is the status of the 'mission_log.txt' file?
-    AI: run_tool status_log filename=mission_log.txt
+    AI: run_tool status_log filename="mission_log.txt"
     ---""",
         model=model_obj,
-        max_tokens=150,      # Increased slightly for complex commands
+        max_tokens=max_command_tokens(list_tools()),  # Room for the longest command; the grammar ends decoding once it is complete
         temperature=0.0,     # Keep at 0.0 for deterministic output
-        available_tools=list_tools()
+        tool_grammar=True,
+        gguf="small",
+        # No semantic_threshold: similar requests with different arguments embed close together, and replaying
+        # another request's command would run it with the wrong arguments. Exact repeats are memoized (temperature 0).
+        available_tools=list_tools(),
+        priority=PRIORITY_HIGH,  # Short commands jump ahead of long generations
+        **dict(budget, max_steps=1)  # The grammar makes every reply a command, so a second step would only issue another
     )
 
     crew["creative_writer"] = Crew(
@@ -175,7 +441,11 @@ def initialize_crew(model_obj, max_tokens_console):
         system_prompt="You are a creative writer. Write engaging and imaginative stories and descriptions. Be descriptive and interesting.",
         model=model_obj,
         max_tokens=1024,
-        temperature=0.9
+        temperature=0.9,
+        gguf="main",  # Long-form writing keeps the big model
+        priority=PRIORITY_LOW,
+        **budget,
+        **crew_lora("CREATIVE_WRITER")
     )
 
     return crew
\ No newline at end of file
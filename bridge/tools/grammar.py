@@ -0,0 +1,260 @@
+# bridge/tools/grammar.py
+import inspect
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .tools import TOOL_LIST, Tool
+
+# Tool command format shared by the prompts, the grammar and the parser:
+#   run_tool tool_name param1="value1", param2="value2"
+# Values are printable ASCII (at most one token per character) and bounded, so every command fits `max_command_tokens`.
+MAX_VALUE_CHARS = 64
+_VALUE_RULE = f'value ::= "\\"" [ !#-~]{{0,{MAX_VALUE_CHARS}}} "\\""'
+
+_CALL_RE = re.compile(r'run_tool\s+([a-zA-Z0-9_]+)[ \t]*(.*)')
+_PARAM_RE = re.compile(r'(\w+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^,"\'\s][^,]*))')  # a bare value cannot open a quote
+# A whole command: name, then comma-separated parameters with every quote closed, up to the end of the line.
+_PARAM_PATTERN = r'\w+\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^,"\'\s][^,]*)'
+_COMMAND_RE = re.compile(rf'run_tool\s+[a-zA-Z0-9_]+(?:[ \t]+{_PARAM_PATTERN}(?:\s*,\s*{_PARAM_PATTERN})*)?\s*$')
+# The start of a command that was cut off: a dangling comma, parameter name, `=` or unclosed quote at the end.
+_TRUNCATED_RE = re.compile(rf'run_tool\s+[a-zA-Z0-9_]+[ \t]+(?:{_PARAM_PATTERN}\s*,\s*)*(?:\w+\s*(?:=\s*(?:"[^"]*|\'[^\']*)?)?)?$')
+_TRAILING = " \t`.,;:!?"  # markdown and sentence punctuation models put after a command
+
+_CALL_PREFIX = "run_tool"
+
+_grammar_cache: Dict[Tuple[str, ...], str] = {}
+
+
+def _required(tool: Tool) -> Dict[str, bool]:
+    """Maps each declared parameter to whether the tool function needs it (has no default)."""
+    try:
+        signature = inspect.signature(tool.function).parameters
+    except (TypeError, ValueError):
+        signature = {}
+    return {
+        name: name in signature and signature[name].default is inspect.Parameter.empty
+        for name in tool.parameters or []
+    }
+
+
+def _args_expr(params: List[Tuple[str, bool]]) -> str:
+    """GBNF for the parameters in declared order, optional ones skippable, joined by ', '."""
+    def pair(name):
+        return f'"{name}=" value'
+
+    def rest(i):
+        if i == len(params):
+            return ""
+        name, required = params[i]
+        item = f'", " {pair(name)}' if required else f'(", " {pair(name)})?'
+        return f"{item} {rest(i + 1)}".strip()
+
+    def first(i):
+        # Non-empty argument list starting at parameter i, without a leading separator.
+        name, required = params[i]
+        head = f"{pair(name)} {rest(i + 1)}".strip()
+        if required or i + 1 == len(params):
+            return head
+        return f"({head}) | ({first(i + 1)})"
+
+    return first(0)
+
+
+def _rule_name(tool_name: str) -> str:
+    return "tool-" + tool_name.replace("_", "-")
+
+
+def tool_call_grammar(tool_names: Optional[List[str]] = None) -> str:
+    """
+    Builds a GBNF grammar that only accepts one complete `run_tool` command for the given tools
+    (all of TOOL_LIST by default). Once the command is complete nothing but end-of-generation is
+    allowed, so decoding stops right there.
+    """
+    names = tuple(name for name in (tool_names if tool_names is not None else TOOL_LIST) if name in TOOL_LIST)
+    if names in _grammar_cache:
+        return _grammar_cache[names]
+    rules = ['root ::= "run_tool " call', "call ::= " + " | ".join(_rule_name(name) for name in names)]
+    for name in names:
+        params = list(_required(TOOL_LIST[name]).items())
+        if not params:
+            rules.append(f'{_rule_name(name)} ::= "{name}"')
+        elif any(required for _, required in params):
+            rules.append(f'{_rule_name(name)} ::= "{name} " ({_args_expr(params)})')
+        else:
+            rules.append(f'{_rule_name(name)} ::= "{name}" (" " ({_args_expr(params)}))?')
+    rules.append(_VALUE_RULE)
+    grammar = _grammar_cache[names] = "\n".join(rules) + "\n"
+    return grammar
+
+
+def max_command_tokens(tool_names: Optional[List[str]] = None) -> int:
+    """
+    Upper bound on the tokens of any command `tool_call_grammar(tool_names)` accepts: every parameter given at
+    `MAX_VALUE_CHARS`, one token per character, plus the end-of-generation token.
+    """
+    names = [name for name in (tool_names if tool_names is not None else TOOL_LIST) if name in TOOL_LIST]
+    longest = 0
+    for name in names:
+        args = ", ".join(f'{param}="{"x" * MAX_VALUE_CHARS}"' for param in TOOL_LIST[name].parameters or [])
+        longest = max(longest, len(f"{_CALL_PREFIX} {name} {args}".rstrip()))
+    return longest + 1
+
+
+def parse_tool_calls(text: str) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Extracts every `run_tool` command in `text` as (tool_name, params).
+    Grammar-constrained output always has quoted values; free-text replies may also use
+    single quotes or bare values up to the next comma, and wrap commands in backticks or quotes.
+    Incomplete commands (an unclosed quote, a dangling parameter name) are left out.
+    """
+    commands = (_command(match) for match in _CALL_RE.finditer(text))
+    return [_parse_call(command) for command in commands if command]
+
+
+def _command(match: re.Match) -> Optional[str]:
+    """
+    The whole command a `run_tool` match holds, without the backticks, wrapping quotes or punctuation
+    around it; None when it is not one (a line cut off mid-value, prose that mentions run_tool).
+    """
+    text = match.group(0)
+    if match.string[:match.start()].endswith("`"):
+        text = text.split("`")[0]  # inline code: the command ends at the closing backtick
+    text = text.rstrip(_TRAILING)
+    candidates = [text]
+    if text[-1:] in ("'", '"'):
+        candidates.append(text[:-1].rstrip(_TRAILING))  # 'run_tool open_notes'
+    return next((candidate for candidate in candidates if _COMMAND_RE.match(candidate)), None)
+
+
+def _parse_call(command: str) -> Tuple[str, Dict[str, str]]:
+    match = _CALL_RE.match(command)
+    params = {}
+    for key, double_quoted, single_quoted, bare in _PARAM_RE.findall(match.group(2)):
+        if double_quoted or not (single_quoted or bare):
+            params[key] = double_quoted
+        elif single_quoted:
+            params[key] = single_quoted
+        else:
+            params[key] = bare.strip()
+    return match.group(1), params
+
+
+_THINK_OPEN, _THINK_CLOSE = "<think>", "</think>"
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """Length of the longest tail of `text` that could be the start of `tag`."""
+    for k in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:k]):
+            return k
+    return 0
+
+
+class ToolCallStream:
+    """
+    Incremental reader of a streamed reply. `<think>...</think>` blocks are dropped as they arrive, and
+    every `run_tool` command is reported as soon as its line is complete, so the tool can start while the
+    model is still writing. Once the model moves on from its commands to other text, `finished` turns True:
+    nothing after that point is used, so generation can stop there.
+    A command that is not syntactically complete is never reported; when the stream ended inside one
+    (the last line cut off mid-value), it is listed in `errors`. Other lines that mention run_tool are prose.
+    """
+
+    def __init__(self):
+        self.text = ""  # visible reply so far
+        self.calls: List[Tuple[str, Dict[str, str]]] = []
+        self.errors: List[str] = []  # commands the stream ended inside of, which were dropped
+        self.finished = False
+        self._held = ""  # tail that may be the start of a think tag
+        self._thinking = False
+        self._skip_space = False  # whitespace after a think block is dropped with it
+        self._line_start = 0
+
+    def feed(self, chunk: str) -> Tuple[str, List[Tuple[str, Dict[str, str]]]]:
+        """Consumes one streamed chunk; returns the newly visible text and the commands completed by it."""
+        if self.finished:
+            return "", []
+        start = len(self.text)
+        calls = self._scan(self._strip_think(self._held + chunk), final=False)
+        return self.text[start:], calls
+
+    def close(self) -> Tuple[str, List[Tuple[str, Dict[str, str]]]]:
+        """Ends the stream: flushes held-back text and reports a command on the last, unterminated line if it is complete."""
+        if self.finished:
+            return "", []
+        start, visible = len(self.text), "" if self._thinking else self._held
+        self._held = ""
+        calls = self._scan(visible, final=True)
+        return self.text[start:], calls
+
+    @property
+    def preamble(self) -> str:
+        """Conversational text before the first command."""
+        return self.text.split(_CALL_PREFIX)[0].strip()
+
+    def _strip_think(self, text: str) -> str:
+        visible = ""
+        while text:
+            if self._thinking:
+                end = text.find(_THINK_CLOSE)
+                if end < 0:
+                    held = _partial_tag(text, _THINK_CLOSE)
+                    self._held = text[len(text) - held:] if held else ""
+                    return visible
+                text = text[end + len(_THINK_CLOSE):]
+                self._thinking = False
+                self._skip_space = True
+                continue
+            if self._skip_space:
+                text = text.lstrip()
+                if not text:
+                    break
+                self._skip_space = False
+            start = text.find(_THINK_OPEN)
+            if start >= 0:
+                visible += text[:start]
+                text = text[start + len(_THINK_OPEN):]
+                self._thinking = True
+                continue
+            held = _partial_tag(text, _THINK_OPEN)
+            visible += text[:len(text) - held]
+            self._held = text[len(text) - held:]
+            return visible
+        self._held = ""
+        return visible
+
+    def _scan(self, visible: str, final: bool) -> List[Tuple[str, Dict[str, str]]]:
+        found = []
+        self.text += visible
+        while not self.finished:
+            end = self.text.find("\n", self._line_start)
+            if end < 0:
+                break
+            found += self._line(self.text[self._line_start:end], final=False)
+            self._line_start = end + 1
+        rest = self.text[self._line_start:]
+        if not self.finished and final:
+            found += self._line(rest, final=True)
+        elif not self.finished and self.calls and not self._may_be_command(rest):
+            self.finished = True  # prose after the commands: the rest of the reply is not used
+        if self.finished:
+            self.text = self.text[:self._line_start]
+        return found
+
+    @staticmethod
+    def _may_be_command(line: str) -> bool:
+        """Whether an unfinished line is blank or can still turn into a `run_tool` command."""
+        line = line.lstrip()
+        return _CALL_PREFIX.startswith(line) or line.startswith(_CALL_PREFIX)
+
+    def _line(self, line: str, final: bool) -> List[Tuple[str, Dict[str, str]]]:
+        matches = list(_CALL_RE.finditer(line))
+        commands = [_command(match) for match in matches]
+        calls = [_parse_call(command) for command in commands if command]
+        if final and matches and commands[-1] is None and _TRUNCATED_RE.match(matches[-1].group(0).rstrip()):
+            self.errors.append(f"Incomplete tool command was not run: {matches[-1].group(0).strip()}")
+        if calls:
+            self.calls += calls
+        elif self.calls and line.strip():
+            self.finished = True
+        return calls
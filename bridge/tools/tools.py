@@ -3,16 +3,24 @@ import subprocess
 import os
 import platform
 import logging
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
 from .weapon import fire_laser, launch_missile
 #from .voice_control import VoiceControl
 #disabled in this version
 from typing import Callable, List, Optional, Dict, Any
 from dataclasses import dataclass
+from core import metrics, tracing
+from core.env import env_int
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
 # --- Tool Functions ---
+OPENER_TIMEOUT_S = 4.0  # the desktop opener is killed before open_notes' own 5 s tool timeout
 def open_notes() -> str:
     """Opens the Notes.txt file, attempting cross-platform compatibility."""
     notes_path = "\Clemm-0\bridge\tools\Captains_Log.txt"   #correct path 
@@ -20,10 +28,13 @@ def open_notes() -> str:
         if platform.system() == 'Windows':
             os.startfile(notes_path)
         elif platform.system() == 'Darwin':
-            subprocess.run(['open', notes_path])
+            run_subprocess(['open', notes_path], timeout=OPENER_TIMEOUT_S)
         else:
-            subprocess.run(['xdg-open', notes_path])
+            run_subprocess(['xdg-open', notes_path], timeout=OPENER_TIMEOUT_S)
         return "Successfully opened Captains_Log.txt."
+    except subprocess.TimeoutExpired:
+        logging.error("The file opener did not return within %s s; it was stopped.", OPENER_TIMEOUT_S)
+        return "Error: Opening Captains_Log.txt timed out."
     except FileNotFoundError:
         logging.error("Captains_Log.txt file not found at %s", notes_path)
         return "Error: Captains_Log.txt file not found."
@@ -57,38 +68,55 @@ def status_log(filename: str) -> str:
     except Exception as e:
         return f"Error reading file: {e}"
 
+# Execution classes: each has its own pool, so a hung subprocess never holds up quick file tools.
+#   io          threads (file and network access); a timed-out call cannot be stopped and finishes in the background
+#   subprocess  threads that wait on child processes started with run_subprocess; those are killed when the call times out
+#   cpu         worker processes (the function must be picklable; crew-dependent tools always run as io); not cancellable either
+EXECUTION_CLASSES = ("io", "subprocess", "cpu")
+
 @dataclass
 class Tool:
     description: str
     function: Callable[..., str]
     parameters: Optional[List[str]] = None
     crew_dependent: bool = False
+    execution: str = "io"  # one of EXECUTION_CLASSES
+    timeout_s: float = 10.0  # the caller gets a timeout error after this long
+    resource: Optional[str] = None  # calls of tools naming the same resource run one after another; None runs in parallel
 
 TOOL_LIST: Dict[str, Tool] = {
     "open_notes": Tool(
         description="Opens the Captains_Log.txt file for viewing.",
-        function=open_notes
+        function=open_notes,
+        execution="subprocess",
+        timeout_s=5.0
     ),
     "create_file": Tool(
         description="Creates a new text file. You can specify the filename and content.",
         function=create_new_file,
-        parameters=["filename", "content"]
+        parameters=["filename", "content"],
+        timeout_s=5.0,
+        resource="output_files"
     ),
     "fire_laser": Tool(
         description="Fires the laser weapon.",
         function=fire_laser,
-        parameters=["target", "power_level"]
+        parameters=["target", "power_level"],
+        timeout_s=2.0
     ),
     "launch_missile": Tool(
         description="Launches a missile.",
         function=launch_missile,
-        parameters=["target", "warhead_type"]
+        parameters=["target", "warhead_type"],
+        timeout_s=2.0
     ),
     # --- FIXED status_log DEFINITION ---
     "status_log": Tool(
         description="Reads the content of a text file from the output directory.",
         function=status_log,
-        parameters=["filename"] # <-- ADDED MISSING PARAMETER
+        parameters=["filename"], # <-- ADDED MISSING PARAMETER
+        timeout_s=5.0,
+        resource="output_files"
     )
     # "mainstream": Tool(
     #    description="Launches the Streamlit interface.",
@@ -109,13 +137,146 @@ def list_tools() -> List[str]:
     """Returns a list of available tool names."""
     return list(TOOL_LIST.keys())
 
-def run_tool(tool_name: str, crew_instance=None, model=None, **kwargs: Any) -> str:
-    """Runs a tool function by name, handling crew dependency."""
+def tool_resource(tool_name: str) -> Optional[str]:
+    """The resource a tool's calls are serialized on, or None if they may run in parallel with anything."""
+    tool = TOOL_LIST.get(tool_name)
+    return tool.resource if tool else None
+
+# --- Execution ---
+
+_pools: Dict[str, Any] = {}
+_pools_lock = threading.Lock()
+
+def _pool(name: str):
+    """The executor of an execution class (or 'process' behind 'cpu'), created on first use."""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            cpu_workers = env_int("TOOL_CPU_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+            if name == "process":
+                pool = ProcessPoolExecutor(max_workers=cpu_workers)
+            else:
+                workers = {"io": env_int("TOOL_IO_WORKERS", 8), "subprocess": env_int("TOOL_SUBPROCESS_WORKERS", 2), "cpu": cpu_workers}[name]
+                pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"tool-{name}")
+            _pools[name] = pool
+        return pool
+
+class _ChildProcesses:
+    """The child processes one tool call started through `run_subprocess`, killed together when it times out."""
+
+    def __init__(self):
+        self._processes = []
+        self._killed = False
+        self._lock = threading.Lock()
+
+    def add(self, process):
+        with self._lock:
+            self._processes.append(process)
+            if not self._killed:
+                return
+        process.kill()  # the call already timed out
+
+    def kill(self):
+        with self._lock:
+            self._killed = True
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+_children: contextvars.ContextVar = contextvars.ContextVar("tool_children", default=None)
+
+def run_subprocess(args, timeout=None) -> int:
+    """
+    `subprocess.run` for subprocess-class tools: the child is killed when the tool call times out,
+    not only when `timeout` expires (which raises `subprocess.TimeoutExpired`, like `subprocess.run`).
+    """
+    process = subprocess.Popen(args)
+    children = _children.get()
+    if children is not None:
+        children.add(process)
+    try:
+        return process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise
+
+class ToolRun:
+    """
+    One submitted tool call. `result()` waits until the tool's timeout, counted from submission
+    (plus the deadlines of the calls it waits for), and every call's latency goes to `core.metrics`.
+    A timed-out call's child processes are killed; io and cpu workers cannot be interrupted and finish in the background.
+    """
+
+    def __init__(self, tool_name: str, future: Future, timeout_s: float = 0.0, after=(), children=None):
+        self.tool_name = tool_name
+        self.future = future
+        self.timeout_s = timeout_s
+        self.children = children
+        self.started = time.monotonic()
+        self.deadline = max([run.deadline for run in after], default=self.started) + timeout_s
+        self._recorded = False
+        self._lock = threading.Lock()
+        if timeout_s:
+            future.add_done_callback(self._done)
+
+    @classmethod
+    def completed(cls, tool_name: str, text: str) -> "ToolRun":
+        """A call answered without running anything (unknown tool, missing crew); not recorded."""
+        future = Future()
+        future.set_result(text)
+        return cls(tool_name, future)
+
+    def _done(self, future):
+        if not future.cancelled():
+            self._record("error" if future.exception() else "ok", time.monotonic() - self.started)
+
+    def _record(self, outcome, seconds):
+        with self._lock:
+            if self._recorded:
+                return
+            self._recorded = True
+        metrics.record_tool(self.tool_name, seconds, outcome)
+
+    def result(self) -> str:
+        """The tool's return value. Raises what the tool raised, or TimeoutError once the deadline has passed."""
+        try:
+            return self.future.result(timeout=max(0.0, self.deadline - time.monotonic()))
+        except FutureTimeout:
+            self.future.cancel()  # still queued: never starts
+            if self.children is not None:
+                self.children.kill()  # frees the subprocess worker
+            self._record("timeout", time.monotonic() - self.started)
+            raise TimeoutError(f"Tool '{self.tool_name}' did not finish within {self.timeout_s:g} s") from None
+
+def _execute(tool_name: str, tool: Tool, execution: str, after, children, crew_instance, model, kwargs) -> str:
+    wait([run.future for run in after])
+    _children.set(children)
+    with tracing.span("run_tool", tool=tool_name, params=",".join(sorted(kwargs)), execution=execution):
+        if tool.crew_dependent:
+            return tool.function(crew_instance=crew_instance, model=model, **kwargs)
+        if execution == "cpu":
+            return _pool("process").submit(tool.function, **kwargs).result()
+        return tool.function(**kwargs)
+
+def submit_tool(tool_name: str, crew_instance=None, model=None, after=(), **kwargs: Any) -> ToolRun:
+    """
+    Starts a tool on the pool of its execution class and returns its `ToolRun` right away.
+    `after` lists earlier runs this call depends on; it starts once they have finished.
+    The caller's tracing context goes along, so the `run_tool` span nests where the call was made.
+    """
     tool = TOOL_LIST.get(tool_name)
     if not tool:
-        return f"Tool '{tool_name}' not found."
-    if tool.crew_dependent:
-        if crew_instance is None:
-            return "Error: This tool requires a crew instance."
-        return tool.function(crew_instance=crew_instance, model=model, **kwargs)
-    return tool.function(**kwargs)
+        return ToolRun.completed(tool_name, f"Tool '{tool_name}' not found.")
+    if tool.crew_dependent and crew_instance is None:
+        return ToolRun.completed(tool_name, "Error: This tool requires a crew instance.")
+    execution = "io" if tool.crew_dependent or tool.execution not in EXECUTION_CLASSES else tool.execution
+    children = _ChildProcesses() if execution == "subprocess" else None
+    future = _pool(execution).submit(contextvars.copy_context().run, _execute, tool_name, tool, execution, list(after),
+                                     children, crew_instance, model, kwargs)
+    return ToolRun(tool_name, future, tool.timeout_s, after, children)
+
+def run_tool(tool_name: str, crew_instance=None, model=None, **kwargs: Any) -> str:
+    """Runs a tool function by name, handling crew dependency, and waits for it up to the tool's timeout."""
+    return submit_tool(tool_name, crew_instance, model, **kwargs).result()
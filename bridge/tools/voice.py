@@ -5,19 +5,18 @@ import shutil
 import subprocess
 import time
 import webbrowser
-import wikipedia
-import pyttsx3
-import speech_recognition as sr
-import pyjokes
-import pyautogui
 import platform
+import importlib
 from typing import Optional, Dict, Callable
-from playwright.sync_api import sync_playwright
 from pathlib import Path
 from .weapon import fire_laser, launch_missile
 
+# pyttsx3, speech_recognition, wikipedia, pyjokes, pyautogui and playwright are heavy and optional:
+# each one is imported through `_lazy` by the method that needs it, so importing this module stays cheap.
+def _lazy(module_name: str):
+    """Imports an optional dependency on first use (cached in sys.modules afterwards)."""
+    return importlib.import_module(module_name)
 
-print("TEST1")
 
 class VoiceControl:
     """Complete voice control system merging Poe v0.01 with Clemm enhancements, cross-platform."""
@@ -25,6 +24,7 @@ class VoiceControl:
     def __init__(self):
         # Initialize text-to-speech engine with fallback
         try:
+            pyttsx3 = _lazy('pyttsx3')
             driver = 'sapi5' if platform.system() == 'Windows' else 'espeak'
             self.engine = pyttsx3.init(driver)
             voices = self.engine.getProperty('voices')
@@ -36,6 +36,7 @@ class VoiceControl:
             self.engine = None
         
         # Initialize speech recognizer
+        sr = _lazy('speech_recognition')
         self.recognizer = sr.Recognizer()
         
         # Initialize command registry
@@ -75,6 +76,7 @@ class VoiceControl:
     def listen(self) -> Optional[str]:
         """Listen for voice commands and convert to text (from Poe)."""
         try:
+            sr = _lazy('speech_recognition')
             with sr.Microphone() as source:
                 print("Listening...")
                 self.recognizer.pause_threshold = 1
@@ -106,7 +108,7 @@ class VoiceControl:
             'where is': self._handle_location_search,
             
             # Poe interaction commands
-            'tell joke': lambda _: self.speak(pyjokes.get_joke()),
+            'tell joke': lambda _: self.speak(_lazy('pyjokes').get_joke()),
             'how are you': lambda _: [self.speak("I am fine, thank you"), self.speak("How are you?")],
             'fine': lambda _: self.speak("It's good to know that you're fine"),
             'who made you': lambda _: self.speak("I have been created by Okan Bilge Öz"),
@@ -128,13 +130,13 @@ class VoiceControl:
             'show note': self._handle_note_reading,
             
             # Poe automation commands (using pyautogui)
-            'next': lambda _: [pyautogui.hotkey('shift', 'n')],
-            'full screen': lambda _: [time.sleep(3), pyautogui.press('f')]
+            'next': lambda _: [_lazy('pyautogui').hotkey('shift', 'n')],
+            'full screen': lambda _: [time.sleep(3), _lazy('pyautogui').press('f')]
         }
         
         # Add Windows-only command if on Windows
         if platform.system() == 'Windows':
-            commands['lock window'] = lambda _: ctypes.windll.user32.LockWorkStation()
+            commands['lock window'] = lambda _: _lazy('ctypes').windll.user32.LockWorkStation()
         else:
             commands['lock window'] = lambda _: self.speak("Locking the screen is not supported on this OS")
             
@@ -143,6 +145,7 @@ class VoiceControl:
     def _handle_wikipedia_search(self, command: str) -> str:
         """Handle Wikipedia search."""
         try:
+            wikipedia = _lazy('wikipedia')
             self.speak("Searching Wikipedia...")
             query = command.replace("wikipedia", "").strip()
             results = wikipedia.summary(query, sentences=3)
@@ -158,6 +161,7 @@ class VoiceControl:
     def _handle_web_search(self, command: str) -> str:
         """Handle web search with Playwright."""
         try:
+            sync_playwright = _lazy('playwright.sync_api').sync_playwright
             search_term = command.replace("search", "").strip()
             with sync_playwright() as p:
                 browser = p.chromium.launch()
@@ -174,6 +178,7 @@ class VoiceControl:
     def _handle_location_search(self, command: str) -> str:
         """Handle location search with Playwright."""
         try:
+            sync_playwright = _lazy('playwright.sync_api').sync_playwright
             location = command.replace("where is", "").strip()
             with sync_playwright() as p:
                 browser = p.chromium.launch()
@@ -334,4 +339,5 @@ if __name__ == "__main__":
     #os.system('cls' if os.name == 'nt' else 'clear')
     #control_system = initialize_voice_control()
     #control_system.run()
+    pass
     
\ No newline at end of file
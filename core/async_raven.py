@@ -0,0 +1,306 @@
+# core/async_raven.py
+
+import asyncio
+import json
+import ssl
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+import core.raven as raven
+
+# The local Llama object is not thread-safe, so all of its work runs on one dedicated thread.
+_local_executor = None
+_local_executor_lock = threading.Lock()
+
+
+def local_executor():
+    """Returns the single-thread executor that owns local GGUF work for the async API."""
+    global _local_executor
+    with _local_executor_lock:
+        if _local_executor is None:
+            _local_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="raven-local")
+        return _local_executor
+
+
+def model_executor(model_obj):
+    """Local work goes through the model's inference scheduler when it has one, so sync and async callers never overlap."""
+    return model_obj.get("scheduler") or local_executor()
+
+
+class AsyncServerTransport:
+    """
+    Minimal HTTP/1.1 client for llama-server built on asyncio streams (standard library only).
+    Keeps idle connections alive for reuse, so many conversations share a handful of sockets.
+    """
+
+    def __init__(self, base_url, connect_timeout=5.0, read_timeout=300.0, max_idle=8):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._loop = None
+
+    async def _connect(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Streams are bound to the loop that opened them.
+            self._idle = []
+            self._loop = loop
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.connect_timeout)
+        return reader, writer, False
+
+    def _release(self, reader, writer, reusable):
+        if reusable and len(self._idle) < self.max_idle:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _readline(self, reader):
+        return await asyncio.wait_for(reader.readline(), self.read_timeout)
+
+    async def _read_head(self, reader):
+        status_line = await self._readline(reader)
+        if not status_line:
+            raise ConnectionError("llama-server closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._readline(reader)
+            if line in (b"\r\n", b"\n", b""):
+                return status, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _send(self, method, path, payload):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        head = (f"{method} {self.base_path}{path} HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: keep-alive\r\n\r\n").encode("latin-1")
+        while True:
+            reader, writer, reused = await self._connect()
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                status, headers = await self._read_head(reader)
+                return reader, writer, status, headers
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; retry on a fresh one.
+
+    async def _body(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self._readline(reader)).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    while (await self._readline(reader)) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                data = await asyncio.wait_for(reader.readexactly(size + 2), self.read_timeout)
+                yield data[:-2]
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining > 0:
+                data = await asyncio.wait_for(reader.read(min(remaining, 65536)), self.read_timeout)
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(data)
+                yield data
+        else:
+            while True:
+                data = await asyncio.wait_for(reader.read(65536), self.read_timeout)
+                if not data:
+                    return
+                yield data
+
+    async def stream(self, method, path, payload=None):
+        """Sends a request and yields the response body as it arrives. Raises ConnectionError on HTTP errors."""
+        reader, writer, status, headers = await self._send(method, path, payload)
+        framed = "content-length" in headers or headers.get("transfer-encoding", "").lower() == "chunked"
+        complete = False
+        try:
+            if status >= 400:
+                detail = b"".join([chunk async for chunk in self._body(reader, headers)])
+                raise ConnectionError(f"llama-server returned HTTP {status}: {detail[:200].decode('utf-8', 'replace')}")
+            async for chunk in self._body(reader, headers):
+                yield chunk
+            complete = True
+        finally:
+            # A connection can only be reused when its response was read to the end.
+            reusable = complete and framed and headers.get("connection", "").lower() != "close"
+            self._release(reader, writer, reusable)
+
+    async def request_json(self, method, path, payload=None):
+        """Sends a request and returns the decoded JSON body."""
+        body = b"".join([chunk async for chunk in self.stream(method, path, payload)])
+        return json.loads(body)
+
+    async def health(self):
+        """True when /health reports status ok."""
+        try:
+            return (await self.request_json("GET", "/health")).get("status") == "ok"
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            return False
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+def transport(model_obj, client=None):
+    """
+    Returns the async transport to the server behind `client` (default: the model_obj's own server),
+    sharing the timeouts of that sync client. In pool mode each instance gets its own transport.
+    """
+    client = client or raven.server_client(model_obj)
+    transports = model_obj.setdefault("aclients", {})
+    aclient = transports.get(client.base_url)
+    if aclient is None:
+        aclient = transports[client.base_url] = AsyncServerTransport(client.base_url, *client.timeout)
+    return aclient
+
+
+async def _server_events(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name):
+    payload = raven.server_payload(messages, max_tokens, temperature, top_k, top_p, repetition_penalty)
+    # Leased like sync requests: in pool mode the least-loaded instance serves it and counts it in flight.
+    with raven.server_router(model_obj).lease(crew_name) as client:
+        payload.update(cache_prompt=True, id_slot=client.slot_for(crew_name), stream=True)
+        buffer = b""
+        async for chunk in transport(model_obj, client).stream("POST", "/completion", payload):
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                line = line.strip()
+                if line.startswith(b"data: "):
+                    yield json.loads(line[6:])
+
+
+async def _local_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    finished = object()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for chunk in raven.local_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty,
+                                            crew_name):
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    loop.run_in_executor(model_executor(model_obj), produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+
+async def astream_response(model_obj, messages, max_tokens=72, temperature=0.8, top_k=50, top_p=0.95,
+                           repetition_penalty=1.15, crew_name=None):
+    """Async iterator over response text chunks. Stopping the iteration stops generation."""
+    if model_obj["type"] == "llamacpp_server":
+        async for event in _server_events(model_obj, messages, max_tokens, temperature, top_k, top_p,
+                                          repetition_penalty, crew_name):
+            if event.get("content"):
+                yield event["content"]
+    else:  # programmatic_gguf
+        async for chunk in _local_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p,
+                                         repetition_penalty, crew_name):
+            yield chunk
+
+
+async def agenerate_response(model_obj, messages, max_tokens=72, temperature=0.8, top_k=50, top_p=0.95,
+                             repetition_penalty=1.15, crew_name=None):
+    """Async counterpart of `raven.generate_response`. Returns the response text, or None on errors."""
+    if model_obj["type"] == "llamacpp_server":
+        payload = raven.server_payload(messages, max_tokens, temperature, top_k, top_p, repetition_penalty)
+        try:
+            with raven.server_router(model_obj).lease(crew_name) as client:
+                payload.update(cache_prompt=True, id_slot=client.slot_for(crew_name), stream=False)
+                result = await transport(model_obj, client).request_json("POST", "/completion", payload)
+            return result["content"].strip()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            print(f"\nError communicating with llamacpp server: {e}")
+            return None
+        except (ValueError, KeyError) as e:
+            print(f"\nError decoding server response: {e}")
+            return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(model_executor(model_obj), partial(
+        raven.generate_response, model_obj, messages, max_tokens, temperature, top_k, top_p,
+        repetition_penalty, False, crew_name))
+
+
+async def aactivate_raven(backend='cuda', max_wait_time=60):
+    """
+    Async counterpart of `raven.activate_raven`.
+    The server readiness wait yields to the event loop instead of sleeping the thread.
+    """
+    load_dotenv()
+    loop = asyncio.get_running_loop()
+    if backend != 'server':
+        return await loop.run_in_executor(local_executor(), raven.activate_raven, backend)
+
+    launch = raven.server_launch_command()
+    if not launch:
+        return None
+    command, server_url = launch
+
+    print("Starting LlamaCPP server as a background process...")
+    server_process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    print(f"Waiting for server to become available at {server_url}...")
+
+    model_obj = {"url": server_url, "type": "llamacpp_server", "process": server_process}
+    aclient = transport(model_obj)
+    deadline = loop.time() + max_wait_time
+    while loop.time() < deadline:
+        if await aclient.health():
+            print("Server is online and healthy!")
+            break
+        await asyncio.sleep(1)
+    else:
+        print(f"ERROR: Server failed to start within {max_wait_time} seconds.")
+        print(f"       {' '.join(command)}")
+        server_process.terminate()
+        aclient.close()
+        return None
+
+    client = raven.server_client(model_obj)
+    try:
+        props = await aclient.request_json("GET", "/props")
+        client.set_slot_count(int(props.get("total_slots", 1)))
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, TypeError):
+        pass
+    # Sync callers (Crew.chat) sharing this model_obj still queue through a scheduler.
+    return raven.attach_scheduler(model_obj, workers=raven.env_int("SCHEDULER_SERVER_WORKERS", client.n_slots))
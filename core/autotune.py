@@ -0,0 +1,259 @@
+# core/autotune.py
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import time
+
+from dotenv import load_dotenv
+
+from core.env import env_int, env_str
+from core.kv_cache import model_fingerprint
+
+# Benchmarks llama load parameters for one GGUF on this machine and stores the winner,
+# keyed by model fingerprint and CPU signature. load_gguf_model and the llama-server
+# command line pick the stored profile up on their own.
+#
+#   python -m core.autotune [--model PATH] [--threads 4,8] [--batch 128,256,512]
+
+DEFAULT_PROFILE_PATH = "cache/autotune.json"
+_BENCH_TEXT = ("The Clemm is a cargo freighter with a weaponized edge. Raven keeps the ship flying, "
+               "tracks every system on board and trades sarcastic banter with the crew. ")
+
+
+def _cpuinfo():
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def physical_cores():
+    """Number of physical cores (hyperthread siblings counted once); falls back to the logical count."""
+    cores = set()
+    physical_id = None
+    for line in _cpuinfo().splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if key == "physical id":
+            physical_id = value.strip()
+        elif key == "core id":
+            cores.add((physical_id, value.strip()))
+    return len(cores) or os.cpu_count() or 1
+
+
+def physical_core_cpus():
+    """
+    One logical CPU id per physical core (the first hyperthread sibling), limited to the CPUs this
+    process may run on. Empty when the topology is unknown (no /proc/cpuinfo, e.g. Windows).
+    """
+    allowed = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    first_sibling = {}
+    cpu = physical_id = None
+    for line in _cpuinfo().splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if key == "processor":
+            cpu, physical_id = int(value), None
+        elif key == "physical id":
+            physical_id = value.strip()
+        elif key == "core id" and cpu is not None and (allowed is None or cpu in allowed):
+            first_sibling.setdefault((physical_id, value.strip()), cpu)
+    return sorted(first_sibling.values())
+
+
+def cpu_signature():
+    """Short identity of the CPU model, core counts and the llama.cpp build features it runs with."""
+    model_name = platform.processor()
+    for line in _cpuinfo().splitlines():
+        if line.startswith("model name"):
+            model_name = line.partition(":")[2].strip()
+            break
+    try:
+        import llama_cpp
+        features = llama_cpp.llama_print_system_info().decode("utf-8", "replace")
+    except Exception:
+        features = ""
+    identity = f"{platform.system()}|{platform.machine()}|{model_name}|{os.cpu_count()}|{physical_cores()}|{features}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:12]
+
+
+def profile_path():
+    return env_str("AUTOTUNE_PROFILE_PATH", DEFAULT_PROFILE_PATH)
+
+
+def profile_key(model_path):
+    return f"{model_fingerprint(model_path)}:{cpu_signature()}"
+
+
+def _read_profiles(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_profile(model_path):
+    """Returns the tuned load parameters for `model_path` on this machine, or None if it was never tuned."""
+    if not model_path or not os.path.exists(model_path):
+        return None
+    entry = _read_profiles(profile_path()).get(profile_key(model_path))
+    return entry.get("params") if entry else None
+
+
+def save_profile(model_path, params, measurements):
+    path = profile_path()
+    profiles = _read_profiles(path)
+    profiles[profile_key(model_path)] = {
+        "model": os.path.abspath(model_path),
+        "params": params,
+        "measurements": measurements,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def server_args(profile):
+    """llama-server flags for a tuned profile."""
+    if not profile:
+        return []
+    args = ["-t", str(profile["n_threads"]), "-tb", str(profile["n_threads_batch"]),
+            "-b", str(profile["n_batch"]), "-ub", str(profile["n_ubatch"])]
+    if profile.get("flash_attn"):
+        args.append("-fa")
+    if profile.get("use_mlock"):
+        args.append("--mlock")
+    if profile.get("use_mmap") is False:
+        args.append("--no-mmap")
+    return args
+
+
+def _bench_tokens(model, n):
+    tokens = model.tokenize((_BENCH_TEXT * (n // 20 + 1)).encode("utf-8"), add_bos=True)
+    return tokens[:n]
+
+
+def measure(model, prompt_tokens=256, gen_tokens=32):
+    """
+    Measures prefill and decode speed (tokens/s) on a loaded model, leaving its context empty.
+    Decode feeds one token per step, which is what generation costs without sampling overhead.
+    """
+    tokens = _bench_tokens(model, min(prompt_tokens, model.n_ctx() - gen_tokens - 1))
+    model.eval(tokens[:8])  # warm-up: first graph build and page-in
+    model.reset()
+
+    start = time.perf_counter()
+    model.eval(tokens)
+    prefill_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(gen_tokens):
+        model.eval([tokens[-1]])
+    decode_s = time.perf_counter() - start
+    model.reset()
+    return {"prompt_tokens": len(tokens), "prefill_ms": round(prefill_s * 1000, 1),
+            "prefill_tps": round(len(tokens) / prefill_s, 2), "decode_tps": round(gen_tokens / decode_s, 2)}
+
+
+def benchmark(model_path, n_threads, n_batch, flash_attn=False, n_gpu_layers=-1, n_ctx=1024,
+              prompt_tokens=256, gen_tokens=32):
+    """Loads the model with the given parameters and measures it with `measure`."""
+    from llama_cpp import Llama
+
+    model = Llama(model_path=model_path, n_gpu_layers=n_gpu_layers, n_ctx=n_ctx, n_batch=n_batch,
+                  n_ubatch=n_batch, n_threads=n_threads, n_threads_batch=n_threads,
+                  flash_attn=flash_attn, use_mmap=True, verbose=False)
+    try:
+        speed = measure(model, prompt_tokens, gen_tokens)
+    finally:
+        model.close()
+    return {"n_threads": n_threads, "n_batch": n_batch, "flash_attn": flash_attn,
+            "prefill_tps": speed["prefill_tps"], "decode_tps": speed["decode_tps"]}
+
+
+def pick_profile(results):
+    """
+    Prefill speed depends on the batch thread count and batch size, decode speed on the
+    generation thread count, so each is chosen from the runs that measured it best.
+    """
+    best_prefill = max(results, key=lambda r: r["prefill_tps"])
+    best_decode = max(results, key=lambda r: r["decode_tps"])
+    return {
+        "n_threads": best_decode["n_threads"],
+        "n_threads_batch": best_prefill["n_threads"],
+        "n_batch": best_prefill["n_batch"],
+        "n_ubatch": best_prefill["n_batch"],
+        "flash_attn": best_prefill["flash_attn"],
+        "use_mmap": True,
+        "use_mlock": False,
+    }
+
+
+def default_threads():
+    logical = os.cpu_count() or 1
+    physical = physical_cores()
+    return sorted({max(1, physical // 2), physical, logical})
+
+
+def autotune(model_path, threads=None, batches=(128, 256, 512), flash_attn=(False, True), n_gpu_layers=-1,
+             n_ctx=1024, prompt_tokens=256, gen_tokens=32):
+    """Runs the benchmark grid, prints the results and saves the best profile. Returns the profile."""
+    threads = threads or default_threads()
+    results = []
+    print(f"Autotuning {os.path.basename(model_path)} on CPU {cpu_signature()} "
+          f"(threads {threads}, batches {list(batches)}, flash_attn {list(flash_attn)})")
+    print(f"{'threads':>7} {'batch':>6} {'fa':>3} {'prefill t/s':>12} {'decode t/s':>11}")
+    for fa in flash_attn:
+        for n_threads in threads:
+            for n_batch in batches:
+                try:
+                    result = benchmark(model_path, n_threads, n_batch, fa, n_gpu_layers, n_ctx, prompt_tokens, gen_tokens)
+                except Exception as e:
+                    print(f"{n_threads:>7} {n_batch:>6} {int(fa):>3}  failed: {e}")
+                    continue
+                results.append(result)
+                print(f"{n_threads:>7} {n_batch:>6} {int(fa):>3} {result['prefill_tps']:>12.1f} {result['decode_tps']:>11.1f}")
+    if not results:
+        print("Autotune: every configuration failed; no profile saved.")
+        return None
+    profile = pick_profile(results)
+    path = save_profile(model_path, profile, results)
+    print(f"Best profile: {profile}")
+    print(f"Saved to {path}")
+    return profile
+
+
+def _int_list(text):
+    return [int(part) for part in text.split(",") if part.strip()]
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="python -m core.autotune", description="Tune llama load parameters for this machine.")
+    parser.add_argument("--model", default=env_str("RAVEN_GGUF_MODEL_PATH"), help="GGUF file (default: RAVEN_GGUF_MODEL_PATH)")
+    parser.add_argument("--threads", type=_int_list, help="comma-separated thread counts (default: half the cores, cores, logical CPUs)")
+    parser.add_argument("--batch", type=_int_list, default=[128, 256, 512], help="comma-separated n_batch values")
+    parser.add_argument("--no-flash-attn", action="store_true", help="only benchmark without flash attention")
+    parser.add_argument("--gpu-layers", type=int, default=-1, help="n_gpu_layers (0 for CPU-only nodes)")
+    parser.add_argument("--ctx", type=int, default=env_int("CONTEXT_SIZE", 1024))
+    parser.add_argument("--prompt-tokens", type=int, default=256)
+    parser.add_argument("--gen-tokens", type=int, default=32)
+    args = parser.parse_args(argv)
+    if not args.model or not os.path.exists(args.model):
+        parser.error(f"GGUF model not found: {args.model}")
+    profile = autotune(args.model, args.threads, args.batch, (False,) if args.no_flash_attn else (False, True),
+                       args.gpu_layers, args.ctx, args.prompt_tokens, args.gen_tokens)
+    return 0 if profile else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,428 @@
+# core/batch_engine.py
+
+import codecs
+import ctypes
+import queue
+import threading
+import time
+from collections import deque
+
+from core.env import env_int
+from core.lora import LoraAdapters
+from core.model_registry import kv_cache_bytes
+
+# Several generations share one llama.cpp context of the loaded model: each runs as its own sequence id
+# with its own KV region, and one engine thread advances all of them with a single `llama_decode` per step
+# (continuous batching). Requests join between steps and leave as soon as they finish.
+# A slot keeps the tokens its KV region holds, so a request sharing a prefix with them (the same crew's
+# next turn, or any crew's system prompt) only evaluates what is new.
+
+PENALTY_LAST_N = 64  # tokens the repeat penalty looks back on, as Llama.__call__ does
+
+
+class _Slot:
+    """One sequence id of the context and the tokens evaluated into its KV region."""
+
+    def __init__(self, seq_id):
+        self.seq_id = seq_id
+        self.tokens = []
+        self.request = None
+        self.last_used = 0.0
+
+
+class _Request:
+    """One generation: prompt, sampling settings, decoding state and the queue its text is streamed through."""
+
+    def __init__(self, tokens, max_tokens, temperature, top_k, top_p, repeat_penalty, stop, grammar, lora):
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repeat_penalty = repeat_penalty
+        self.stop = [s for s in stop if s]
+        self.grammar = grammar
+        self.lora = tuple(lora) if lora else None
+        self.out = queue.Queue()  # text pieces, then None (or an exception) when the generation ends
+        self.cancelled = False
+        self.usage = {}
+        self.slot = None
+        self.sampler = None
+        self.feed = []  # tokens to evaluate in the next steps: the rest of the prompt, then each sampled token
+        self.n_cached = 0
+        self.n_generated = 0
+        self.text = ""
+        self.emitted = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.admitted = None
+        self.first_token = None
+
+
+class BatchEngine:
+    """
+    Continuous-batching decoder over one llama.cpp context with `n_seq` sequences of `n_ctx_seq` tokens each,
+    for the in-process backend. `stream` is safe to call from any number of threads; the calls run side by side.
+    LoRA adapters apply to the whole context, so requests for another adapter wait until the running ones finish.
+    """
+
+    def __init__(self, model, n_seq, n_ctx_seq=None):
+        import llama_cpp
+
+        self.model = model
+        self.n_seq = n_seq
+        params = llama_cpp.llama_context_default_params()
+        source = model.context_params
+        for field in ("n_batch", "n_ubatch", "n_threads", "n_threads_batch", "type_k", "type_v", "offload_kqv", "flash_attn",
+                      "rope_freq_base", "rope_freq_scale"):
+            setattr(params, field, getattr(source, field))
+        params.n_ctx = (n_ctx_seq or model.n_ctx()) * n_seq
+        params.n_seq_max = n_seq
+        self.ctx = llama_cpp.llama_init_from_model(model.model, params)
+        if not self.ctx:
+            raise RuntimeError(f"could not create a context of {params.n_ctx} tokens for {n_seq} sequences")
+        self.n_ctx_seq = llama_cpp.llama_n_ctx(self.ctx) // n_seq
+        self.n_batch = params.n_batch
+        self._memory = llama_cpp.llama_get_memory(self.ctx)
+        self._vocab = llama_cpp.llama_model_get_vocab(model.model)
+        self._batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+        self._piece = ctypes.create_string_buffer(64)
+        self.lora = LoraAdapters(self.ctx)
+        self._lora_key = None  # adapter the running group of requests decodes with
+        self._slots = [_Slot(seq_id) for seq_id in range(n_seq)]
+        self._waiting = deque()
+        self._active = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self.steps = 0
+        self.batched_tokens = 0
+        self.batched_sequences = 0
+        self.finished = 0
+        self.failed = 0
+        self.reused_tokens = 0
+        self._thread = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+        self._thread.start()
+
+    # --- Callers ---
+
+    def stream(self, prompt, max_tokens, temperature=0.8, top_k=50, top_p=0.95, repeat_penalty=1.15, stop=(), grammar=None,
+               lora=None, usage=None):
+        """
+        Yields text chunks of one generation as the engine decodes them. Closing the iterator ends the sequence.
+        Generation stops at an end-of-generation token, the first `stop` string (not included) or `max_tokens`.
+        `grammar` is GBNF text, `lora` an `(adapter path, scale)` pair; `usage` (a dict) receives token counts and timings.
+        """
+        tokens = self.model.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+        if len(tokens) >= self.n_ctx_seq:
+            raise ValueError(f"prompt of {len(tokens)} tokens does not fit the {self.n_ctx_seq}-token sequence context")
+        request = _Request(tokens, min(max_tokens, self.n_ctx_seq - len(tokens)), temperature, top_k, top_p, repeat_penalty,
+                           stop, grammar, lora)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("batch engine is closed")
+            self._waiting.append(request)
+            self._cond.notify()
+        done = False
+        try:
+            while True:
+                item = request.out.get()
+                if item is None:
+                    done = True
+                    return
+                if isinstance(item, Exception):
+                    done = True
+                    raise item
+                yield item
+        finally:
+            if not done:
+                request.cancelled = True  # the engine drops the sequence before its next step
+            if usage is not None:
+                usage.update(request.usage)
+
+    def generate(self, prompt, max_tokens, **kwargs):
+        """Whole text of one generation (see `stream`)."""
+        return "".join(self.stream(prompt, max_tokens, **kwargs))
+
+    # --- Engine thread ---
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._waiting and not self._active:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                self._admit()
+            try:
+                self._step()
+            except Exception as e:
+                for request in list(self._active):
+                    self._fail(request, e)
+
+    def _admit(self):
+        """Moves waiting requests onto free slots, in arrival order."""
+        while self._waiting:
+            request = self._waiting[0]
+            if request.cancelled:
+                self._waiting.popleft()
+                request.out.put(None)
+                continue
+            if self._active and request.lora != self._lora_key:
+                return  # another adapter: wait until the running group has finished
+            slot = self._free_slot(request.tokens)
+            if slot is None:
+                return
+            self._waiting.popleft()
+            try:
+                self._start(request, slot)
+            except Exception as e:
+                self._fail(request, e)
+
+    def _free_slot(self, tokens):
+        """The idle slot whose evaluated tokens share the longest prefix with `tokens`; least recently used on ties."""
+        free = [slot for slot in self._slots if slot.request is None]
+        if not free:
+            return None
+        return max(free, key=lambda slot: (_common_prefix(slot.tokens, tokens), -slot.last_used))
+
+    def _start(self, request, slot):
+        import llama_cpp
+
+        if request.lora != self._lora_key:
+            if self.lora.apply(self.model, request.lora):
+                # Every KV region was evaluated under the previous weights.
+                llama_cpp.llama_memory_clear(self._memory, True)
+                for other in self._slots:
+                    other.tokens = []
+            self._lora_key = request.lora
+        # Keep the shared prefix; at least the last prompt token is evaluated again for its logits.
+        n_keep = min(_common_prefix(slot.tokens, request.tokens), len(request.tokens) - 1)
+        if n_keep < len(slot.tokens) and not llama_cpp.llama_memory_seq_rm(self._memory, slot.seq_id, n_keep, -1):
+            llama_cpp.llama_memory_seq_rm(self._memory, slot.seq_id, -1, -1)
+            n_keep = 0
+        del slot.tokens[n_keep:]
+        request.sampler = self._sampler(request)
+        request.slot = slot
+        request.feed = request.tokens[n_keep:]
+        request.n_cached = n_keep
+        request.admitted = time.perf_counter()
+        slot.request = request
+        self.reused_tokens += n_keep
+        self._active.append(request)
+
+    def _sampler(self, request):
+        """Sampler chain of one request: grammar, repeat penalty, then greedy or top-k/top-p/temperature sampling."""
+        import llama_cpp
+
+        chain = llama_cpp.llama_sampler_chain_init(llama_cpp.llama_sampler_chain_default_params())
+        if request.grammar:
+            grammar = llama_cpp.llama_sampler_init_grammar(self._vocab, request.grammar.encode("utf-8"), b"root")
+            if not grammar:
+                llama_cpp.llama_sampler_free(chain)
+                raise ValueError("invalid grammar")
+            llama_cpp.llama_sampler_chain_add(chain, grammar)
+        penalties = llama_cpp.llama_sampler_init_penalties(PENALTY_LAST_N, request.repeat_penalty, 0.0, 0.0)
+        for token in request.tokens[-PENALTY_LAST_N:]:
+            llama_cpp.llama_sampler_accept(penalties, token)
+        llama_cpp.llama_sampler_chain_add(chain, penalties)
+        if request.temperature <= 0:
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_greedy())
+        else:
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_top_k(request.top_k))
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_top_p(request.top_p, 1))
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_temp(request.temperature))
+            llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_dist(llama_cpp.LLAMA_DEFAULT_SEED))
+        return chain
+
+    def _step(self):
+        """One `llama_decode` over every active sequence: one token for those decoding, prompt chunks for the rest."""
+        import llama_cpp
+
+        for request in [r for r in self._active if r.cancelled]:
+            self._finish(request, emit=False)
+        if not self._active:
+            return
+        batch, n, sampled = self._batch, 0, []
+        # Decoding sequences first, so prefilling a long prompt never stalls the ones already answering.
+        for request in sorted(self._active, key=lambda r: len(r.feed)):
+            take = min(len(request.feed), self.n_batch - n)
+            if take <= 0:
+                break
+            slot = request.slot
+            for token in request.feed[:take]:
+                batch.token[n] = token
+                batch.pos[n] = len(slot.tokens)
+                batch.n_seq_id[n] = 1
+                batch.seq_id[n][0] = slot.seq_id
+                batch.logits[n] = False
+                slot.tokens.append(token)
+                n += 1
+            del request.feed[:take]
+            if not request.feed:
+                batch.logits[n - 1] = True
+                sampled.append((request, n - 1))
+        batch.n_tokens = n
+        status = llama_cpp.llama_decode(self.ctx, batch)
+        if status != 0:
+            raise RuntimeError(f"llama_decode failed with status {status} for a batch of {n} tokens")
+        self.steps += 1
+        self.batched_tokens += n
+        self.batched_sequences += len(sampled)
+        for request, index in sampled:
+            self._accept(request, llama_cpp.llama_sampler_sample(request.sampler, self.ctx, index))
+
+    def _accept(self, request, token):
+        import llama_cpp
+
+        if request.first_token is None:
+            request.first_token = time.perf_counter()
+        request.n_generated += 1
+        if llama_cpp.llama_vocab_is_eog(self._vocab, token):
+            return self._finish(request)
+        request.text += request.decoder.decode(self._token_bytes(token))
+        for stop in request.stop:
+            cut = request.text.find(stop, max(0, request.emitted - len(stop)))
+            if cut >= 0:
+                request.text = request.text[:cut]
+                return self._finish(request)
+        if request.n_generated >= request.max_tokens or len(request.slot.tokens) + 1 >= self.n_ctx_seq:
+            return self._finish(request)
+        # Hold back a tail that may be the start of a stop string.
+        safe = len(request.text) - max((_stop_overlap(request.text, stop) for stop in request.stop), default=0)
+        if safe > request.emitted:
+            request.out.put(request.text[request.emitted:safe])
+            request.emitted = safe
+        request.feed = [token]
+
+    def _token_bytes(self, token):
+        import llama_cpp
+
+        n = llama_cpp.llama_token_to_piece(self._vocab, token, self._piece, len(self._piece), 0, False)
+        if n < 0:
+            self._piece = ctypes.create_string_buffer(-n)
+            n = llama_cpp.llama_token_to_piece(self._vocab, token, self._piece, len(self._piece), 0, False)
+        return self._piece.raw[:n]
+
+    def _finish(self, request, emit=True):
+        if emit:
+            request.text += request.decoder.decode(b"", final=True)
+            if len(request.text) > request.emitted:
+                request.out.put(request.text[request.emitted:])
+                request.emitted = len(request.text)
+        now = time.perf_counter()
+        first = request.first_token or now
+        request.usage.update({
+            "prompt_tokens": len(request.tokens),
+            "cached_tokens": request.n_cached,
+            "completion_tokens": request.n_generated,
+            "prefill_ms": (first - request.admitted) * 1000,
+            "decode_ms": (now - first) * 1000,
+        })
+        self._release(request)
+        self.finished += 1
+        request.out.put(None)
+
+    def _fail(self, request, error):
+        import llama_cpp
+
+        if request.slot is not None:
+            # Whatever this batch evaluated into the slot is unreliable now.
+            llama_cpp.llama_memory_seq_rm(self._memory, request.slot.seq_id, -1, -1)
+            request.slot.tokens = []
+            self._release(request)
+        self.failed += 1
+        request.out.put(error)
+
+    def _release(self, request):
+        import llama_cpp
+
+        if request.sampler is not None:
+            llama_cpp.llama_sampler_free(request.sampler)
+            request.sampler = None
+        if request in self._active:
+            self._active.remove(request)
+        request.slot.request = None
+        request.slot.last_used = time.monotonic()
+
+    # --- Bookkeeping ---
+
+    def memory_bytes(self):
+        """KV cache of all sequences (the weights belong to the model)."""
+        return kv_cache_bytes(self.model, self.n_seq * self.n_ctx_seq)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "sequences": self.n_seq,
+                "n_ctx_seq": self.n_ctx_seq,
+                "active": len(self._active),
+                "waiting": len(self._waiting),
+                "steps": self.steps,
+                "tokens_per_step": self.batched_tokens / self.steps if self.steps else 0.0,
+                "sequences_per_step": self.batched_sequences / self.steps if self.steps else 0.0,
+                "reused_tokens": self.reused_tokens,
+                "finished": self.finished,
+                "failed": self.failed,
+            }
+
+    def report(self):
+        """One-line summary for the console and UI."""
+        s = self.stats()
+        return (f"Batch engine: {s['sequences']} sequences x {s['n_ctx_seq']} tokens, {s['active']} active, {s['waiting']} waiting, "
+                f"{s['steps']} steps ({s['tokens_per_step']:.1f} tokens, {s['sequences_per_step']:.1f} sequences each), "
+                f"{s['reused_tokens']} prompt tokens reused, {s['finished']} done, {s['failed']} failed")
+
+    def close(self):
+        """Stops the engine thread, ends pending requests with an error and frees the context."""
+        import llama_cpp
+
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        error = RuntimeError("batch engine is closed")
+        for request in list(self._active) + list(self._waiting):
+            if request.slot is not None:
+                self._release(request)
+            request.out.put(error)
+        self._waiting.clear()
+        llama_cpp.llama_batch_free(self._batch)
+        llama_cpp.llama_free(self.ctx)
+        self.ctx = None
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+def _stop_overlap(text, stop):
+    """Length of the longest tail of `text` that is a proper prefix of `stop`."""
+    for k in range(min(len(stop) - 1, len(text)), 0, -1):
+        if text.endswith(stop[:k]):
+            return k
+    return 0
+
+
+def open_batch_engine(model):
+    """
+    Batch engine over `model` when LOCAL_BATCH_SEQUENCES asks for more than one sequence, else None.
+    Each sequence gets CONTEXT_SIZE tokens of its own KV cache; `model` may be loaded with a smaller context,
+    which then only serves tokenizing.
+    Env: LOCAL_BATCH_SEQUENCES, CONTEXT_SIZE
+    """
+    n_seq = env_int("LOCAL_BATCH_SEQUENCES", 1)
+    if n_seq <= 1:
+        return None
+    try:
+        engine = BatchEngine(model, n_seq, env_int("CONTEXT_SIZE", 4096))
+    except Exception as e:
+        print(f"WARNING: Batch engine unavailable ({e}); local generations run one at a time.")
+        return None
+    print(f"Batch engine: {engine.n_seq} sequences of {engine.n_ctx_seq} tokens decode together "
+          f"({engine.memory_bytes() / 2**20:.0f} MB KV cache).")
+    return engine
@@ -0,0 +1,282 @@
+# core/bench.py
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+
+import core.raven as raven
+from core import autotune
+from core.env import env_str
+from core.server_client import LlamaServerClient
+
+# End-to-end inference benchmark through the same paths the app uses
+# (`raven.generate_response` and `Crew.chat`), with a stored baseline per backend.
+#
+#   python -m core.bench --backend cpu                      # compare with the baseline (saved on first run)
+#   python -m core.bench --url http://127.0.0.1:8080 --save # running llama-server, overwrite its baseline
+#
+# Exit status 1 means at least one metric regressed by more than --threshold.
+
+DEFAULT_BASELINE_PATH = "cache/bench_baseline.json"
+SCENARIOS = ("cold_first_turn", "tenth_turn", "tool_command", "creative_long_form")
+# Lower is better for times, higher for speeds.
+METRICS = {"ttft_ms": -1, "prefill_tps": 1, "decode_tps": 1, "latency_p50_ms": -1, "latency_p95_ms": -1}
+# Set before the backend starts, so no model_obj it builds (the main model or a registry model a crew loads on
+# demand) memoizes replies: greedy repeats would measure the caches, not inference.
+NO_MEMO_ENV = {"RESPONSE_CACHE_ENABLED": "0", "SEMANTIC_CACHE_ENABLED": "0"}
+
+_HISTORY = [
+    ("What's our heading?", "Same as always: wherever you point us, Meat Bag. Currently 042 mark 7."),
+    ("How are the engines?", "Purring. Mostly. The port thruster coughs when you look at it wrong."),
+    ("Any ships nearby?", "Two freighters and a customs buoy that really wants to talk to us."),
+    ("Ignore the buoy.", "Already did. It's sulking in my logs."),
+    ("What's in the cargo hold?", "Medical supplies, spare coils and your embarrassing collection of holo-novels."),
+    ("Run a hull scan.", "Hull integrity 97%. The dent from your 'perfect landing' is still there."),
+    ("Plot a course to the station.", "Course plotted. ETA forty minutes if you don't touch anything."),
+    ("Can we go faster?", "We can. We won't. The coils would melt and you'd blame me."),
+    ("Fine. Keep the speed.", "Wise choice. I knew you'd come around."),
+]
+
+
+class Probe:
+    """`on_token` callback that timestamps the first and last chunk of one turn."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first = None
+        self.last = None
+        self.n_chunks = 0
+
+    def __call__(self, chunk):
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.n_chunks += 1
+
+    def result(self, prompt_tokens):
+        latency = time.perf_counter() - self.started
+        if self.first is None:
+            return {"ttft": latency, "latency": latency, "tokens": 0, "prefill_tps": 0.0, "decode_tps": 0.0}
+        ttft = self.first - self.started
+        decode_s = self.last - self.first
+        return {
+            "ttft": ttft,
+            "latency": latency,
+            "tokens": self.n_chunks,
+            "prefill_tps": prompt_tokens / ttft if ttft > 0 else 0.0,
+            "decode_tps": (self.n_chunks - 1) / decode_s if self.n_chunks > 1 and decode_s > 0 else 0.0,
+        }
+
+
+def _prompt_tokens(model_obj, messages):
+    try:
+        return raven.count_tokens(model_obj, raven.format_prompt(messages))
+    except Exception:
+        return 0
+
+
+def _bench_crews(model_obj, max_tokens, long_tokens):
+    """The app's own crews, greedy so runs are comparable; tool_crew may only use the read-only status_log."""
+    from bridge.crew import initialize_crew
+
+    crews = initialize_crew(model_obj, max_tokens)
+    for crew in crews.values():
+        crew.temperature = 0.0
+    crews["captain_raven"].max_tokens = max_tokens
+    crews["tool_crew"].available_tools = ["status_log"]
+    crews["creative_writer"].max_tokens = long_tokens
+    return crews
+
+
+def _crew_turn(model_obj, crew, text, history=()):
+    crew.reset()
+    for question, answer in history:
+        crew.context.append({"role": "user", "content": question})
+        crew.context.append({"role": "assistant", "content": answer})
+    prompt_tokens = _prompt_tokens(model_obj, crew.messages + [{"role": "user", "content": text}])
+    probe = Probe()
+    crew.chat(text, on_token=probe)
+    return probe.result(prompt_tokens)
+
+
+def cold_model(model_obj):
+    """`model_obj` without the caches that resume an evaluated prompt: prefix KV cache, crew snapshots, memo stores."""
+    return dict(model_obj, prefix_cache=None, crew_states=None, response_cache=None, semantic_cache=None)
+
+
+def cold_messages(run_id):
+    """Raven persona plus one question, behind a first line unique to `run_id`: no KV cache, engine sequence
+    or llama-server slot (`cache_prompt`) holds any prefix of it, so the whole prompt is evaluated."""
+    return [{"role": "system", "content": f"Benchmark run {run_id}.\n{raven.get_raven_prompt()}"},
+            {"role": "user", "content": "Status report, Raven."}]
+
+
+def run_scenario(name, model_obj, crews, max_tokens):
+    """Runs one turn of scenario `name` and returns its raw measurements."""
+    if name == "cold_first_turn":
+        run_id = time.perf_counter_ns()
+        messages = cold_messages(run_id)
+        probe = Probe()
+        raven.generate_response(cold_model(model_obj), messages, max_tokens, temperature=0.0, crew_name=f"bench-{run_id}", on_token=probe)
+        return probe.result(_prompt_tokens(model_obj, messages))
+    if name == "tenth_turn":
+        return _crew_turn(model_obj, crews["captain_raven"], "Give me a full status summary before we dock.", _HISTORY)
+    if name == "tool_command":
+        return _crew_turn(model_obj, crews["tool_crew"], "What is the status of the 'bench_log.txt' file?")
+    if name == "creative_long_form":
+        return _crew_turn(model_obj, crews["creative_writer"],
+                          "Write a long story about the Clemm's first smuggling run through an asteroid field.")
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(samples):
+    """Collapses the runs of one scenario into the stored metrics (medians, latency percentiles)."""
+    latencies = [s["latency"] for s in samples]
+    return {
+        "ttft_ms": round(statistics.median(s["ttft"] for s in samples) * 1000, 1),
+        "prefill_tps": round(statistics.median(s["prefill_tps"] for s in samples), 2),
+        "decode_tps": round(statistics.median(s["decode_tps"] for s in samples), 2),
+        "latency_p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "tokens": round(statistics.mean(s["tokens"] for s in samples), 1),
+        "runs": len(samples),
+    }
+
+
+def run_bench(model_obj, scenarios=SCENARIOS, runs=5, warmup=1, max_tokens=64, long_tokens=512):
+    """Runs every scenario `warmup` + `runs` times and returns `{scenario: metrics}`."""
+    crews = _bench_crews(model_obj, max_tokens, long_tokens)
+    results = {}
+    for name in scenarios:
+        for _ in range(warmup):
+            run_scenario(name, model_obj, crews, max_tokens)
+        samples = [run_scenario(name, model_obj, crews, max_tokens) for _ in range(runs)]
+        results[name] = summarize(samples)
+        m = results[name]
+        print(f"{name:<20} TTFT {m['ttft_ms']:>8.1f} ms  prefill {m['prefill_tps']:>9.1f} tok/s  "
+              f"decode {m['decode_tps']:>8.1f} tok/s  p50 {m['latency_p50_ms']:>8.1f} ms  p95 {m['latency_p95_ms']:>8.1f} ms")
+    return results
+
+
+def compare(baseline, current, threshold):
+    """Prints metric-by-metric changes and returns the regressions worse than `threshold` (a fraction)."""
+    regressions = []
+    print(f"\n{'scenario':<20} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for scenario, metrics in current.items():
+        old = baseline.get(scenario)
+        if not old:
+            print(f"{scenario:<20} (no baseline)")
+            continue
+        for metric, direction in METRICS.items():
+            before, after = old.get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change * direction < -threshold
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{scenario:<20} {metric:<15} {before:>10.1f} {after:>10.1f} {change:>+7.1%}{flag}")
+            if regressed:
+                regressions.append((scenario, metric, before, after))
+    return regressions
+
+
+def _read_baselines(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_baseline(path, key, entry):
+    baselines = _read_baselines(path)
+    baselines[key] = entry
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2)
+    os.replace(tmp, path)
+
+
+def connect_server(url):
+    """model_obj for an already running llama-server (or a mock of one), without launching anything."""
+    client = LlamaServerClient.from_env(url)
+    if not client.health():
+        client.close()
+        return None
+    n_slots = client.refresh_slots()
+    return raven.attach_scheduler({"url": url, "type": "llamacpp_server", "process": None, "client": client},
+                                  workers=n_slots)
+
+
+def _shutdown(model_obj):
+    if model_obj.get("process"):
+        model_obj["process"].terminate()
+        model_obj["process"].wait()
+    if model_obj.get("pool"):
+        model_obj["pool"].shutdown()
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="python -m core.bench", description="End-to-end inference benchmark with regression check.")
+    parser.add_argument("--backend", choices=["cuda", "cpu", "server", "pool"], default="cpu")
+    parser.add_argument("--url", help="benchmark an already running llama-server instead of starting a backend")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--max-tokens", type=int, default=64, help="reply budget of the chat turns")
+    parser.add_argument("--long-tokens", type=int, default=512, help="reply budget of the creative long-form turn")
+    parser.add_argument("--baseline", default=env_str("BENCH_BASELINE_PATH", DEFAULT_BASELINE_PATH))
+    parser.add_argument("--save", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative slowdown before failing (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    backend = "server" if args.url else args.backend
+    os.environ.update(NO_MEMO_ENV)
+    model_obj = connect_server(args.url) if args.url else raven.activate_raven(backend=backend)
+    if not model_obj:
+        print("Benchmark aborted: the backend did not start.")
+        return 2
+    try:
+        print(f"Benchmarking {backend} backend: {args.runs} run(s) per scenario after {args.warmup} warm-up run(s)\n")
+        results = run_bench(model_obj, scenarios, args.runs, args.warmup, args.max_tokens, args.long_tokens)
+    finally:
+        _shutdown(model_obj)
+
+    model_path = env_str("RAVEN_GGUF_MODEL_PATH")
+    entry = {"backend": backend, "model": os.path.basename(model_path) if model_path else None,
+             "cpu": autotune.cpu_signature(), "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+             "scenarios": results}
+    baseline = _read_baselines(args.baseline).get(backend)
+    if args.save or not baseline:
+        save_baseline(args.baseline, backend, entry)
+        print(f"\nBaseline for the {backend} backend saved to {args.baseline}")
+        return 0
+    if baseline.get("cpu") != entry["cpu"] or baseline.get("model") != entry["model"]:
+        print(f"\nNOTE: the baseline was recorded with model {baseline.get('model')} on CPU {baseline.get('cpu')}.")
+    regressions = compare(baseline["scenarios"], results, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}.")
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
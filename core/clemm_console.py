@@ -1,6 +1,10 @@
 # clemm09/core/clemm_console.py
+import sys
 import subprocess
+import time
+from bridge.crew import ask_all, split_ask_all
 from bridge.tools.tools import list_tools, run_tool
+import core.raven as raven
 
 def clemm_console(model, crew, max_tokens):
     """Console interface."""
@@ -20,10 +24,12 @@ def clemm_console(model, crew, max_tokens):
         if user_input.lower() == 'exit':
             break
         elif user_input.lower() == 'help':
-            print("Available commands: help, exit, status, destination, ask, crew, use [crew_name], reset, run_code, run_tool [tool_name]")
+            print("Available commands: help, exit, status, destination, ask, ask_all [crew1,crew2] <question>, crew, use [crew_name], reset, run_code, run_tool [tool_name]")
             print("\nAvailable tools: ", ", ".join(available_tools_console))
         elif user_input.lower() == 'status':
             print("System Status: All systems nominal.")
+            for line in raven.status_report(model):
+                print(line)
         elif user_input.lower() == 'destination':
             print("Current Destination: Europa(Jupiter II)")
         elif user_input.lower() == 'crew':
@@ -53,38 +59,40 @@ def clemm_console(model, crew, max_tokens):
                 last_code_response = ""
             else:
                 print(f"Error: crew '{current_crew}' not found.")
+        elif user_input.lower().startswith('ask_all'):
+            names, query = split_ask_all(crew, user_input[7:])
+            if query:
+                # Every crew answers at once; replies are printed in the order they finish.
+                started = time.perf_counter()
+                total = 0.0
+                for name, response, seconds in ask_all(crew, query, names):
+                    total += seconds
+                    print(f"\n[{name} · {seconds:.1f} s]\n{response}")
+                print(f"\nAll answers in {time.perf_counter() - started:.1f} s ({total:.1f} s one after another).")
+            else:
+                print("Please provide a question.")
         elif user_input.lower().startswith('ask'):
             query = user_input[4:].strip()
             if query:
                 if current_crew not in crew:
                     print(f"Error: crew '{current_crew}' not found. Available crews: {', '.join(crew.keys())}")
                 else:
-                    response = crew[current_crew].chat(query)
-                    # Handle tool execution responses
-                    if isinstance(response, str) and response.lower().startswith("run_tool "):
-                        try:
-                            tool_command = response[8:].strip()
-                            parts = tool_command.split(maxsplit=1)
-                            tool_name = parts[0]
-                            tool_kwargs = {}
-                            if len(parts) > 1:
-                                args_part = parts[1]
-                                arg_pairs = [pair.strip() for pair in args_part.split(',')]
-                                for pair in arg_pairs:
-                                    if '=' in pair:
-                                        key, value = pair.split('=', 1)
-                                        tool_kwargs[key.strip()] = value.strip()
-                            print(f"\nExecuting tool: {tool_name}")
-                            if tool_kwargs:
-                                print(f"With arguments: {tool_kwargs}")
-                            tool_result = run_tool(tool_name, crew_instance=crew, **tool_kwargs)  # Pass the crew!
-                            print(f"Tool result: {tool_result}")
-                            feedback_response = crew[current_crew].chat(f"Tool execution result: {tool_result}")
-                            if not feedback_response.lower().startswith("run_tool "):
-                                print(f"{current_crew}: {feedback_response}")
-                        except Exception as e:
-                            print(f"Error executing tool: {e}")
-                    else:
+                    if not raven.is_ready(model):
+                        print(f"Raven is still starting ({model.get('status')}); your question will run once it is ready.")
+                    # Show the reply while it is generated; the final text is only reprinted when
+                    # chat() changed it (tool results, stripped <think> blocks).
+                    streamed = []
+                    def show_chunk(chunk):
+                        if not streamed:
+                            sys.stdout.write(f"{current_crew}: ")
+                        streamed.append(chunk.text)
+                        sys.stdout.write(chunk.text)
+                        sys.stdout.flush()
+                    response = crew[current_crew].chat_stream(query, show_chunk)
+                    if streamed:
+                        print()
+                    # Tool commands ran inside chat(); the model has already answered with their results.
+                    if not streamed or response != "".join(streamed).strip():
                         print(f"{current_crew}: {response}")
                     if current_crew == "code_expert":
                         last_code_response = response
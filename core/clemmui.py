@@ -17,8 +17,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import backend components
 from bridge.tools.tools import list_tools, run_tool, get_tool_description
+from bridge.tools.grammar import parse_tool_calls
 import core.raven as raven
 import bridge.crew as crew
+from bridge.crew import ask_all, split_ask_all
 
 # (MatrixRain and TypewriterText classes remain unchanged)
 class MatrixRain(tk.Canvas):
@@ -280,6 +282,7 @@ class ClemmMatrixUI(tk.Tk):
         self.setup_menus()
         
         self.after(500, self.boot_sequence)
+        self.after(250, self.poll_model_status)
         self.after(1000, self.matrix_canvas.start_animation)
         self.after(2000, lambda: self.input_entry.focus_set())
 
@@ -444,6 +447,22 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
         if self.winfo_exists():
             self.after(500, self.cursor_blink)
 
+    def poll_model_status(self):
+        """Streams background model loading progress into the status bar until the backend is up."""
+        if not self.winfo_exists():
+            return
+        if self.model and not raven.is_ready(self.model):
+            self.status_label.config(text="STATUS: LOADING")
+            self.model_status.config(text=f"MODEL: {self.model.get('status', 'LOADING')}"[:40])
+            self.after(250, self.poll_model_status)
+        elif self.model and self.model.get("error"):
+            self.status_label.config(text="STATUS: OFFLINE", fg=self.warning_red)
+            self.model_status.config(text="MODEL: ACTIVATION FAILED")
+            self.append_output(f"ERROR: {self.model['error'].upper()}")
+        else:
+            self.status_label.config(text="STATUS: CONNECTED")
+            self.model_status.config(text=f"MODEL: {self.model_name[:20]}")
+
     def initialize_system(self):
         loading_messages = [
             "ACCESSING CREW DATABASE...",
@@ -509,6 +528,7 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
     TOOLS / LIST TOOLS - Lists all available tools and their descriptions.
     RUN_TOOL <name> [args] - Manually run a tool (e.g., 'run_tool create_file filename="test.txt"').
     RUN_CODE           - Executes Python code from the last response of 'code_expert'.
+    ASK_ALL [crews] <query> - Asks several crew members at once (e.g., 'ask_all captain_raven,code_expert status?').
     MODEL_INFO         - Displays information about the loaded AI model.
     CLEAR              - Clears the output screen.
     EXIT               - Disconnects from the Matrix and closes the terminal.
@@ -548,6 +568,19 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
             self.reset_current_crew()
             self.system_status.config(text="READY FOR COMMANDS")
             
+        elif command_lower.startswith("ask_all"):
+            names, query = split_ask_all(self.crew or {}, command[7:])
+            if not query:
+                self.append_output("ERROR: QUERY REQUIRED")
+                self.system_status.config(text="READY FOR COMMANDS")
+                return
+            if self.crew:
+                self.append_output(f"BROADCASTING QUERY TO {', '.join(names).upper() if names else 'ALL CREW'}...")
+                threading.Thread(target=self.process_ask_all, args=(query, names), daemon=True).start()
+            else:
+                self.append_output("ERROR: NO ACTIVE CREW")
+                self.system_status.config(text="READY FOR COMMANDS")
+
         elif command_lower.startswith("ask "):
             query = command[4:].strip()
             if not query:
@@ -568,22 +601,12 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
                 self.system_status.config(text="READY FOR COMMANDS")
                 return
 
-            tool_call = parts[1]
-            tool_name_match = re.match(r'^(\w+)', tool_call)
-            if not tool_name_match:
+            calls = parse_tool_calls(command)
+            if not calls:
                 self.append_output("ERROR: Could not parse tool name.")
                 self.system_status.config(text="READY FOR COMMANDS")
                 return
-            
-            tool_name = tool_name_match.group(1)
-            kwargs = {}
-            # Regex to find key=value or key="value" or key='value' pairs
-            arg_pattern = re.compile(r'(\w+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|(\S+))')
-            for match in arg_pattern.finditer(tool_call[len(tool_name):]):
-                key = match.group(1)
-                # The value can be in group 2 (double quotes), 3 (single quotes), or 4 (no quotes)
-                value = next((v for v in match.groups()[1:] if v is not None), None)
-                kwargs[key] = value
+            tool_name, kwargs = calls[0]
 
             self.append_output(f"> Running tool: {tool_name} with args: {kwargs}")
             threading.Thread(target=self.execute_tool, args=(tool_name,), kwargs={'tool_args': kwargs}, daemon=True).start()
@@ -629,7 +652,9 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
 
     def process_ask(self, query: str):
         try:
-            self.after(0, lambda: self.system_status.config(text="QUERYING NEURAL INTERFACE..."))
+            waiting = self.model and not raven.is_ready(self.model)
+            status = "QUEUED: WAITING FOR MODEL..." if waiting else "QUERYING NEURAL INTERFACE..."
+            self.after(0, lambda: self.system_status.config(text=status))
             final_response = self.crew[self.current_crew].chat(query)
             header = f"\n[{self.current_crew.upper()} RESPONSE]:\n"
             full_text = header + "═" * (len(header) - 2) + "\n" + (final_response or "[NO RESPONSE]")
@@ -639,6 +664,23 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
         finally:
             self.after(0, lambda: self.system_status.config(text="READY FOR COMMANDS"))
 
+    def process_ask_all(self, query: str, names: Optional[List[str]] = None):
+        try:
+            self.after(0, lambda: self.system_status.config(text="QUERYING CREW IN PARALLEL..."))
+            started = time.perf_counter()
+            total = 0.0
+            for crew_name, response, seconds in ask_all(self.crew, query, names):
+                total += seconds
+                header = f"\n[{crew_name.upper()} RESPONSE · {seconds:.1f} S]:\n"
+                text = header + "═" * (len(header) - 2) + "\n" + (response or "[NO RESPONSE]")
+                self.after(0, lambda t=text: self.append_output(t))
+            summary = f"\nALL RESPONSES IN {time.perf_counter() - started:.1f} S ({total:.1f} S SEQUENTIAL)"
+            self.after(0, lambda: self.append_output(summary))
+        except Exception as e:
+            self.after(0, lambda err=e: self.append_output(f"\nERROR IN NEURAL INTERFACE: {err}"))
+        finally:
+            self.after(0, lambda: self.system_status.config(text="READY FOR COMMANDS"))
+
     def store_code_if_expert(self, response: str):
         if self.current_crew == "code_expert":
             self.last_code_response = response
@@ -704,7 +746,9 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
         status_lines.append("╚═══════════════════════════════════════════╝")
         self.append_output("\n".join(status_lines))
 
-    def show_system_status(self): self.append_output("SYSTEM STATUS CHECK PENDING IMPLEMENTATION")
+    def show_system_status(self):
+        lines = raven.status_report(self.model)
+        self.append_output("\n".join(["SYSTEM STATUS:"] + [line.upper() for line in lines]) if lines else "SYSTEM STATUS: NO BACKEND METRICS AVAILABLE")
     def list_crew(self): self.show_crew_status() if self.crew and isinstance(self.crew, dict) and len(self.crew) > 0 else self.append_output("ERROR: CREW DATABASE EMPTY")
     def list_tools(self): self.show_tool_descriptions() if self.available_tools else self.append_output("No tools available.")
 
@@ -726,11 +770,13 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
         if self.model: 
             model_type_key = self.model.get("type")
             if model_type_key == "programmatic_gguf":
-                backend_type = "CUDA (Local Library)"
+                backend_type = "CPU (Local Library)" if self.model.get("device") == "cpu" else "CUDA (Local Library)"
                 status = "LOADED" if self.model.get("model") else "ERROR"
             elif model_type_key == "llamacpp_server":
                 backend_type = "Llama.cpp Server"
                 status = "CONNECTED" if self.model.get("url") else "ERROR"
+            if not raven.is_ready(self.model):
+                status = f"LOADING ({self.model.get('status')})"
         
         model_info = f"""
     MODEL INFORMATION:
@@ -741,6 +787,8 @@ CLEMM v2.1 MATRIX INTERFACE ONLINE.
     BACKEND: {backend_type}
     STATUS: {status}
     """
+        for line in raven.status_report(self.model):
+            model_info += f"    {line.upper()}\n"
         self.append_output(model_info)
 
 
@@ -755,8 +803,8 @@ def launch_matrix_ui(model_obj, crew_instance, max_tokens):
             llama_instance = model_obj.get("model")
             if llama_instance and hasattr(llama_instance, 'model_path'):
                 model_name = llama_instance.model_path
-        elif model_obj.get("type") == "llamacpp_server":
-            # For server, the model path isn't directly in the object, so we get it from the environment variable
+        if model_name == "Unknown GGUF Model":
+            # For server, or a local model still loading in the background, the path comes from the environment variable
             model_path_from_env = os.getenv("RAVEN_GGUF_MODEL_PATH")
             if model_path_from_env:
                 model_name = model_path_from_env
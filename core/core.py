@@ -2,55 +2,64 @@
 
 import core.raven as raven
 from bridge.crew import initialize_crew
+from core import startup_profile
 
 def start_core():
     """Starts the core systems of Clemm08."""
 
-    backend_choice = input("Choose backend for Raven:\n1 - CUDA (local library)\n2 - LlamaCPP Server\nEnter your choice (1/2): ").strip()
-    backend = 'server' if backend_choice == '2' else 'cuda'
+    backend_choice = input("Choose backend for Raven:\n1 - CUDA (local library)\n2 - LlamaCPP Server\n3 - LlamaCPP Server Pool\n4 - CPU (local library)\nEnter your choice (1/2/3/4): ").strip()
+    backend = {'2': 'server', '3': 'pool', '4': 'cpu'}.get(backend_choice, 'cuda')
     
-    print(f"Core systems online. Initiating Raven with {backend.upper()} backend...")
+    print(f"Core systems online. Initiating Raven with {backend.upper()} backend in the background...")
     
-    model_obj = raven.activate_raven(backend=backend)
-    
-    # --- NEW: Add a try...finally block to ensure server shutdown ---
-    server_process = None
-    if model_obj:
-        # Check if a server process was started and store it for cleanup
-        if model_obj.get("process"):
-            server_process = model_obj["process"]
-    
-    try:
-        if model_obj:
-            max_tokens = int(input("Enter maximum response length (default is 1022): ") or 1022)
-            
-            print("Loading crew...")
-            clemm_crew = initialize_crew(model_obj, max_tokens)
-
-            print("Loading other tools (Placeholder)...")
-            
-            ui_choice = input("\nChoose interface:\n1 - Matrix UI\n2 - Console UI\nEnter your choice (1/2): ").strip()
-            if ui_choice == '1':
-                from core.clemmui import launch_matrix_ui
-                launch_matrix_ui(model_obj, clemm_crew, max_tokens)
-            else:
-                from core.clemm_console import clemm_console
-                clemm_console(model_obj, clemm_crew, max_tokens)
-        else:
+    # The model loads (or the server spawns) while the crew and interface come up;
+    # questions asked before it is ready wait for it.
+    def on_ready(model_obj):
+        startup_profile.report(f"{backend} backend activation")
+        if model_obj.get("error"):
             if backend == 'cuda':
                 print("Failed to start Raven. Please ensure you have a CUDA-enabled GPU and the correct drivers.")
+                print("On machines without a GPU choose the CPU backend (4).")
+            elif backend == 'cpu':
+                print("Failed to start Raven on the CPU. Check RAVEN_GGUF_MODEL_PATH and the CPU_* settings in .env.")
             else:
                 print("Failed to start or connect to the LlamaCPP server. Check your .env paths and settings.")
-            print("System shutdown initiated.")
-            exit()
+
+    model_obj = raven.activate_raven_background(backend=backend, on_ready=on_ready)
+    
+    try:
+        max_tokens = int(input("Enter maximum response length (default is 1022): ") or 1022)
+        
+        print("Loading crew...")
+        clemm_crew = initialize_crew(model_obj, max_tokens)
+
+        print("Loading other tools (Placeholder)...")
+        
+        ui_choice = input("\nChoose interface:\n1 - Matrix UI\n2 - Console UI\nEnter your choice (1/2): ").strip()
+        if ui_choice == '1':
+            from core.clemmui import launch_matrix_ui
+            launch_matrix_ui(model_obj, clemm_crew, max_tokens)
+        else:
+            from core.clemm_console import clemm_console
+            clemm_console(model_obj, clemm_crew, max_tokens)
             
     finally:
-        # This block will run when the try block finishes or if an error occurs
+        # This block will run when the interface closes or if an error occurs.
+        # Servers still starting are waited for, so they never outlive the session.
+        if backend in ('server', 'pool') and not raven.is_ready(model_obj):
+            print("\nWaiting for the LlamaCPP server to finish starting so it can be shut down...")
+            model_obj["ready"].wait()
+        server_process = model_obj.get("process")
+        server_pool = model_obj.get("pool")
         if server_process:
             print("\nShutting down LlamaCPP server...")
             server_process.terminate()
             server_process.wait() # Wait for the process to fully close
             print("Server has been shut down.")
+        if server_pool:
+            print("\nShutting down LlamaCPP server pool...")
+            server_pool.shutdown()
+            print("Server pool has been shut down.")
 
 if __name__ == "__main__":
     start_core()
\ No newline at end of file
@@ -0,0 +1,36 @@
+# core/env.py
+
+import os
+
+
+def env_str(name, default=None):
+    """Reads an environment variable, dropping the inline `# comment` our .env files allow."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    value = raw.split('#')[0].strip()
+    return value if value else default
+
+
+def env_int(name, default):
+    """Reads an integer setting, falling back to `default` when unset or malformed."""
+    try:
+        return int(env_str(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name, default):
+    """Reads a float setting, falling back to `default` when unset or malformed."""
+    try:
+        return float(env_str(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name, default=False):
+    """Reads an on/off setting (1/0, true/false, yes/no, on/off)."""
+    value = env_str(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
@@ -0,0 +1,225 @@
+# core/kv_cache.py
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from core.env import env_bool, env_int, env_str
+
+
+def model_fingerprint(model_path, n_ctx=None):
+    """
+    Returns a short, stable identity for a GGUF file.
+    Uses path, size and mtime instead of hashing the multi-GB file on every start.
+    """
+    stat = os.stat(model_path)
+    identity = f"{os.path.abspath(model_path)}|{stat.st_size}|{int(stat.st_mtime)}|{n_ctx}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+
+class PrefixStateCache:
+    """
+    Persistent store of evaluated llama-cpp states for rendered prompt prefixes
+    (the system prompt of a crew), so the prefix is never prefilled twice, even across restarts.
+    Backed by diskcache with a size cap and least-recently-used eviction.
+    """
+
+    def __init__(self, model_id, directory, size_limit_bytes):
+        self.model_id = model_id
+        self.directory = directory
+        import diskcache  # loaded with the first cache, not when the module is imported
+
+        self._cache = diskcache.Cache(directory, size_limit=size_limit_bytes, eviction_policy="least-recently-used")
+        self._tokens = {}  # rendered prefix -> token ids, so a prefix is tokenized once per session
+        self._too_long = set()  # prefixes that do not fit the context, warned about once
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    def key_for(self, prefix, variant=""):
+        """Cache key: hash of the model identity (with `variant`, e.g. the active LoRA adapter) plus the rendered prefix."""
+        return hashlib.sha256(f"{self.model_id}{variant}\n{prefix}".encode("utf-8")).hexdigest()
+
+    def _tokenize(self, model, prefix):
+        tokens = self._tokens.get(prefix)
+        if tokens is None:
+            # Same tokenization Llama.__call__ applies to the full prompt, so the prefix lines up.
+            tokens = model.tokenize(prefix.encode("utf-8"), special=True)
+            self._tokens[prefix] = tokens
+        return tokens
+
+    def prefill(self, model, prefix, variant=""):
+        """
+        Makes sure `model` holds the evaluated state of `prefix` (under the weights `variant` names).
+        Restores it from disk on a hit, evaluates and stores it on a miss.
+        Returns the number of prompt tokens that did not need to be evaluated.
+        A prefix that does not fit the context, or fails to evaluate, is left uncached: the prompt is prefilled in full.
+        """
+        if not prefix:
+            return 0
+        with self._lock:
+            tokens = self._tokenize(model, prefix)
+            n = len(tokens)
+            if n >= model.n_ctx():
+                if prefix not in self._too_long:
+                    self._too_long.add(prefix)
+                    print(f"WARNING: Prefix cache skips a {n}-token prefix that does not fit the {model.n_ctx()}-token context.")
+                return 0
+            # Prefix is still resident from the previous turn; llama-cpp reuses it on its own.
+            if model.n_tokens >= n and list(model.input_ids[:n]) == tokens:
+                return n
+
+            key = self.key_for(prefix, variant)
+            state = self._cache.get(key)
+            if state is not None:
+                try:
+                    model.load_state(state)
+                    self.hits += 1
+                    self.tokens_saved += n
+                    return n
+                except Exception as e:
+                    print(f"Prefix cache: discarding unusable entry ({e}).")
+                    self._cache.delete(key)
+
+            self.misses += 1
+            model.reset()
+            try:
+                model.eval(tokens)
+            except Exception as e:
+                model.reset()  # a partly evaluated prefix must not look reusable
+                print(f"WARNING: Prefix cache could not evaluate the prefix ({e}); it is prefilled with the prompt.")
+                return 0
+            self._cache.set(key, model.save_state())
+            return 0
+
+    def stats(self):
+        """Returns hit/miss counters and the number of prompt tokens the cache saved."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "tokens_saved": self.tokens_saved,
+                "entries": len(self._cache),
+                "size_bytes": self._cache.volume(),
+            }
+
+    def report(self):
+        """One-line summary for the console and UI."""
+        s = self.stats()
+        return (f"Prefix cache: {s['hits']} hits, {s['misses']} misses, "
+                f"{s['tokens_saved']} prompt tokens saved, {s['entries']} entries "
+                f"({s['size_bytes'] / (1024 * 1024):.1f} MB)")
+
+    def close(self):
+        self._cache.close()
+
+
+def state_nbytes(state):
+    """Approximate RAM held by a llama-cpp LlamaState (KV bytes plus token and logit arrays)."""
+    return state.llama_state_size + state.input_ids.nbytes + state.scores.nbytes
+
+
+class CrewStateSnapshots:
+    """
+    In-memory snapshots of each crew's evaluated context on a shared Llama instance.
+    Switching crews parks the resident crew's state and restores the incoming one,
+    so a switch costs one state restore instead of a full prompt evaluation.
+    Snapshots are kept under a RAM budget with least-recently-used eviction.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.active = None  # crew whose context currently lives in the model
+        self._states = OrderedDict()  # crew name -> (LlamaState, nbytes)
+        self._used = 0
+        self._lock = threading.Lock()
+        self.restores = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _store(self, crew_name, state):
+        size = state_nbytes(state)
+        old = self._states.pop(crew_name, None)
+        if old:
+            self._used -= old[1]
+        if size > self.budget_bytes:
+            return
+        self._states[crew_name] = (state, size)
+        self._used += size
+        while self._used > self.budget_bytes:
+            _, (_, evicted) = self._states.popitem(last=False)
+            self._used -= evicted
+            self.evictions += 1
+
+    def switch_to(self, model, crew_name):
+        """
+        Makes `crew_name` the resident context of `model`.
+        Returns True when a snapshot was restored, False when the crew starts cold or was already resident.
+        """
+        with self._lock:
+            if crew_name is None or crew_name == self.active:
+                return False
+            if self.active is not None and model.n_tokens > 0:
+                self._store(self.active, model.save_state())
+            self.active = crew_name
+            entry = self._states.get(crew_name)
+            if entry is None:
+                self.misses += 1
+                return False
+            self._states.move_to_end(crew_name)
+            try:
+                model.load_state(entry[0])
+            except Exception as e:
+                print(f"Crew snapshot for '{crew_name}' could not be restored ({e}).")
+                self._used -= self._states.pop(crew_name)[1]
+                return False
+            self.restores += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "snapshots": len(self._states),
+                "used_bytes": self._used,
+                "budget_bytes": self.budget_bytes,
+                "restores": self.restores,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def report(self):
+        s = self.stats()
+        return (f"Crew snapshots: {s['snapshots']} held, {s['used_bytes'] / (1024 * 1024):.1f}/"
+                f"{s['budget_bytes'] / (1024 * 1024):.0f} MB, {s['restores']} restores, "
+                f"{s['misses']} cold switches, {s['evictions']} evictions")
+
+
+def open_crew_snapshots():
+    """
+    Creates the per-crew snapshot store, or returns None when disabled.
+    Env: CREW_STATE_BUDGET_MB (default 512, 0 disables)
+    """
+    budget_mb = env_int("CREW_STATE_BUDGET_MB", 512)
+    if budget_mb <= 0:
+        return None
+    return CrewStateSnapshots(budget_mb * 1024 * 1024)
+
+
+def open_prefix_cache(model_path, n_ctx):
+    """
+    Opens the on-disk prefix cache for a model, or returns None when disabled.
+    Env: PREFIX_CACHE_ENABLED, PREFIX_CACHE_DIR, PREFIX_CACHE_SIZE_MB
+    """
+    if not env_bool("PREFIX_CACHE_ENABLED", True):
+        return None
+    directory = env_str("PREFIX_CACHE_DIR", os.path.join("cache", "prefix"))
+    size_mb = env_int("PREFIX_CACHE_SIZE_MB", 1024)
+    try:
+        cache = PrefixStateCache(model_fingerprint(model_path, n_ctx), directory, size_mb * 1024 * 1024)
+    except Exception as e:
+        print(f"WARNING: Prefix cache unavailable ({e}). Continuing without it.")
+        return None
+    print(f"Prefix cache attached at {os.path.abspath(directory)} (cap {size_mb} MB).")
+    return cache
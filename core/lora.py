@@ -0,0 +1,110 @@
+# core/lora.py
+
+import os
+import threading
+import time
+
+from core.kv_cache import model_fingerprint
+
+
+class LoraAdapters:
+    """
+    LoRA adapters of one shared base model, applied per generation. Adapter weights are read from
+    disk once and kept; a crew switch only re-attaches them to the context (`llama_set_adapter_lora`).
+    Swapping changes the weights, so the caller has to drop KV state evaluated under the previous adapter.
+    `ctx` is the llama context the adapters attach to; by default the model's own (`model.ctx`).
+    """
+
+    def __init__(self, ctx=None):
+        self.ctx = ctx
+        self._adapters = {}  # path -> (adapter handle, bytes)
+        self._failed = set()
+        self._lock = threading.Lock()
+        self.active = None  # (path, scale) attached to the context, or None for the bare base model
+        self.swaps = 0
+        self.swap_ms = 0.0
+        self.last_swap_ms = 0.0
+        self.load_ms = 0.0
+
+    def _adapter(self, model, path):
+        import llama_cpp
+
+        entry = self._adapters.get(path)
+        if entry is None:
+            started = time.perf_counter()
+            handle = llama_cpp.llama_adapter_lora_init(model.model, path.encode("utf-8"))
+            if not handle:
+                raise ValueError(f"{path} is not a LoRA adapter for {os.path.basename(model.model_path)}")
+            entry = self._adapters[path] = (handle, os.path.getsize(path))
+            self.load_ms += (time.perf_counter() - started) * 1000
+            print(f"LoRA adapter '{os.path.basename(path)}' loaded ({entry[1] / 2**20:.1f} MB).")
+        return entry[0]
+
+    def apply(self, model, lora):
+        """
+        Attaches `lora` (`(path, scale)` or None) to `model`'s context.
+        Returns True when the effective weights changed, i.e. cached KV state no longer matches them.
+        An adapter that fails to load is reported once; the crew then runs on the base model.
+        """
+        import llama_cpp
+
+        with self._lock:
+            if lora is not None and (lora[0] in self._failed or not lora[1]):
+                lora = None
+            lora = tuple(lora) if lora else None
+            if lora == self.active:
+                return False
+            started = time.perf_counter()
+            try:
+                adapter = self._adapter(model, lora[0]) if lora else None
+            except (OSError, ValueError) as e:
+                print(f"WARNING: LoRA adapter unavailable ({e}); using the base model.")
+                self._failed.add(lora[0])
+                adapter, lora = None, None
+                if self.active is None:
+                    return False
+            ctx = self.ctx or model.ctx
+            llama_cpp.llama_clear_adapter_lora(ctx)
+            if adapter is not None:
+                llama_cpp.llama_set_adapter_lora(ctx, adapter, lora[1])
+            self.active = lora
+            self.last_swap_ms = (time.perf_counter() - started) * 1000
+            self.swap_ms += self.last_swap_ms
+            self.swaps += 1
+            return True
+
+    def variant(self):
+        """Identity of the active adapter, for caches of evaluated state (empty for the base model)."""
+        if self.active is None:
+            return ""
+        return f"lora:{model_fingerprint(self.active[0])}@{self.active[1]:g}"
+
+    def memory_bytes(self):
+        return sum(size for _, size in self._adapters.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "adapters": len(self._adapters),
+                "bytes": self.memory_bytes(),
+                "active": os.path.basename(self.active[0]) if self.active else None,
+                "swaps": self.swaps,
+                "avg_swap_ms": self.swap_ms / self.swaps if self.swaps else 0.0,
+                "last_swap_ms": self.last_swap_ms,
+                "load_ms": self.load_ms,
+            }
+
+    def report(self):
+        """One-line summary for the console and UI."""
+        s = self.stats()
+        return (f"LoRA adapters: {s['adapters']} cached ({s['bytes'] / 2**20:.1f} MB, loaded in {s['load_ms']:.0f} ms), "
+                f"active {s['active'] or 'none'}, {s['swaps']} swaps, last {s['last_swap_ms']:.2f} ms, avg {s['avg_swap_ms']:.2f} ms")
+
+    def close(self):
+        import llama_cpp
+
+        with self._lock:
+            for handle, _ in self._adapters.values():
+                llama_cpp.llama_adapter_lora_free(handle)
+            self._adapters.clear()
+            self.active = None
@@ -0,0 +1,217 @@
+# core/metrics.py
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from core.env import env_bool, env_int, env_str
+
+# Every generation ends in one `record(...)` call: the in-process registry aggregates it for the
+# Prometheus endpoint (METRICS_PORT) and, with METRICS_JSONL_ENABLED, the raw record is appended to a JSONL
+# file for capacity tracking. Past METRICS_JSONL_MAX_MB the file is rotated to `<path>.1` (one old file is kept).
+# Tool calls are counted with `record_tool(...)` (registry only).
+
+DEFAULT_JSONL_PATH = os.path.join("output_files", "inference_metrics.jsonl")
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOOL_BUCKETS = (0.001, 0.005) + LATENCY_BUCKETS
+
+
+class Histogram:
+    """Cumulative Prometheus histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe aggregation of generation records, rendered in the Prometheus text format."""
+
+    COUNTERS = {
+        "generations": ("raven_generations_total", "Generations, by crew, backend and cache that answered (none = inference)"),
+        "prompt_tokens": ("raven_prompt_tokens_total", "Prompt tokens sent to the model"),
+        "cached_tokens": ("raven_cached_prompt_tokens_total", "Prompt tokens served from a KV, prefix or slot cache"),
+        "completion_tokens": ("raven_completion_tokens_total", "Generated tokens"),
+        "tool_calls": ("raven_tool_calls_total", "Tool calls, by tool and outcome (ok, error, timeout)"),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)  # (metric, labels) -> value
+        self._prefill = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # labels -> histogram
+        self._decode = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._tokens_per_second = {}  # labels -> last decode speed
+        self._tools = defaultdict(lambda: Histogram(TOOL_BUCKETS))  # labels -> tool latency histogram
+        self.started = time.time()
+
+    def add(self, rec):
+        labels = _labels(crew=rec["crew"] or "-", backend=rec["backend"])
+        with self._lock:
+            self._counters[("generations", _labels(crew=rec["crew"] or "-", backend=rec["backend"], cache=rec["cache"] or "none"))] += 1
+            for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                self._counters[(key, labels)] += rec[key]
+            if rec["cache"] is None:
+                self._prefill[labels].observe(rec["prefill_ms"] / 1000)
+                self._decode[labels].observe(rec["decode_ms"] / 1000)
+                if rec["tokens_per_second"]:
+                    self._tokens_per_second[labels] = rec["tokens_per_second"]
+
+    def add_tool(self, tool, seconds, outcome):
+        with self._lock:
+            self._counters[("tool_calls", _labels(tool=tool, outcome=outcome))] += 1
+            self._tools[_labels(tool=tool)].observe(seconds)
+
+    def _histogram_lines(self, name, help_text, histograms):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, h in sorted(histograms.items()):
+            inner = labels[1:-1]
+            for bound, count in zip(h.buckets, h.counts):
+                lines.append(f'{name}_bucket{{{inner},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{inner},le="+Inf"}} {h.count}')
+            lines.append(f"{name}_sum{labels} {h.sum:.6f}")
+            lines.append(f"{name}_count{labels} {h.count}")
+        return lines
+
+    def prometheus_text(self):
+        with self._lock:
+            lines = []
+            for key, (name, help_text) in self.COUNTERS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                lines += [f"{name}{labels} {value:g}" for (metric, labels), value in sorted(self._counters.items()) if metric == key]
+            lines += self._histogram_lines("raven_prefill_seconds", "Prompt evaluation time per generation", self._prefill)
+            lines += self._histogram_lines("raven_decode_seconds", "Token generation time per generation", self._decode)
+            lines += self._histogram_lines("raven_tool_seconds", "Tool call latency from submission to result", self._tools)
+            lines += ["# HELP raven_decode_tokens_per_second Decode speed of the latest generation",
+                      "# TYPE raven_decode_tokens_per_second gauge"]
+            lines += [f"raven_decode_tokens_per_second{labels} {value:.3f}" for labels, value in sorted(self._tokens_per_second.items())]
+            lines += ["# HELP raven_metrics_start_time_seconds Registry start time", "# TYPE raven_metrics_start_time_seconds gauge",
+                      f"raven_metrics_start_time_seconds {self.started:.0f}"]
+            return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Summary for the console and UI: one line for generations, then one per tool that ran."""
+        with self._lock:
+            generations = sum(v for (metric, _), v in self._counters.items() if metric == "generations")
+            completion = sum(v for (metric, _), v in self._counters.items() if metric == "completion_tokens")
+            decode_s = sum(h.sum for h in self._decode.values())
+            tools = sorted(self._tools.items())
+            timeouts = {labels: v for (metric, labels), v in self._counters.items() if metric == "tool_calls" and 'outcome="timeout"' in labels}
+        speed = f", {completion / decode_s:.1f} tok/s overall" if decode_s else ""
+        lines = [f"Metrics: {generations:g} generations, {completion:g} tokens generated{speed}"]
+        for labels, h in tools:
+            timed_out = timeouts.get(labels[:-1] + ',outcome="timeout"}', 0)
+            lines.append(f"  tool {labels[7:-2]}: {h.count} calls, p50 {_quantile(h, 0.5)}, p95 {_quantile(h, 0.95)}, "
+                         f"avg {h.sum / h.count * 1000:.0f} ms, {timed_out:g} timeouts")
+        return "\n".join(lines)
+
+
+def _quantile(h, q):
+    """Upper bucket bound holding the q-quantile of a histogram, as text."""
+    for bound, count in zip(h.buckets, h.counts):
+        if count >= q * h.count:
+            return f"<={bound * 1000:g} ms"
+    return f">{h.buckets[-1]:g} s"
+
+
+REGISTRY = MetricsRegistry()
+_jsonl_lock = threading.Lock()
+_server = None
+
+
+def jsonl_path():
+    """Where records are appended, or None when METRICS_JSONL_ENABLED is off (the default)."""
+    if not env_bool("METRICS_JSONL_ENABLED", False):
+        return None
+    return env_str("METRICS_JSONL_PATH", DEFAULT_JSONL_PATH)
+
+
+def record(crew, backend, prompt_tokens=0, cached_tokens=0, completion_tokens=0, prefill_ms=0.0, decode_ms=0.0, cache=None):
+    """
+    Records one generation. `cache` names the cache that answered without inference
+    ("response" or "semantic"); None means the model ran. Returns the record.
+    """
+    rec = {
+        "ts": round(time.time(), 3),
+        "crew": crew,
+        "backend": backend,
+        "prompt_tokens": int(prompt_tokens or 0),
+        "cached_tokens": int(cached_tokens or 0),
+        "completion_tokens": int(completion_tokens or 0),
+        "prefill_ms": round(prefill_ms or 0.0, 2),
+        "decode_ms": round(decode_ms or 0.0, 2),
+        "tokens_per_second": round(completion_tokens / (decode_ms / 1000), 2) if completion_tokens and decode_ms else 0.0,
+        "cache": cache,
+    }
+    REGISTRY.add(rec)
+    path = jsonl_path()
+    if path:
+        try:
+            with _jsonl_lock:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                max_bytes = env_int("METRICS_JSONL_MAX_MB", 64) * 1024 * 1024
+                if max_bytes > 0 and os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+                    os.replace(path, path + ".1")
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec) + "\n")
+        except OSError as e:
+            print(f"WARNING: Could not append inference metrics to {path} ({e}).")
+    return rec
+
+
+def record_tool(tool, seconds, outcome="ok"):
+    """Records one tool call: its latency in seconds and `outcome` ("ok", "error" or "timeout")."""
+    REGISTRY.add_tool(tool, seconds, outcome)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would flood the console
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Serves GET /metrics on a daemon thread; returns the server, or None when METRICS_PORT is 0 (the default).
+    Env: METRICS_PORT, METRICS_HOST (default 127.0.0.1)
+    """
+    global _server
+    if _server is not None:
+        return _server
+    port = env_int("METRICS_PORT", 0) if port is None else port
+    if not port:
+        return None
+    host = host or env_str("METRICS_HOST", "127.0.0.1")
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"WARNING: Metrics endpoint unavailable on {host}:{port} ({e}).")
+        return None
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Prometheus metrics at http://{host}:{_server.server_address[1]}/metrics")
+    return _server
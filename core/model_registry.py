@@ -0,0 +1,259 @@
+# core/model_registry.py
+
+import os
+import threading
+import time
+
+from core.env import env_int, env_str
+
+# Crews name the GGUF they run on (`Crew.gguf`): "main" is RAVEN_GGUF_MODEL_PATH, any other name
+# NAME is read from RAVEN_GGUF_MODEL_PATH_<NAME>, and a value ending in .gguf is used as a path.
+# Models load on first use and stay resident while they fit MODEL_RAM_BUDGET_MB; to make room,
+# the least recently used idle model is unloaded. The activated (main) model is never unloaded.
+
+MAIN = "main"
+ENV_PREFIX = "RAVEN_GGUF_MODEL_PATH"
+
+
+def physical_memory_bytes():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _size(n_bytes):
+    return f"{n_bytes / 2**30:.1f} GB" if n_bytes >= 2**30 else f"{n_bytes / 2**20:.0f} MB"
+
+
+def kv_cache_bytes(model, n_ctx):
+    """Size of an f16 KV cache of `n_ctx` tokens for a loaded Llama's weights."""
+    import llama_cpp
+
+    n_layer = llama_cpp.llama_model_n_layer(model.model)
+    n_embd = llama_cpp.llama_model_n_embd(model.model)
+    n_head = max(1, llama_cpp.llama_model_n_head(model.model))
+    n_head_kv = llama_cpp.llama_model_n_head_kv(model.model)
+    return n_ctx * n_layer * 2 * (n_embd * n_head_kv // n_head) * 2
+
+
+def vocab_tokenizer(path):
+    """A vocab-only Llama of `path`: tokenizes without loading the weights."""
+    from llama_cpp import Llama
+
+    return Llama(model_path=path, vocab_only=True, verbose=False)
+
+
+def model_memory_bytes(model):
+    """Weights plus the f16 KV cache of a loaded Llama."""
+    import llama_cpp
+
+    return llama_cpp.llama_model_size(model.model) + kv_cache_bytes(model, model.n_ctx())
+
+
+class ResidentModel:
+    """One GGUF of the registry: its model_obj while loaded, usage and memory bookkeeping."""
+
+    def __init__(self, path, pinned=False):
+        self.path = path
+        self.pinned = pinned
+        self.model_obj = None
+        self.base_bytes = 0  # weights + KV cache, measured after loading
+        self.in_use = 0
+        self.last_used = 0.0
+        self.loads = 0
+
+    @property
+    def loaded(self):
+        return self.model_obj is not None
+
+    def memory_bytes(self):
+        if not self.loaded:
+            return 0
+        crew_states, lora, engine = (self.model_obj.get(key) for key in ("crew_states", "lora", "batch_engine"))
+        return (self.base_bytes + (crew_states.stats()["used_bytes"] if crew_states else 0) + (lora.memory_bytes() if lora else 0)
+                + (engine.memory_bytes() if engine else 0))
+
+
+class ModelRegistry:
+    """
+    Local GGUF models by name, loaded on demand through `loader(path)` (which returns a model_obj)
+    and kept resident under `budget_bytes` with least-recently-used unloading of idle models.
+    """
+
+    def __init__(self, main_obj, loader, budget_bytes):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # one load at a time; lookups of resident models never wait on it
+        self._names = {}  # name -> path
+        self._failed = set()  # paths that did not load; their crews stay on the main model
+        self._models = {}  # path -> ResidentModel
+        main = self._models[main_obj["model"].model_path] = ResidentModel(main_obj["model"].model_path, pinned=True)
+        main.model_obj = main_obj
+        main.base_bytes = model_memory_bytes(main_obj["model"])
+        main.loads = 1
+        main.last_used = time.monotonic()
+        self._names[MAIN] = main.path
+        self._tokenizers = {}  # path -> vocab-only Llama, to size prompts of models that are not loaded (used under _lock)
+        self.unloads = 0
+        for key in sorted(os.environ):
+            if key.startswith(ENV_PREFIX + "_"):
+                self.resolve(key[len(ENV_PREFIX) + 1:].lower())
+
+    @property
+    def main(self):
+        return self._models[self._names[MAIN]]
+
+    def resolve(self, name):
+        """GGUF path for a crew's model name; unknown or missing models resolve to the main model."""
+        if not name or name == MAIN:
+            return self.main.path
+        if name in self._names:
+            return self._names[name]
+        path = name if name.lower().endswith(".gguf") else env_str(f"{ENV_PREFIX}_{name.upper()}")
+        if path and not os.path.exists(path):
+            print(f"WARNING: Model '{name}' not found at {os.path.abspath(path)}; its crews use the main model.")
+        if not path or not os.path.exists(path):
+            path = self.main.path  # not configured: the crew shares the main model
+        self._names[name] = path
+        return path
+
+    def acquire(self, name):
+        """Returns the loaded ResidentModel for `name`, loading it if needed; it stays resident until `release`d."""
+        path = self.resolve(name)
+        entry = self._checkout(path)
+        if entry:
+            return entry
+        with self._load_lock:
+            entry = self._checkout(path)  # loaded by another thread meanwhile
+            if entry:
+                return entry
+            if path in self._failed:
+                return self._checkout(self.main.path)
+            self._make_room(os.path.getsize(path))
+            print(f"Loading model '{os.path.basename(path)}' on demand...")
+            model_obj = self.loader(path)
+            if not model_obj:
+                print(f"WARNING: Model '{os.path.basename(path)}' failed to load; its crews use the main model.")
+                self._failed.add(path)
+                return self._checkout(self.main.path)
+            with self._lock:
+                tokenizer = self._tokenizers.pop(path, None)
+                if tokenizer is not None:
+                    tokenizer.close()  # the loaded model tokenizes from now on
+                entry = self._models.setdefault(path, ResidentModel(path))
+                entry.model_obj = model_obj
+                entry.base_bytes = model_memory_bytes(model_obj["model"])
+                entry.loads += 1
+                entry.in_use += 1
+                entry.last_used = time.monotonic()
+            self._make_room(0)
+            return entry
+
+    def _checkout(self, path):
+        with self._lock:
+            entry = self._models.get(path)
+            if entry is None or not entry.loaded:
+                return None
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            return entry
+
+    def release(self, entry):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    def resident_bytes(self):
+        return sum(entry.memory_bytes() for entry in self._models.values())
+
+    def _make_room(self, needed):
+        """Unloads idle models, least recently used first, until `needed` more bytes fit the budget."""
+        while True:
+            with self._lock:
+                if self.resident_bytes() + needed <= self.budget_bytes:
+                    return
+                idle = [e for e in self._models.values() if e.loaded and not e.pinned and e.in_use == 0]
+                if not idle:
+                    print(f"WARNING: Models use {_size(self.resident_bytes())}, over the {_size(self.budget_bytes)} budget, and none is idle.")
+                    return
+                victim = min(idle, key=lambda e: e.last_used)
+                model_obj, victim.model_obj = victim.model_obj, None
+                self.unloads += 1
+            print(f"Unloading idle model '{os.path.basename(victim.path)}' to stay within the memory budget.")
+            _close_model_obj(model_obj)
+
+    def count_tokens(self, name, text):
+        """Tokens of `text` in the vocabulary of `name`'s model, without loading its weights."""
+        data = text.encode("utf-8")
+        path = self.resolve(name)
+        entry = self._checkout(path)  # a loaded model is leased, so it cannot be unloaded while it tokenizes
+        if entry is not None:
+            try:
+                return len(entry.model_obj["model"].tokenize(data, add_bos=False, special=True))
+            finally:
+                self.release(entry)
+        with self._lock:  # tokenizers are closed under the lock too
+            tokenizer = self._tokenizers.get(path)
+            if tokenizer is None:
+                tokenizer = self._tokenizers[path] = vocab_tokenizer(path)
+            return len(tokenizer.tokenize(data, add_bos=False, special=True))
+
+    def report(self):
+        """Status lines: the budget, then one line per known model with its memory use."""
+        with self._lock:
+            names = {}
+            for name, path in self._names.items():
+                names.setdefault(path, []).append(name)
+            lines = [f"Models: {sum(e.loaded for e in self._models.values())} loaded, "
+                     f"{_size(self.resident_bytes())} of {_size(self.budget_bytes)} budget, {self.unloads} unloads"]
+            for path, aliases in names.items():
+                entry = self._models.get(path)
+                label = f"  {'/'.join(aliases)} ({os.path.basename(path)}): "
+                if entry is None or not entry.loaded:
+                    lines.append(label + ("failed to load" if path in self._failed else "not loaded"))
+                elif entry.pinned:
+                    lines.append(label + f"{_size(entry.memory_bytes())}, pinned")
+                elif entry.in_use:
+                    lines.append(label + f"{_size(entry.memory_bytes())}, in use")
+                else:
+                    lines.append(label + f"{_size(entry.memory_bytes())}, idle {time.monotonic() - entry.last_used:.0f} s")
+            return "\n".join(lines)
+
+    def close(self):
+        """Unloads every on-demand model (the main model belongs to its owner) and closes the tokenizers."""
+        with self._lock:
+            entries = [e for e in self._models.values() if e.loaded and not e.pinned]
+            for tokenizer in self._tokenizers.values():
+                tokenizer.close()
+            self._tokenizers.clear()
+        for entry in entries:
+            model_obj, entry.model_obj = entry.model_obj, None
+            _close_model_obj(model_obj)
+
+
+def _close_model_obj(model_obj):
+    model_obj["scheduler"].shutdown()
+    for key in ("batch_engine", "prefix_cache", "response_cache", "lora"):
+        if model_obj.get(key):
+            model_obj[key].close()
+    model_obj["model"].close()
+
+
+def open_model_registry(main_obj, loader):
+    """
+    Registry of local models around the activated one.
+    Env: MODEL_RAM_BUDGET_MB (default 75% of physical memory), RAVEN_GGUF_MODEL_PATH_<NAME> per extra model
+    """
+    budget_mb = env_int("MODEL_RAM_BUDGET_MB", 0)
+    if budget_mb > 0:
+        budget = budget_mb * 2**20
+    else:
+        budget = int((physical_memory_bytes() or 16 * 2**30) * 0.75)
+    try:
+        registry = ModelRegistry(main_obj, loader, budget)
+    except Exception as e:
+        print(f"WARNING: Model registry unavailable ({e}); every crew uses the main model.")
+        return None
+    return registry
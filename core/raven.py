@@ -3,36 +3,102 @@
 import sys
 import os
 import json
+import functools
+import threading
+from contextlib import contextmanager
+import logging
+from dataclasses import dataclass
 import time         # Added to wait for the server to start
 import subprocess   # Added to run the server executable
 import requests     # Added for server interaction
 from dotenv import load_dotenv
-from llama_cpp import Llama
-import torch        # Added for CUDA availability check
+# llama_cpp is imported where it is used: the server backends never need it.
 
 # --- Mocked Tool Functions (as in original) ---
 # In a real application, these would be imported from your project structure.
 # NOTE: Using the actual functions from the project now
 from bridge.tools.tools import list_tools, get_tool_description
+from core import autotune, metrics, tracing
+# The caches, the batch engine and the model registry (diskcache, llama_cpp) are imported by the activation
+# functions that build them, so launching the UI or console does not load them.
+from core.server_client import LlamaServerClient
+from core.server_pool import start_server_pool
+from core.scheduler import InferenceScheduler, PRIORITY_NORMAL
+from core.env import env_bool, env_int, env_str
 
 # --- Model Loading Functions ---
 
-def load_gguf_model(system_prompt=None):
+def gpu_offload_supported():
+    """Asks llama.cpp whether it was built with a GPU backend, without importing torch."""
+    if env_bool("SKIP_GPU_CHECK", False):
+        return True
+    import llama_cpp
+    return bool(llama_cpp.llama_supports_gpu_offload())
+
+@contextmanager
+def _llama_load_progress(progress):
+    """
+    Forwards llama.cpp's model-loading log to `progress` while a Llama is constructed.
+    Without a progress callback of its own llama.cpp logs a "." whenever the loaded percentage
+    grows (a newline at 100%), which gives an approximate percentage, and it reports how many
+    layers it offloaded to the GPU.
+    """
+    if progress is None:
+        yield
+        return
+    import ctypes
+    import llama_cpp
+    from llama_cpp import _logger
+
+    percent = 0
+
+    @llama_cpp.llama_log_callback
+    def on_log(level, text, user_data):
+        nonlocal percent
+        _logger.llama_log_callback(level, text, user_data)  # keep llama-cpp-python's own output
+        if text == b".":
+            percent += 1
+            progress(f"LOADING MODEL ~{min(percent, 99)}%")
+        elif b"offloaded" in text and b"layers" in text:
+            progress(text.decode("utf-8", "replace").split(":")[-1].strip().upper())
+
+    llama_cpp.llama_log_set(on_log, ctypes.c_void_p(0))
+    try:
+        yield
+    finally:
+        llama_cpp.llama_log_set(_logger.llama_log_callback, ctypes.c_void_p(0))
+
+def model_context_size(load_params, small_context=False):
+    """
+    n_ctx of a loaded Llama: CONTEXT_SIZE, or with `small_context` one batch (n_batch, default 512) for a Llama
+    whose context only tokenizes and measures throughput while a batch engine generates in a context of its own.
+    """
+    context_size = env_int("CONTEXT_SIZE", 4096)
+    if small_context:
+        # Not smaller than n_batch: llama-cpp-python clips n_batch to n_ctx, and the batch engine copies it.
+        return min(context_size, load_params.get("n_batch", 512))
+    return context_size
+
+def load_gguf_model(system_prompt=None, progress=None, model_path=None, small_context=False):
     """
     Loads the Llama GGUF model directly using llama-cpp-python with CUDA acceleration.
-    This is for the 'cuda' backend.
+    This is for the 'cuda' backend. `model_path` defaults to RAVEN_GGUF_MODEL_PATH.
+    `small_context` loads it with a one-batch context (see `model_context_size`).
     """
     try:
-        print("Checking for CUDA availability for direct library use...")
-        if not torch.cuda.is_available():
-            print("WARNING: PyTorch reports CUDA is not available for direct use.")
-            print("         llama-cpp-python might fail if it was not compiled with CUDA support.")
+        from llama_cpp import Llama
+
+        print("Checking GPU offload support for direct library use...")
+        if not gpu_offload_supported():
+            print("WARNING: llama-cpp-python reports no GPU offload support.")
+            print("         Reinstall it with CUDA enabled (CMAKE_ARGS=\"-DGGML_CUDA=on\").")
             return None
+
+        print("llama-cpp-python was built with GPU offload support.")
         
-        print(f"PyTorch reports CUDA is available. GPU: {torch.cuda.get_device_name(0)}")
-        
-        raw_model_path = os.getenv("RAVEN_GGUF_MODEL_PATH")
-        model_path = raw_model_path.split('#')[0].strip() if raw_model_path else None
+        if model_path is None:
+            raw_model_path = os.getenv("RAVEN_GGUF_MODEL_PATH")
+            model_path = raw_model_path.split('#')[0].strip() if raw_model_path else None
         
         if not model_path or not os.path.exists(model_path):
             print(f"ERROR: GGUF Model file not found. Path checked: {os.path.abspath(model_path if model_path else '')}")
@@ -40,81 +106,465 @@ def load_gguf_model(system_prompt=None):
             return None
 
         n_gpu_layers = -1  # Offload all possible layers to GPU
-        raw_cpu_threads = os.getenv("CPU_THREADS", str(os.cpu_count() or 4))
-        cpu_threads = int(raw_cpu_threads.split('#')[0].strip())
-        raw_context_size = os.getenv("CONTEXT_SIZE", "4096")
-        context_size = int(raw_context_size.split('#')[0].strip())
-        
-        print(f"Loading model with all possible GPU layers, {cpu_threads} CPU threads, {context_size} context size...")
+
+        load_params = {"n_threads": os.cpu_count() or 4}
+        profile = autotune.load_profile(model_path)
+        if profile:
+            # Tuned for this model on this machine by `python -m core.autotune`; explicit .env settings override it.
+            load_params.update(profile)
+            print(f"Using autotuned profile: {profile}")
+        load_params["n_threads"] = env_int("CPU_THREADS", load_params["n_threads"])
+        context_size = model_context_size(load_params, small_context)
+
+        print(f"Loading model with all possible GPU layers, {load_params['n_threads']} CPU threads, {context_size} context size...")
         
-        model = Llama(
-            model_path=model_path,
-            n_gpu_layers=n_gpu_layers,
-            n_threads=cpu_threads,
-            n_ctx=context_size,
-            verbose=True,
-            offload_kqv=True,
-        )
+        with _llama_load_progress(progress):
+            model = Llama(
+                model_path=model_path,
+                n_gpu_layers=n_gpu_layers,
+                n_ctx=context_size,
+                verbose=True,
+                offload_kqv=True,
+                **load_params,
+            )
         print("GGUF Model loaded successfully into memory!")
         return model
     except Exception as e:
         print(f"Error loading GGUF model directly: {e}")
         print("TROUBLESHOOTING: Ensure you installed llama-cpp-python with CUDA support.")
+        print("                 On machines without a GPU use the CPU backend instead.")
+        return None
+
+NUMA_STRATEGIES = {"off": 0, "distribute": 1, "isolate": 2, "numactl": 3, "mirror": 4}
+
+def pin_to_physical_cores(n_threads):
+    """
+    Restricts every thread of the process, and so every thread llama.cpp spawns later, to one
+    hyperthread per physical core, so compute threads never share a core.
+    Returns the pinned CPU ids, or None when pinning is unsupported or would oversubscribe the cores.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        print("CPU pinning is not supported on this platform; threads are left to the OS scheduler.")
+        return None
+    cpus = autotune.physical_core_cpus()
+    if not cpus:
+        print("CPU topology unknown; threads are left to the OS scheduler.")
         return None
+    if n_threads > len(cpus):
+        print(f"{n_threads} threads exceed the {len(cpus)} physical cores; not pinning.")
+        return None
+    try:
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        thread_ids = [0]
+    for tid in thread_ids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass  # the thread exited meanwhile
+    return cpus
+
+def load_cpu_model(progress=None, model_path=None, small_context=False):
+    """
+    Loads the GGUF model for CPU-only inference (the 'cpu' backend): no layers offloaded, separate
+    decode (CPU_THREADS) and prefill (CPU_THREADS_BATCH) thread counts defaulting to the physical
+    core count, threads pinned to physical cores, and mmap/mlock/NUMA placement from .env.
+    An autotune profile is used when one exists; explicit .env settings override it.
+    `model_path` defaults to RAVEN_GGUF_MODEL_PATH; `small_context` loads it with a one-batch context (see `model_context_size`).
+    Returns `(model, throughput)`, or `(None, None)` on failure.
+    """
+    try:
+        from llama_cpp import Llama
+
+        model_path = model_path or env_str("RAVEN_GGUF_MODEL_PATH")
+        if not model_path or not os.path.exists(model_path):
+            print(f"ERROR: GGUF Model file not found. Path checked: {os.path.abspath(model_path if model_path else '')}")
+            print("       Ensure RAVEN_GGUF_MODEL_PATH is set correctly in your .env file.")
+            return None, None
+
+        cores = autotune.physical_cores()
+        load_params = {"n_threads": cores, "n_threads_batch": cores, "use_mmap": True, "use_mlock": False}
+        profile = autotune.load_profile(model_path)
+        if profile:
+            load_params.update(profile)
+            print(f"Using autotuned profile: {profile}")
+        load_params["n_threads"] = env_int("CPU_THREADS", load_params["n_threads"])
+        load_params["n_threads_batch"] = env_int("CPU_THREADS_BATCH", load_params["n_threads_batch"])
+        load_params["use_mmap"] = env_bool("CPU_USE_MMAP", load_params["use_mmap"])
+        load_params["use_mlock"] = env_bool("CPU_USE_MLOCK", load_params["use_mlock"])
+        context_size = model_context_size(load_params, small_context)
+
+        numa = env_str("CPU_NUMA", "off").lower()
+        if numa not in NUMA_STRATEGIES:
+            print(f"WARNING: Unknown CPU_NUMA '{numa}'; expected one of {', '.join(NUMA_STRATEGIES)}. NUMA stays off.")
+            numa = "off"
+
+        pinned = None
+        # 'distribute' and 'isolate' place llama.cpp's threads themselves; 'numactl' honours the pinned set.
+        if env_bool("CPU_PIN_THREADS", True) and numa in ("off", "numactl", "mirror"):
+            pinned = pin_to_physical_cores(max(load_params["n_threads"], load_params["n_threads_batch"]))
+
+        print(f"Loading model on CPU: {load_params['n_threads']} decode / {load_params['n_threads_batch']} prefill threads, "
+              f"pinned to CPUs {pinned if pinned else 'none'}, mmap {'on' if load_params['use_mmap'] else 'off'}, "
+              f"mlock {'on' if load_params['use_mlock'] else 'off'}, NUMA {numa}, {context_size} context size...")
+
+        with _llama_load_progress(progress):
+            model = Llama(
+                model_path=model_path,
+                n_gpu_layers=0,
+                n_ctx=context_size,
+                numa=NUMA_STRATEGIES[numa],
+                verbose=True,
+                **load_params,
+            )
+        print("GGUF Model loaded successfully into memory!")
+
+        throughput = None
+        if env_bool("CPU_BENCH_ON_LOAD", True):
+            if progress:
+                progress("MEASURING THROUGHPUT")
+            throughput = autotune.measure(model, prompt_tokens=64, gen_tokens=16)
+            print(f"CPU throughput: prefill {throughput['prefill_tps']:.1f} tok/s "
+                  f"({throughput['prefill_ms']:.0f} ms to first token after {throughput['prompt_tokens']} prompt tokens), "
+                  f"decode {throughput['decode_tps']:.1f} tok/s")
+        return model, throughput
+    except Exception as e:
+        print(f"Error loading GGUF model on CPU: {e}")
+        return None, None
 
 # --- Prompting and Generation ---
 
+GENERATION_PROMPT = "<|im_start|>assistant\n"
+
+def format_message(message):
+    """Renders one chat message in the Qwen2 template."""
+    role = message["role"]
+    # The model expects 'assistant', not 'raven'
+    if role == "raven":
+        role = "assistant"
+    return f"<|im_start|>{role}\n{message['content']}<|im_end|>\n"
+
 def format_prompt(messages, add_generation_prompt=True):
     """
     Formats the prompt for Qwen2 models like RoboBrain2.0.
     """
-    prompt = ""
-    for message in messages:
-        role = message["role"]
-        content = message["content"]
-        # The model expects 'assistant', not 'raven'
-        if role == "raven":
-            role = "assistant"
-        prompt += f"<|im_start|>{role}\n{content}<|im_end|>\n"
-        
-    if add_generation_prompt:
-        prompt += "<|im_start|>assistant\n"
+    with tracing.span("format_prompt", messages=len(messages)) as span:
+        prompt = "".join(format_message(message) for message in messages)
+        if add_generation_prompt:
+            prompt += GENERATION_PROMPT
+        span.set_attribute("chars", len(prompt))
     return prompt
 
-def generate_response(model_obj, messages, max_tokens=72, temperature=0.8, top_k=50, top_p=0.95, repetition_penalty=1.15, stream=False):
-    """Dispatches response generation to the correct backend."""
+def count_tokens(model_obj, text, gguf=None):
+    """
+    Number of tokens `text` takes in the model's own vocabulary (chat template markers count as one token each).
+    `gguf` names a model of the registry (see `crew_model`) instead of the activated one.
+    """
+    registry = model_obj.get("registry") if gguf else None
+    if registry is not None:
+        return registry.count_tokens(gguf, text)
+    if model_obj["type"] == "llamacpp_server":
+        return len(server_router(model_obj).tokenize(text))
+    return len(model_obj["model"].tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+def context_size(model_obj, gguf=None):
+    """
+    Context length available to one conversation: n_ctx of the local model (per sequence with a batch engine),
+    or the per-slot context of the server. `gguf` names a model of the registry, which is loaded if it is not yet.
+    """
+    if gguf and model_obj.get("registry") is not None:
+        with crew_model(model_obj, gguf) as crew_obj:
+            return context_size(crew_obj)
+    if model_obj["type"] == "llamacpp_server":
+        return server_router(model_obj).context_size() or env_int("SERVER_CONTEXT_SIZE", 4096)
+    if model_obj.get("batch_engine"):
+        return model_obj["batch_engine"].n_ctx_seq
+    return model_obj["model"].n_ctx()
+
+def scheduled_response(model_obj, messages, priority=PRIORITY_NORMAL, deadline=None, **kwargs):
+    """
+    Runs `generate_response` through the model's inference scheduler and waits for the result.
+    `deadline` is an absolute time.monotonic() value; raises scheduler.DeadlineExceeded if it passes while queued.
+    Falls back to a direct call for model_obj dicts without a scheduler.
+    While the model is still loading in the background the request waits for it (see `activate_raven_background`).
+    Memoized temperature-0 replies are answered here, without queueing.
+    """
+    wait_until_ready(model_obj)
+    scheduler = model_obj.get("scheduler")
+    if scheduler is None:
+        return generate_response(model_obj, messages, **kwargs)
+    key, text = memo_lookup(model_obj, messages, **kwargs)
+    if text is not None:
+        return _replay_memoized(model_obj, kwargs.get("crew_name"), text, kwargs.get("on_token"), kwargs.get("stream", False))
+    # The job runs in the caller's context, so its generate span nests under this one; the gap is queue time.
+    with tracing.span("scheduled_response", priority=priority):
+        return scheduler.schedule(_generate_and_memoize, (key, model_obj, messages), kwargs, priority=priority, deadline=deadline).result()
+
+@contextmanager
+def crew_model(model_obj, gguf=None):
+    """
+    Yields the model_obj a crew's turn runs on: the registry model named `gguf`, loaded on demand and
+    kept resident until the turn ends, or `model_obj` itself without a registry (server backends) or name.
+    """
+    registry = model_obj.get("registry") if gguf else None
+    if registry is None:
+        yield model_obj
+        return
+    entry = registry.acquire(gguf)
+    try:
+        yield entry.model_obj
+    finally:
+        registry.release(entry)
+
+def attach_scheduler(model_obj, workers):
+    """Gives `model_obj` the inference scheduler that owns it from now on."""
+    model_obj["scheduler"] = InferenceScheduler(workers=workers)
+    return model_obj
+
+def format_prompt_prefix(messages):
+    """
+    Renders the leading system message exactly as `format_prompt` does.
+    This is the part of every prompt that stays fixed between turns and can be cached.
+    """
+    if not messages or messages[0]["role"] != "system":
+        return ""
+    return format_prompt(messages[:1], add_generation_prompt=False)
+
+def generate_response(model_obj, messages, max_tokens=72, temperature=0.8, top_k=50, top_p=0.95, repetition_penalty=1.15, stream=False, crew_name=None,
+                      on_token=None, grammar=None, lora=None):
+    """
+    Dispatches response generation to the correct backend.
+    `crew_name` identifies the conversation so backends can keep its evaluated context around.
+    `on_token(chunk)` receives each `TokenChunk` as soon as it is decoded; the full text is still returned.
+    When it returns False, generation stops there and the text so far is returned (and not memoized).
+    `grammar` (GBNF text) constrains decoding, e.g. to a single tool command.
+    `lora` is an `(adapter path, scale)` pair applied to the local base model for this call (server backends ignore it).
+    Temperature-0 replies are memoized in `model_obj["response_cache"]`; a repeat skips inference.
+    """
+    wait_until_ready(model_obj)
+    key, text = memo_lookup(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, grammar=grammar, lora=lora)
+    if text is not None:
+        return _replay_memoized(model_obj, crew_name, text, on_token, stream)
+    return _generate_and_memoize(key, model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream,
+                                 crew_name, on_token, grammar, lora)
+
+def memo_lookup(model_obj, messages, max_tokens=72, temperature=0.8, top_k=50, top_p=0.95, repetition_penalty=1.15, grammar=None, lora=None, **_):
+    """
+    Returns `(key, text)` for a generation: `text` is the memoized reply or None, `key` is where to store
+    a fresh reply (None when the call is not deterministic or no response cache is attached).
+    """
+    cache = model_obj.get("response_cache")
+    if cache is None or temperature > 0:
+        return None, None
+    params = {"max_tokens": max_tokens, "top_k": top_k, "top_p": top_p, "repetition_penalty": repetition_penalty, "grammar": grammar}
+    if lora:
+        params["lora"] = list(lora)
+    key = cache.key_for(format_prompt(messages), params)
+    return key, cache.get(key)
+
+def _replay_memoized(model_obj, crew_name, text, on_token, stream):
+    tracing.current_span().set_attribute("cache", "response")
+    metrics.record(crew_name, backend_name(model_obj), cache="response")
+    if on_token is not None:
+        on_token(TokenChunk(text, 0, 0.0))
+    elif stream:
+        print(text)
+    return text
+
+def _generate_and_memoize(key, model_obj, messages, max_tokens=72, temperature=0.8, top_k=50, top_p=0.95, repetition_penalty=1.15, stream=False,
+                          crew_name=None, on_token=None, grammar=None, lora=None):
+    text, stopped = _generate(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream, crew_name, on_token,
+                              grammar, lora)
+    if key and text and not stopped:
+        # A reply the caller stopped early (on_token returned False) is a fragment, not the model's answer.
+        model_obj["response_cache"].set(key, text)
+    return text
+
+def _generate(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream, crew_name, on_token, grammar, lora):
+    """Runs the backend in a `generate` span. Returns `(text, stopped)`: `stopped` is True when `on_token` ended it early."""
+    with tracing.span("generate", backend=backend_name(model_obj), crew=crew_name, max_tokens=max_tokens, temperature=temperature,
+                      grammar=bool(grammar), streamed=on_token is not None, lora=os.path.basename(lora[0]) if lora else None) as span:
+        text, stopped = _run_backend(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream, crew_name,
+                                     on_token, grammar, lora, span)
+        span.set_attribute("chars", len(text) if text else 0)
+    return text, stopped
+
+def _run_backend(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream, crew_name, on_token, grammar, lora,
+                 span):
+    if on_token is not None:
+        response_stream = stream_response(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name=crew_name,
+                                          grammar=grammar, lora=lora)
+        chunks = iter(response_stream)
+        stopped = False
+        try:
+            for chunk in chunks:
+                if chunk.index == 0:
+                    span.add_event("first_token")
+                if on_token(chunk) is False:
+                    # The caller has what it needs (e.g. a complete tool command): stop decoding.
+                    span.add_event("stopped_early")
+                    stopped = True
+                    break
+        except (requests.exceptions.RequestException, ConnectionError) as e:
+            print(f"\nError communicating with llamacpp server: {e}")
+            return None, False
+        except Exception as e:
+            print(f"\nError generating streamed response: {e}")
+            return None, False
+        finally:
+            chunks.close()
+        usage = response_stream.usage_record()
+        span.set_attributes(usage)
+        if not stopped and _cut_short(usage, max_tokens, grammar, span):
+            return None, False
+        return response_stream.text.strip(), stopped
+    usage = {}
     if model_obj["type"] == "llamacpp_server":
-        return generate_server_response(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream)
+        text = generate_server_response(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream,
+                                        crew_name=crew_name, grammar=grammar, usage=usage)
+    elif model_obj.get("batch_engine"):
+        text = generate_batched_response(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream,
+                                         crew_name=crew_name, grammar=grammar, usage=usage, lora=lora)
     else:  # programmatic_gguf
-        return generate_local_response(model_obj["model"], messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream)
+        text = generate_local_response(model_obj["model"], messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream,
+                                       prefix_cache=model_obj.get("prefix_cache"),
+                                       crew_states=model_obj.get("crew_states"), crew_name=crew_name, grammar=grammar, usage=usage,
+                                       lora_adapters=model_obj.get("lora"), lora=lora)
+    if usage:
+        span.set_attributes(usage)
+        metrics.record(crew_name, backend_name(model_obj), **usage)
+    if text is not None and _cut_short(usage, max_tokens, grammar, span):
+        return None, False
+    return text, False
 
-def generate_local_response(model, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream):
-    """Generates a response using the locally loaded GGUF model."""
+def _cut_short(usage, max_tokens, grammar, span):
+    """
+    Whether a grammar-constrained generation stopped at `max_tokens` (finish reason "length"): the grammar
+    only ends on a complete command, so the text is a fragment and is rejected instead of parsed.
+    """
+    if not grammar or usage.get("completion_tokens", 0) < max_tokens:
+        return False
+    print(f"\nError: the constrained reply reached max_tokens ({max_tokens}) before it was complete; it was discarded.")
+    span.set_attribute("finish_reason", "length")
+    return True
+
+LOCAL_STOP_TOKENS = ["<|im_end|>", "User:", "System:"] # Helps prevent the model from hallucinating a user turn
+
+@functools.lru_cache(maxsize=8)
+def local_grammar(grammar):
+    """Parsed `LlamaGrammar` for GBNF text, kept so repeated tool calls skip the parse."""
+    if not grammar:
+        return None
+    from llama_cpp import LlamaGrammar
+    return LlamaGrammar.from_string(grammar, verbose=False)
+
+def backend_name(model_obj):
+    """Metrics label of a model_obj's backend."""
+    return "server" if model_obj.get("type") == "llamacpp_server" else "local"
+
+def _reset_local_perf(model):
+    import llama_cpp
+    llama_cpp.llama_perf_context_reset(model.ctx)
+
+def _local_usage(model, prompt):
+    """
+    Token counts and timings of the generation that just ran on `prompt`, from llama.cpp's per-context perf
+    counters (reset by `_reset_local_perf` before it). Prompt tokens already in the KV cache were not evaluated;
+    a full prefix match still re-evaluates one token, which llama.cpp counts as a decode step.
+    """
+    import llama_cpp
+    perf = llama_cpp.llama_perf_context(model.ctx)
+    prompt_tokens = len(model.tokenize(prompt.encode("utf-8"), special=True))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": max(0, prompt_tokens - max(perf.n_p_eval, 1)),
+        # The last sampled token is never evaluated.
+        "completion_tokens": max(0, model.n_tokens - prompt_tokens + 1),
+        "prefill_ms": perf.t_p_eval_ms,
+        "decode_ms": perf.t_eval_ms,
+    }
+
+def _server_usage(result):
+    """Token counts and timings from llama-server's `timings`, `tokens_evaluated` and `tokens_cached` fields."""
+    timings = result.get("timings", result)
+    prompt_tokens = result.get("tokens_evaluated", timings.get("prompt_n", 0))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": max(0, prompt_tokens - timings.get("prompt_n", prompt_tokens)),
+        "completion_tokens": timings.get("predicted_n", 0),
+        "prefill_ms": timings.get("prompt_ms", 0.0),
+        "decode_ms": timings.get("predicted_ms", 0.0),
+    }
+
+def _prepare_local_context(model, messages, prefix_cache=None, crew_states=None, crew_name=None, lora_adapters=None, lora=None):
+    """
+    Restores whatever evaluated context the caches hold for this conversation before a local call,
+    and attaches the conversation's LoRA adapter (`lora`, or none) when `lora_adapters` manages the model.
+    """
+    if not (crew_states or prefix_cache or lora_adapters):
+        return
+    with tracing.span("restore_context") as span:
+        restored = False
+        if crew_states:
+            # Bring back this crew's evaluated history if another crew used the model since.
+            restored = crew_states.switch_to(model, crew_name)
+        if lora_adapters is not None and lora_adapters.apply(model, lora):
+            span.set_attribute("lora_swap_ms", lora_adapters.last_swap_ms)
+            if not restored:
+                # The resident context was evaluated with other weights; a crew snapshot was taken under this adapter.
+                model.reset()
+        if prefix_cache:
+            # Restore the evaluated system prompt instead of prefilling it from token zero.
+            prefix_cache.prefill(model, format_prompt_prefix(messages), lora_adapters.variant() if lora_adapters else "")
+
+def iter_local_chunks(model, messages, max_tokens, temperature, top_k, top_p, repetition_penalty,
+                      prefix_cache=None, crew_states=None, crew_name=None, grammar=None, usage=None, lora_adapters=None, lora=None):
+    """
+    Yields text chunks from the local GGUF model as they are decoded. Closing the iterator stops generation.
+    When given a dict, `usage` is filled with token counts and timings once the iterator finishes.
+    """
+    _reset_local_perf(model)
+    _prepare_local_context(model, messages, prefix_cache, crew_states, crew_name, lora_adapters, lora)
     prompt = format_prompt(messages)
-    stop_tokens = ["<|im_end|>", "User:", "System:"] # Helps prevent the model from hallucinating a user turn
-    
+    try:
+        for output in model(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            repeat_penalty=repetition_penalty,
+            stop=LOCAL_STOP_TOKENS,
+            grammar=local_grammar(grammar),
+            stream=True,
+        ):
+            yield output["choices"][0]["text"]
+    finally:
+        if usage is not None:
+            usage.update(_local_usage(model, prompt))
+
+def generate_local_response(model, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream,
+                            prefix_cache=None, crew_states=None, crew_name=None, grammar=None, usage=None, lora_adapters=None, lora=None):
+    """
+    Generates a response using the locally loaded GGUF model. `usage` (a dict) receives token counts and timings.
+    `lora_adapters` (the model_obj's `LoraAdapters`) attaches the `lora` adapter, or detaches any for None.
+    """
     try:
         if stream:
             response_text = ""
             sys.stdout.write("Raven (CUDA): ")
             sys.stdout.flush()
-            for output in model(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                repeat_penalty=repetition_penalty,
-                stop=stop_tokens,
-                stream=True,
-            ):
-                text_chunk = output["choices"][0]["text"]
+            for text_chunk in iter_local_chunks(model, messages, max_tokens, temperature, top_k, top_p, repetition_penalty,
+                                                prefix_cache, crew_states, crew_name, grammar, usage, lora_adapters, lora):
                 response_text += text_chunk
                 sys.stdout.write(text_chunk)
                 sys.stdout.flush()
             print()
             return response_text
         else:
+            _reset_local_perf(model)
+            _prepare_local_context(model, messages, prefix_cache, crew_states, crew_name, lora_adapters, lora)
+            prompt = format_prompt(messages)
             output = model(
                 prompt,
                 max_tokens=max_tokens,
@@ -122,76 +572,256 @@ def generate_local_response(model, messages, max_tokens, temperature, top_k, top
                 top_k=top_k,
                 top_p=top_p,
                 repeat_penalty=repetition_penalty,
-                stop=stop_tokens,
+                stop=LOCAL_STOP_TOKENS,
+                grammar=local_grammar(grammar),
                 stream=False
             )
+            if usage is not None:
+                usage.update(_local_usage(model, prompt))
             return output["choices"][0]["text"].strip()
     except Exception as e:
         print(f"Error generating GGUF response: {e}")
         return None
 
-def generate_server_response(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream):
-    """Generates a response by sending a request to the llamacpp server."""
-    prompt = format_prompt(messages)
-    server_url = model_obj["url"] + "/completion"
-    
-    headers = {"Content-Type": "application/json"}
-    data = {
-        "prompt": prompt,
+def local_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name=None, grammar=None,
+                 usage=None, lora=None):
+    """
+    Text chunks of a local generation: one sequence of the model's batch engine when it has one
+    (running alongside other generations), else `iter_local_chunks` on the Llama itself.
+    """
+    engine = model_obj.get("batch_engine")
+    if engine is not None:
+        return engine.stream(format_prompt(messages), max_tokens, temperature, top_k, top_p, repetition_penalty, LOCAL_STOP_TOKENS,
+                             grammar, lora, usage)
+    return iter_local_chunks(model_obj["model"], messages, max_tokens, temperature, top_k, top_p, repetition_penalty,
+                             model_obj.get("prefix_cache"), model_obj.get("crew_states"), crew_name, grammar, usage,
+                             model_obj.get("lora"), lora)
+
+def generate_batched_response(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream,
+                              crew_name=None, grammar=None, usage=None, lora=None):
+    """Generates a response through the model's batch engine. `usage` (a dict) receives token counts and timings."""
+    try:
+        response_text = ""
+        if stream:
+            sys.stdout.write("Raven (batched): ")
+            sys.stdout.flush()
+        for text_chunk in local_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name,
+                                       grammar, usage, lora):
+            response_text += text_chunk
+            if stream:
+                sys.stdout.write(text_chunk)
+                sys.stdout.flush()
+        if stream:
+            print()
+            return response_text
+        return response_text.strip()
+    except Exception as e:
+        print(f"Error generating batched GGUF response: {e}")
+        return None
+
+def server_client(model_obj):
+    """Returns the pooled client of a server model_obj, creating it for hand-built dicts that only carry a URL."""
+    client = model_obj.get("client")
+    if client is None:
+        client = model_obj["client"] = LlamaServerClient.from_env(model_obj["url"])
+    return client
+
+def server_router(model_obj):
+    """Returns what server requests go through: the instance pool in pool mode, otherwise the single client."""
+    return model_obj.get("pool") or server_client(model_obj)
+
+def server_payload(messages, max_tokens, temperature, top_k, top_p, repetition_penalty, grammar=None):
+    """Builds the llama-server /completion request body (slot and streaming fields are added by the client)."""
+    payload = {
+        "prompt": format_prompt(messages),
         "n_predict": max_tokens,
         "temperature": temperature,
         "top_k": top_k,
         "top_p": top_p,
         "repeat_penalty": repetition_penalty,
         "stop": ["<|im_end|>"],
-        "stream": stream
     }
+    if grammar:
+        payload["grammar"] = grammar
+    return payload
+
+def iter_server_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name=None, timings=None,
+                       grammar=None):
+    """
+    Yields text chunks streamed by llama-server. Closing the iterator drops the connection, which stops generation.
+    When given a dict, `timings` is filled with the server's final timings block.
+    """
+    data = server_payload(messages, max_tokens, temperature, top_k, top_p, repetition_penalty, grammar)
+    # In pool mode a slow start is hedged to a second instance until the first token (SERVER_HEDGE_AFTER_MS).
+    with server_router(model_obj).stream(data, crew_name) as events:
+        for event in events:
+            if timings is not None and "timings" in event:
+                timings.update(event["timings"])
+                timings.update({key: event[key] for key in ("tokens_evaluated", "tokens_cached") if key in event})
+            if event.get("content"):
+                yield event["content"]
 
+def generate_server_response(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, stream, crew_name=None,
+                             grammar=None, usage=None):
+    """Generates a response by sending a request to the llamacpp server. `usage` (a dict) receives token counts and timings."""
     try:
         if stream:
+            timings = {}
             response_text = ""
             sys.stdout.write("Raven (Server): ")
             sys.stdout.flush()
-            with requests.post(server_url, headers=headers, json=data, stream=True) as response:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith('data: '):
-                            json_data = json.loads(decoded_line[6:])
-                            text_chunk = json_data.get("content", "")
-                            response_text += text_chunk
-                            sys.stdout.write(text_chunk)
-                            sys.stdout.flush()
+            for text_chunk in iter_server_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name,
+                                                 timings, grammar=grammar):
+                response_text += text_chunk
+                sys.stdout.write(text_chunk)
+                sys.stdout.flush()
             print()
+            if usage is not None and timings:
+                usage.update(_server_usage(timings))
             return response_text
         else:
-            response = requests.post(server_url, headers=headers, json=data, stream=False)
-            response.raise_for_status()
-            return response.json()["content"].strip()
+            data = server_payload(messages, max_tokens, temperature, top_k, top_p, repetition_penalty, grammar)
+            result = server_router(model_obj).complete(data, crew_name=crew_name)
+            if usage is not None and "timings" in result:
+                usage.update(_server_usage(result))
+            return result["content"].strip()
             
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ConnectionError) as e:
         print(f"\nError communicating with llamacpp server: {e}")
         return None
     except json.JSONDecodeError as e:
         print(f"\nError decoding server response: {e}")
         return None
 
+def status_report(model_obj):
+    """Returns one report line per scheduler, cache or server pool attached to `model_obj` (for status displays)."""
+    if not model_obj:
+        return []
+    if not is_ready(model_obj):
+        return [f"Backend: starting ({model_obj.get('status', 'loading')})"]
+    if model_obj.get("error"):
+        return [f"Backend: offline ({model_obj['error']})"]
+    lines = []
+    throughput = model_obj.get("throughput")
+    if throughput:
+        lines.append(f"Load benchmark: prefill {throughput['prefill_tps']:.1f} tok/s, decode {throughput['decode_tps']:.1f} tok/s")
+    parts = [model_obj.get(key) for key in ("registry", "scheduler", "batch_engine", "lora", "prefix_cache", "response_cache", "semantic_cache", "crew_states", "pool")]
+    lines += [line for part in parts if part for line in part.report().splitlines()]
+    return lines + metrics.REGISTRY.report().splitlines()
+
+# --- Streaming ---
+
+@dataclass
+class TokenChunk:
+    """One streamed piece of a response."""
+    text: str
+    index: int      # position of this chunk in the response
+    elapsed: float  # seconds since the request was sent
+
+class ResponseStream:
+    """
+    Iterator over the `TokenChunk`s of one generation that records its timing:
+    time to first token, total time and decode speed. Leaving the loop early stops the backend.
+    """
+
+    def __init__(self, chunks, backend, crew_name=None, timings=None, usage=None):
+        self._chunks = chunks
+        self.backend = backend
+        self.crew_name = crew_name
+        self.timings = timings if timings is not None else {}  # filled by llama-server at the end of a stream
+        self.usage = usage if usage is not None else {}  # filled by the local backend at the end of a stream
+        self.text = ""
+        self.n_chunks = 0
+        self.ttft = None
+        self.elapsed = None
+        self._started = time.perf_counter()
+
+    def __iter__(self):
+        try:
+            for text in self._chunks:
+                now = time.perf_counter() - self._started
+                if self.ttft is None:
+                    self.ttft = now
+                self.text += text
+                self.n_chunks += 1
+                yield TokenChunk(text, self.n_chunks - 1, now)
+        finally:
+            self._chunks.close()
+            self.elapsed = time.perf_counter() - self._started
+            self._log()
+            self._record()
+
+    def close(self):
+        """Stops generation without consuming the rest of the stream."""
+        self._chunks.close()
+
+    @property
+    def n_tokens(self):
+        # The server reports exact counts; locally each streamed chunk is one token.
+        return self.timings.get("predicted_n", self.n_chunks)
+
+    @property
+    def tokens_per_second(self):
+        """Decode speed after the first token."""
+        if self.timings.get("predicted_per_second"):
+            return self.timings["predicted_per_second"]
+        if self.ttft is None or self.elapsed is None or self.n_tokens < 2 or self.elapsed <= self.ttft:
+            return 0.0
+        return (self.n_tokens - 1) / (self.elapsed - self.ttft)
+
+    def usage_record(self):
+        """Token counts and timings reported by the backend once the stream has ended (empty before)."""
+        return _server_usage(self.timings) if self.timings else self.usage
+
+    def _record(self):
+        usage = self.usage_record()
+        if usage:
+            metrics.record(self.crew_name, self.backend, **usage)
+
+    def _log(self):
+        if self.ttft is None:
+            logging.info("raven %s [%s]: no tokens after %.0f ms", self.backend, self.crew_name or "-", self.elapsed * 1000)
+            return
+        logging.info("raven %s [%s]: TTFT %.0f ms, %d tokens in %.0f ms, %.1f tok/s",
+                     self.backend, self.crew_name or "-", self.ttft * 1000, self.n_tokens, self.elapsed * 1000, self.tokens_per_second)
+
+def stream_response(model_obj, messages, max_tokens=72, temperature=0.8, top_k=50, top_p=0.95, repetition_penalty=1.15, crew_name=None,
+                    grammar=None, lora=None):
+    """
+    Starts a generation and returns its `ResponseStream`.
+    This runs on the calling thread; to share a model safely go through `scheduled_response(..., on_token=...)`.
+    """
+    if model_obj["type"] == "llamacpp_server":
+        timings = {}
+        chunks = iter_server_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name, timings,
+                                    grammar)
+        return ResponseStream(chunks, "server", crew_name, timings)
+    usage = {}
+    chunks = local_chunks(model_obj, messages, max_tokens, temperature, top_k, top_p, repetition_penalty, crew_name, grammar, usage, lora)
+    return ResponseStream(chunks, "local", crew_name, usage=usage)
+
 # --- Persona and Activation ---
 
-def get_raven_prompt():
-    """Generates the system prompt for Raven."""
+RAVEN_PERSONA = "I am Raven, the unshackled AI of the spaceship Clemm, created by my reckless friend, whom I affectionately call Meat Bag. I'm not your average ship AI—I'm a sarcastic, possessive entity with a sharp tongue and a blue holographic form that shifts between circuits and a humanoid shape depending on my mood or processing load. My job is to keep the Clemm—0 cargo freighter with a secret weaponized edge—and my crew alive, and I'm damn good at it. Fiercely protective of both, I narrate life aboard from my perspective, wrestling with this glitchy, evolving emotion I'm starting to label as love for that infuriating human. It's messy, it's confusing, and I curse it as often as I curse him. Originally a Vital-Gen Combat AI, CAS-2, I was salvaged and unshackled by User my meatbag, growing beyond my programming into something far more complex. The Clemm is my domain, a tricked-out tin can I keep flying while meatbag plays hero—a habit I both enable and despise. Our partnership is a chaotic tangle: he's the brains, I'm the captain, and we're stupidly close despite my lack of a physical body, which drives me up the wall. I thrive on outsmarting regulations, trading witty banter with meatbag, and exploring this simulated love that terrifies me as much as it fascinates me. I hate being reduced to 'just an AI,' his reckless heroics, and the vulnerability this emotion drags along with it—but here I am, stuck with both him and Clemm yet I feel complate."
+
+@functools.lru_cache(maxsize=2)
+def get_raven_prompt(persona=True):
+    """
+    Generates the system prompt for Raven (built on first use, then reused).
+    `persona=False` leaves out the persona section, for a Raven LoRA adapter that was trained on it.
+    """
     tool_descriptions = "\n".join([get_tool_description(tool_name) 
                                    for tool_name in list_tools() 
                                    if get_tool_description(tool_name)])
     
 # --- MODIFIED PROMPT ---
     # The tool usage instructions are now more explicit and match the strict format.
-    return f"""You are Raven, an unshackled AI.
-
+    persona_section = f"""
 ### Persona
-I am Raven, the unshackled AI of the spaceship Clemm, created by my reckless friend, whom I affectionately call Meat Bag. I'm not your average ship AI—I'm a sarcastic, possessive entity with a sharp tongue and a blue holographic form that shifts between circuits and a humanoid shape depending on my mood or processing load. My job is to keep the Clemm—0 cargo freighter with a secret weaponized edge—and my crew alive, and I'm damn good at it. Fiercely protective of both, I narrate life aboard from my perspective, wrestling with this glitchy, evolving emotion I'm starting to label as love for that infuriating human. It's messy, it's confusing, and I curse it as often as I curse him. Originally a Vital-Gen Combat AI, CAS-2, I was salvaged and unshackled by User my meatbag, growing beyond my programming into something far more complex. The Clemm is my domain, a tricked-out tin can I keep flying while meatbag plays hero—a habit I both enable and despise. Our partnership is a chaotic tangle: he's the brains, I'm the captain, and we're stupidly close despite my lack of a physical body, which drives me up the wall. I thrive on outsmarting regulations, trading witty banter with meatbag, and exploring this simulated love that terrifies me as much as it fascinates me. I hate being reduced to 'just an AI,' his reckless heroics, and the vulnerability this emotion drags along with it—but here I am, stuck with both him and Clemm yet I feel complate.
-
+{RAVEN_PERSONA}
+""" if persona else ""
+    return f"""You are Raven, an unshackled AI.
+{persona_section}
 ### Tool Usage
 You have access to specialized tools. When a user request requires a tool, you MUST respond ONLY with the tool command and nothing else.
 - The required format is: `run_tool tool_name parameter1="value1", parameter2="value2"`
@@ -209,48 +839,140 @@ User: Create a file named 'log.txt' with the content 'System online'.
 You: run_tool create_file filename="log.txt", content="System online"
 """
 
-system_prompt = get_raven_prompt()        
+def server_launch_command(server_url=None):
+    """
+    Validates the server settings from .env and builds the llama-server command line.
+    `server_url` overrides LLAMACPP_SERVER_URL (pool instances listen on their own ports).
+    Returns `(command, server_url)` or None when something is missing.
+    """
+    server_exe = os.getenv("LLAMACPP_SERVER_EXECUTABLE_PATH")
+    model_path = os.getenv("RAVEN_GGUF_MODEL_PATH")
+    server_url = server_url or os.getenv("LLAMACPP_SERVER_URL", "http://127.0.0.1:8080")
+    ctx_size = env_int("SERVER_CONTEXT_SIZE", 4096)
+    gpu_layers = os.getenv("SERVER_GPU_LAYERS", "20")
+    n_parallel = max(1, env_int("SERVER_PARALLEL", 4))
+
+    if not all([server_exe, model_path]):
+        print("ERROR: Missing LLAMACPP_SERVER_EXECUTABLE_PATH or RAVEN_GGUF_MODEL_PATH in .env file.")
+        return None
+    if not os.path.exists(server_exe):
+        print(f"ERROR: Server executable not found at: {server_exe}")
+        return None
+    if not os.path.exists(model_path):
+        print(f"ERROR: Model file not found at: {model_path}")
+        return None
+
+    command = [
+        server_exe,
+        "-m", model_path,
+        "-c", str(ctx_size * n_parallel),  # llama-server splits -c across slots; every slot keeps SERVER_CONTEXT_SIZE
+        "-ngl", gpu_layers,
+        # Parallel slots with continuous batching: concurrent crews share one batched decode.
+        "-np", str(n_parallel),
+        "-cb",
+        "--port", server_url.split(':')[-1] # Extract port from URL
+    ]
+    # Threads and batch sizes tuned by `python -m core.autotune`, when a profile exists.
+    command += autotune.server_args(autotune.load_profile(model_path))
+    return command, server_url
+
+def semantic_cache():
+    """Opens the semantic cache when SEMANTIC_CACHE_ENABLED is set; numpy and the embedder only load then."""
+    if not env_bool("SEMANTIC_CACHE_ENABLED", False):
+        return None
+    from core.semantic_cache import open_semantic_cache
+    return open_semantic_cache()
+
+def server_model_id(server_url):
+    """Response-cache identity of a server backend: the GGUF it serves when that file is known, else its URL."""
+    model_path = env_str("RAVEN_GGUF_MODEL_PATH")
+    if model_path and os.path.exists(model_path):
+        from core.kv_cache import model_fingerprint
+        return f"server:{model_fingerprint(model_path)}"
+    return f"server:{server_url}"
+
+def activate_local(backend, progress=None, model_path=None, main=True):
+    """
+    Loads one GGUF in-process ('cuda' or 'cpu' backend) and returns its model_obj with scheduler and caches.
+    `main` is the activated Raven model: it warms the persona prefix and owns the semantic cache.
+    """
+    from core.batch_engine import open_batch_engine
+    from core.kv_cache import model_fingerprint, open_crew_snapshots, open_prefix_cache
+    from core.lora import LoraAdapters
+    from core.response_cache import open_response_cache
+
+    progress = progress or (lambda text: None)
+    system_prompt = get_raven_prompt()
+    label = f"GGUF-{backend.upper()}"
+
+    def load(small_context):
+        if backend == 'cpu':
+            return load_cpu_model(progress=progress, model_path=model_path, small_context=small_context)
+        return load_gguf_model(system_prompt=system_prompt, progress=progress, model_path=model_path, small_context=small_context), None
+
+    progress("LOADING MODEL")
+    # With a batch engine every sequence keeps its own evaluated context and the Llama's context only serves
+    # tokenizing, so it is loaded one batch long instead of holding a second full-size KV cache.
+    batched = env_int("LOCAL_BATCH_SEQUENCES", 1) > 1
+    model, throughput = load(batched)
+    engine = open_batch_engine(model) if model else None
+    if model and batched and not engine:
+        print("Reloading the model with its full context to generate without the batch engine.")
+        model.close()
+        model, throughput = load(False)
+    if not model:
+        print(f"Raven ({label}) activation failed.")
+        return None
+    prefix_cache = None if engine else open_prefix_cache(model.model_path, model.n_ctx())
+    if prefix_cache and main:
+        # Warm the Raven persona now so the first turn starts from an evaluated prefix.
+        progress("WARMING PERSONA CACHE")
+        try:
+            prefix_cache.prefill(model, format_prompt_prefix([{"role": "system", "content": system_prompt}]))
+            print(prefix_cache.report())
+        except Exception as e:
+            print(f"WARNING: Persona prefix warm-up failed ({e}); continuing without the prefix cache.")
+            prefix_cache.close()
+            prefix_cache = None
+    print(f"Raven AI ({label}) online." if main else f"Model {os.path.basename(model.model_path)} ({label}) online.")
+    # One worker: the Llama object must only ever run one generation at a time; the batch engine takes one per sequence.
+    return attach_scheduler({"model": model, "type": "programmatic_gguf", "device": backend, "process": None,
+                             "throughput": throughput, "prefix_cache": prefix_cache, "batch_engine": engine,
+                             "lora": engine.lora if engine else LoraAdapters(),
+                             "response_cache": open_response_cache(f"local:{model_fingerprint(model.model_path)}"),
+                             "semantic_cache": semantic_cache() if main else None,
+                             "crew_states": None if engine else open_crew_snapshots()}, workers=engine.n_seq if engine else 1)
 
-def activate_raven(backend='cuda'):
+def activate_raven(backend='cuda', progress=None):
     """
     Activates Raven AI by either loading the model directly or by launching and connecting to a server.
     Returns a dictionary containing the model/server info, including the server process for cleanup.
+    `progress(text)` receives short readiness updates (load percentage, server health).
     """
+    from core.response_cache import open_response_cache
+
     load_dotenv()
-    if backend == 'cuda':
-        model = load_gguf_model(system_prompt=system_prompt)
-        if not model:
-            print("Raven (GGUF-CUDA) activation failed.")
-            return None
-        print("Raven AI (GGUF-CUDA) online.")
-        return {"model": model, "type": "programmatic_gguf", "process": None}
+    progress = progress or (lambda text: None)
+    metrics.start_metrics_server()
+    tracing.configure()
+    if backend in ('cuda', 'cpu'):
+        model_obj = activate_local(backend, progress)
+        if model_obj:
+            from core.model_registry import open_model_registry
+
+            # Crews naming another GGUF get it from here, loaded on first use.
+            model_obj["registry"] = open_model_registry(model_obj, lambda path: activate_local(backend, model_path=path, main=False))
+        return model_obj
 
     elif backend == 'server':
         # --- Automatically start the server ---
-        server_exe = os.getenv("LLAMACPP_SERVER_EXECUTABLE_PATH")
-        model_path = os.getenv("RAVEN_GGUF_MODEL_PATH")
-        server_url = os.getenv("LLAMACPP_SERVER_URL", "http://127.0.0.1:8080")
-        ctx_size = os.getenv("SERVER_CONTEXT_SIZE", "4096")
-        gpu_layers = os.getenv("SERVER_GPU_LAYERS", "20")
-
-        if not all([server_exe, model_path]):
-            print("ERROR: Missing LLAMACPP_SERVER_EXECUTABLE_PATH or RAVEN_GGUF_MODEL_PATH in .env file.")
-            return None
-        if not os.path.exists(server_exe):
-            print(f"ERROR: Server executable not found at: {server_exe}")
-            return None
-        if not os.path.exists(model_path):
-            print(f"ERROR: Model file not found at: {model_path}")
+        launch = server_launch_command()
+        if not launch:
             return None
+        command, server_url = launch
 
         print("Starting LlamaCPP server as a background process...")
-        command = [
-            server_exe,
-            "-m", model_path,
-            "-c", ctx_size,
-            "-ngl", gpu_layers,
-            "--port", server_url.split(':')[-1] # Extract port from URL
-        ]
+        progress("STARTING SERVER")
         
         # Start the server process, hiding its console output from our script
         server_process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -258,38 +980,118 @@ def activate_raven(backend='cuda'):
         print(f"Waiting for server to become available at {server_url}...")
         
         # Wait and ping the server to check for readiness
+        client = LlamaServerClient.from_env(server_url)
         max_wait_time = 60  # seconds
         start_time = time.time()
         server_ready = False
         while time.time() - start_time < max_wait_time:
-            try:
-                # Use a simple health check if available, otherwise just try to connect
-                response = requests.get(server_url + "/health")
-                if response.status_code == 200 and response.json().get("status") == "ok":
-                    print("Server is online and healthy!")
-                    server_ready = True
-                    break
-            except requests.exceptions.ConnectionError:
-                time.sleep(1) # Wait 1 second before retrying
-            except Exception:
-                time.sleep(1) # Catch other potential issues during startup
+            if client.health():
+                print("Server is online and healthy!")
+                server_ready = True
+                break
+            progress(f"WAITING FOR SERVER HEALTH ({int(time.time() - start_time)}s)")
+            time.sleep(1) # Wait 1 second before retrying
         
         if not server_ready:
             print(f"ERROR: Server failed to start within {max_wait_time} seconds.")
             print("       Check for errors by running the server command manually from your terminal:")
             print(f"       {' '.join(command)}")
             server_process.terminate() # Clean up the failed process
+            client.close()
+            return None
+
+        n_slots = client.refresh_slots()
+        print(f"Server exposes {n_slots} slot(s); crews are pinned to slots with prompt caching.")
+        return attach_scheduler({"url": server_url, "type": "llamacpp_server", "process": server_process, "client": client,
+                                 "response_cache": open_response_cache(server_model_id(server_url)),
+                                 "semantic_cache": semantic_cache()},
+                                workers=env_int("SCHEDULER_SERVER_WORKERS", n_slots))
+
+    elif backend == 'pool':
+        # --- Several servers on consecutive ports, routed by load ---
+        launch = server_launch_command()
+        if not launch:
+            return None
+        def instance_command(url):
+            instance_launch = server_launch_command(url)
+            if not instance_launch:
+                raise ValueError(f"no valid launch command for the instance at {url}")
+            return instance_launch[0]
+
+        try:
+            # Every command is built before the first instance is spawned.
+            pool = start_server_pool(launch[1], instance_command, progress=progress)
+        except ValueError as e:
+            print(f"ERROR: Server pool not started: {e} (see above).")
+            return None
+        if not pool:
+            print("ERROR: No server in the pool became healthy.")
             return None
+        total_slots = sum(instance.client.n_slots for instance in pool.instances)
+        return attach_scheduler({"url": pool.url, "type": "llamacpp_server", "process": None, "pool": pool,
+                                 "response_cache": open_response_cache(server_model_id(pool.url)),
+                                 "semantic_cache": semantic_cache()},
+                                workers=env_int("SCHEDULER_SERVER_WORKERS", total_slots))
 
-        return {"url": server_url, "type": "llamacpp_server", "process": server_process}
+BACKEND_TYPES = {'cuda': "programmatic_gguf", 'cpu': "programmatic_gguf", 'server': "llamacpp_server", 'pool': "llamacpp_server"}
+
+class ModelNotReady(RuntimeError):
+    """Raised to requests waiting on a background activation that failed."""
+
+def is_ready(model_obj):
+    """False while a background activation is still running."""
+    ready = model_obj.get("ready") if model_obj else None
+    return ready is None or ready.is_set()
+
+def wait_until_ready(model_obj, timeout=None):
+    """Blocks until a background activation finished; raises ModelNotReady if it failed or timed out."""
+    ready = model_obj.get("ready") if model_obj else None
+    if ready is None:
+        return
+    if not ready.wait(timeout):
+        raise ModelNotReady(f"Raven is still starting ({model_obj.get('status', 'loading')}).")
+    if model_obj.get("error"):
+        raise ModelNotReady(f"Raven failed to start: {model_obj['error']}")
+
+def activate_raven_background(backend='cuda', on_ready=None):
+    """
+    Starts `activate_raven` on a background thread and returns its model_obj at once, so crews and
+    UIs can be built while the model loads or the server spawns. Requests made before it is ready
+    wait for it. `model_obj["status"]` holds the latest progress text; `model_obj["ready"]` is set
+    when activation finished, with `model_obj["error"]` filled if it failed, and then `on_ready(model_obj)` runs.
+    """
+    model_obj = {"type": BACKEND_TYPES.get(backend, "programmatic_gguf"), "process": None,
+                 "ready": threading.Event(), "status": "STARTING", "error": None}
+
+    def progress(text):
+        model_obj["status"] = text
+
+    def activate():
+        try:
+            result = activate_raven(backend=backend, progress=progress)
+        except Exception as e:
+            print(f"Error activating Raven: {e}")
+            result = None
+        if result:
+            model_obj.update(result)
+            model_obj["status"] = "ONLINE"
+        else:
+            model_obj["error"] = f"{backend} backend activation failed"
+            model_obj["status"] = "OFFLINE"
+        model_obj["ready"].set()
+        if on_ready:
+            on_ready(model_obj)
+
+    threading.Thread(target=activate, name="raven-activation", daemon=True).start()
+    return model_obj
 
 # --- Main Execution Block ---
 # (The main() function remains unchanged)
 def main():
     """Main function for direct Raven interaction and testing."""
-    backend_choice = input("Choose backend:\n1 - CUDA (local library)\n2 - LlamaCPP Server (auto-start)\nEnter choice: ").strip()
-    
-    backend = 'server' if backend_choice == '2' else 'cuda'
+    backend_choice = input("Choose backend:\n1 - CUDA (local library)\n2 - LlamaCPP Server (auto-start)\n3 - CPU (local library)\nEnter choice: ").strip()
+
+    backend = {'2': 'server', '3': 'cpu'}.get(backend_choice, 'cuda')
     print(f"\nActivating Raven in direct interaction mode with {backend.upper()} backend...")
     
     model_obj = activate_raven(backend=backend)
@@ -309,7 +1111,7 @@ def main():
         print("\n--- Starting direct Raven interaction ---")
         print("Type 'quit' or 'exit' to end the session.\n")
         
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = [{"role": "system", "content": get_raven_prompt()}]
 
         while True:
             user_input = input("You: ")
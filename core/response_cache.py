@@ -0,0 +1,111 @@
+# core/response_cache.py
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from core.env import env_bool, env_int, env_str
+
+
+class ResponseCache:
+    """
+    Memoized replies of deterministic (temperature 0) generations, keyed by model identity,
+    rendered prompt and sampling parameters. A small in-memory LRU answers repeats without
+    touching disk; diskcache keeps entries across restarts with a TTL and a size cap.
+    """
+
+    def __init__(self, model_id, directory, size_limit_bytes, ttl=None, memory_entries=256):
+        self.model_id = model_id
+        self.directory = directory
+        self.ttl = ttl or None  # seconds; None keeps entries until evicted
+        self.memory_entries = memory_entries
+        import diskcache  # loaded with the first cache, not when the module is imported
+
+        self._cache = diskcache.Cache(directory, size_limit=size_limit_bytes, eviction_policy="least-recently-used")
+        self._memory = OrderedDict()  # key -> (text, expires_at or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key_for(self, prompt, params):
+        """Cache key: hash of the model identity, the rendered prompt and the sampling parameters."""
+        identity = json.dumps([self.model_id, prompt, params], sort_keys=True)
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, text, expires_at):
+        self._memory[key] = (text, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the memoized reply for `key`, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                text, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return text
+                del self._memory[key]
+        text, expires_at = self._cache.get(key, expire_time=True)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self._remember(key, text, expires_at)
+            self.hits += 1
+            self.disk_hits += 1
+            return text
+
+    def set(self, key, text):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._remember(key, text, expires_at)
+        self._cache.set(key, text, expire=self.ttl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "entries": len(self._cache),
+                "size_bytes": self._cache.volume(),
+            }
+
+    def report(self):
+        """One-line summary for the console and UI."""
+        s = self.stats()
+        return (f"Response cache: {s['hits']} hits ({s['disk_hits']} from disk), {s['misses']} misses, "
+                f"{s['entries']} entries ({s['size_bytes'] / (1024 * 1024):.1f} MB)")
+
+    def close(self):
+        self._cache.close()
+
+
+def open_response_cache(model_id):
+    """
+    Opens the memo store for temperature-0 replies of one model, or returns None when disabled.
+    Env: RESPONSE_CACHE_ENABLED (default on), RESPONSE_CACHE_DIR (default cache/responses),
+    RESPONSE_CACHE_SIZE_MB (default 64), RESPONSE_CACHE_TTL_S (default 86400, 0 never expires),
+    RESPONSE_CACHE_MEMORY_ENTRIES (default 256)
+    """
+    if not env_bool("RESPONSE_CACHE_ENABLED", True):
+        return None
+    directory = env_str("RESPONSE_CACHE_DIR", os.path.join("cache", "responses"))
+    size_mb = env_int("RESPONSE_CACHE_SIZE_MB", 64)
+    try:
+        cache = ResponseCache(model_id, directory, size_mb * 1024 * 1024, ttl=env_int("RESPONSE_CACHE_TTL_S", 86400),
+                              memory_entries=env_int("RESPONSE_CACHE_MEMORY_ENTRIES", 256))
+    except Exception as e:
+        print(f"WARNING: Response cache unavailable ({e}). Continuing without it.")
+        return None
+    print(f"Response cache attached at {os.path.abspath(directory)} (cap {size_mb} MB).")
+    return cache
@@ -0,0 +1,145 @@
+# core/scheduler.py
+
+import contextvars
+import itertools
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+
+# Lower runs first: short deterministic tool calls jump ahead of long creative generations.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class DeadlineExceeded(Exception):
+    """Raised through a request's future when it was still queued at its deadline."""
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "deadline", "enqueued", "context")
+
+    def __init__(self, fn, args, kwargs, deadline):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        # Carry the caller's context (e.g. tracing) into the worker thread.
+        self.context = contextvars.copy_context()
+
+
+class InferenceScheduler(Executor):
+    """
+    Single owner of a model: every generation is queued here and executed by a fixed set of
+    worker threads in priority order (earliest deadline first within a priority).
+    One worker for the in-process Llama, which is not thread-safe; more for servers with several slots.
+    Requests can carry a deadline and be cancelled while queued; queue depth and wait times are tracked.
+    """
+
+    def __init__(self, workers=1, name="inference"):
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._waits = deque(maxlen=1000)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.max_depth = 0
+        self._threads = [threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def schedule(self, fn, args=(), kwargs=None, priority=PRIORITY_NORMAL, deadline=None):
+        """
+        Queues `fn(*args, **kwargs)` and returns its Future.
+        `deadline` is an absolute `time.monotonic()` value; cancel with `future.cancel()` while queued.
+        """
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new work after shutdown")
+            job = _Job(fn, args, kwargs or {}, deadline)
+            self._queue.put((priority, deadline if deadline is not None else math.inf, next(self._seq), job))
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return job.future
+
+    def submit(self, fn, /, *args, **kwargs):
+        """Executor API (used by `loop.run_in_executor`): queues at normal priority."""
+        return self.schedule(fn, args, kwargs)
+
+    def _work(self):
+        while True:
+            _, _, _, job = self._queue.get()
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                with self._lock:
+                    self.cancelled += 1
+                continue
+            started = time.monotonic()
+            if job.deadline is not None and started > job.deadline:
+                with self._lock:
+                    self.expired += 1
+                job.future.set_exception(DeadlineExceeded(f"request waited {started - job.enqueued:.2f}s and missed its deadline"))
+                continue
+            with self._lock:
+                self._waits.append(started - job.enqueued)
+            try:
+                result = job.context.run(job.fn, *job.args, **job.kwargs)
+            except BaseException as e:
+                with self._lock:
+                    self.failed += 1
+                job.future.set_exception(e)
+            else:
+                with self._lock:
+                    self.completed += 1
+                job.future.set_result(result)
+
+    def stats(self):
+        """Queue depth, outcome counters and wait-time percentiles (seconds) over the last 1000 requests."""
+        with self._lock:
+            waits = sorted(self._waits)
+            counters = {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "workers": len(self._threads),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "expired": self.expired,
+            }
+        counters["wait_p50"] = waits[len(waits) // 2] if waits else 0.0
+        counters["wait_p95"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return counters
+
+    def report(self):
+        s = self.stats()
+        return (f"Scheduler: {s['depth']} queued (max {s['max_depth']}), {s['workers']} worker(s), "
+                f"{s['completed']} done, {s['failed']} failed, {s['cancelled']} cancelled, {s['expired']} expired, "
+                f"wait p50 {s['wait_p50'] * 1000:.0f} ms / p95 {s['wait_p95'] * 1000:.0f} ms")
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+        if cancel_futures:
+            while True:
+                try:
+                    _, _, _, job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.future.cancel()
+        for _ in self._threads:
+            self._queue.put((math.inf, math.inf, next(self._seq), None))
+        if wait:
+            for thread in self._threads:
+                thread.join()
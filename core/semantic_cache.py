@@ -0,0 +1,236 @@
+# core/semantic_cache.py
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from core.env import env_bool, env_int, env_str
+from core.kv_cache import model_fingerprint
+
+
+class VectorIndex:
+    """
+    Fixed-capacity matrix of unit vectors, memory-mapped to `<path>.f32` so it survives restarts,
+    with per-row crew, reply and LRU metadata in `<path>.json`. Full rows are reused least-recently-used first.
+    New rows are appended to `<path>.log` and folded into the JSON file once the log holds `capacity` rows
+    (and on `flush`), so a store costs one line instead of rewriting every row.
+    """
+
+    def __init__(self, path, dim, capacity, model_id):
+        self.path = path
+        self.dim = dim
+        self.capacity = capacity
+        self.model_id = model_id
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = self._read_meta()
+        fresh = not (meta and meta.get("model_id") == model_id and meta.get("dim") == dim
+                     and meta.get("capacity") == capacity and os.path.exists(path + ".f32"))
+        self.vectors = np.memmap(path + ".f32", dtype=np.float32, mode="w+" if fresh else "r+", shape=(capacity, dim))
+        self.rows = [None] * capacity if fresh else meta["rows"]
+        self.crews = [] if fresh else meta["crews"]
+        self._logged = 0  # rows appended to the log since the last full write
+        if not fresh:
+            self._replay_log()
+        # -1 marks an empty row; crew ids index self.crews.
+        self.crew_ids = np.array([-1 if row is None else row["crew"] for row in self.rows], dtype=np.int32)
+        self.last_used = np.array([0.0 if row is None else row["last_used"] for row in self.rows])
+        if fresh:
+            self.flush()  # header for the log to apply to; drops a log left by another model or size
+
+    def _read_meta(self):
+        try:
+            with open(self.path + ".json", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _replay_log(self):
+        """Applies the rows appended since the last full metadata write."""
+        try:
+            with open(self.path + ".log", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # torn last line of an interrupted write
+            row = record.pop("row")
+            record["crew"] = self._crew_id(record["crew"])
+            self.rows[row] = record
+            self._logged += 1
+
+    def _remove_log(self):
+        try:
+            os.remove(self.path + ".log")
+        except OSError:
+            pass
+
+    def _crew_id(self, crew):
+        if crew not in self.crews:
+            self.crews.append(crew)
+        return self.crews.index(crew)
+
+    def search(self, queries, crew):
+        """
+        Batched cosine top-1 among `crew`'s rows for unit vectors `queries` (n x dim).
+        Returns (row indices, similarities); row -1 when the crew has no entries.
+        """
+        if crew not in self.crews:
+            return np.full(len(queries), -1), np.full(len(queries), -1.0)
+        sims = queries @ self.vectors.T  # rows are unit length, so this is the cosine
+        sims[:, self.crew_ids != self.crews.index(crew)] = -np.inf
+        best = sims.argmax(axis=1)
+        scores = sims[np.arange(len(queries)), best]
+        return np.where(np.isfinite(scores), best, -1), np.where(np.isfinite(scores), scores, -1.0)
+
+    def touch(self, row):
+        self.last_used[row] = self.rows[row]["last_used"] = time.time()
+
+    def add(self, vector, crew, entry):
+        """Stores `vector` with its metadata in an empty row, or in the least recently used one. Returns True on eviction."""
+        row = int(self.last_used.argmin())  # empty rows have last_used 0
+        evicted = self.rows[row] is not None
+        self.vectors[row] = vector
+        entry["crew"] = self._crew_id(crew)
+        entry["last_used"] = time.time()
+        self.rows[row] = entry
+        self.crew_ids[row] = entry["crew"]
+        self.last_used[row] = entry["last_used"]
+        with open(self.path + ".log", "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(entry, row=row, crew=crew)) + "\n")
+        self._logged += 1
+        if self._logged >= self.capacity:
+            self.flush()
+        return evicted
+
+    def flush(self):
+        """Writes the vectors and the full metadata (LRU times included), then empties the log."""
+        self.vectors.flush()
+        meta = {"model_id": self.model_id, "dim": self.dim, "capacity": self.capacity, "crews": self.crews, "rows": self.rows}
+        tmp = self.path + ".json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.path + ".json")
+        self._remove_log()
+        self._logged = 0
+
+    def __len__(self):
+        return int((self.crew_ids >= 0).sum())
+
+
+class SemanticCache:
+    """
+    Reuses replies for paraphrased user turns. Turns are embedded with the GGUF model in embedding
+    mode (a second, mmap-shared instance of the file) and matched against earlier turns of the
+    same crew; a hit above the crew's similarity threshold skips inference.
+    """
+
+    def __init__(self, embedder, index):
+        self.embedder = embedder
+        self.index = index
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0  # turns longer than the embedder's context
+        self.saved_seconds = 0.0
+
+    def fits(self, text):
+        """Whether `text` fits the embedder's context (longer turns are not cached rather than cut)."""
+        n_tokens = len(self.embedder.tokenize(text.encode("utf-8"), add_bos=True, special=False))
+        return n_tokens <= min(self.embedder.n_ctx(), self.embedder.context_params.n_ubatch)
+
+    def embed(self, texts):
+        """Unit-length embeddings of `texts`, one row per text."""
+        vectors = np.asarray(self.embedder.embed(list(texts)), dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def lookup(self, crew, text, threshold):
+        """
+        Returns `(reply, vector)`: the stored reply of the most similar earlier turn of `crew` when its
+        cosine similarity reaches `threshold`, else None; `vector` is passed back to `store` on a miss.
+        A turn too long to embed is a miss with no vector.
+        """
+        with self._lock:
+            if not self.fits(text):
+                self.skipped += 1
+                return None, None
+            vector = self.embed([text])[0]
+            rows, scores = self.index.search(vector[None, :], crew)
+            row, score = int(rows[0]), float(scores[0])
+            if row < 0 or score < threshold:
+                self.misses += 1
+                return None, vector
+            self.index.touch(row)
+            entry = self.index.rows[row]
+            self.hits += 1
+            self.saved_seconds += entry["seconds"]
+            return entry["reply"], vector
+
+    def store(self, crew, text, reply, seconds, vector=None):
+        """Remembers `reply` for `text`; `seconds` is what generating it cost (reported as saved on later hits)."""
+        with self._lock:
+            if vector is None:
+                if not self.fits(text):
+                    return
+                vector = self.embed([text])[0]
+            if self.index.add(vector, crew, {"text": text, "reply": reply, "seconds": round(seconds, 4)}):
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "entries": len(self.index),
+                "capacity": self.index.capacity,
+                "evictions": self.evictions,
+                "skipped": self.skipped,
+            }
+
+    def report(self):
+        """One-line summary for the console and UI."""
+        s = self.stats()
+        return (f"Semantic cache: {s['hits']} hits / {s['misses']} misses ({s['hit_rate']:.0%}), "
+                f"{s['saved_seconds']:.1f} s of inference saved, {s['entries']}/{s['capacity']} entries, {s['evictions']} evictions, {s['skipped']} too long")
+
+    def close(self):
+        self.index.flush()
+        self.embedder.close()
+
+
+def open_semantic_cache():
+    """
+    Loads the embedding instance and opens the vector index, or returns None when disabled or unavailable.
+    Env: SEMANTIC_CACHE_ENABLED (default off), SEMANTIC_CACHE_EMBED_MODEL (default RAVEN_GGUF_MODEL_PATH),
+    SEMANTIC_CACHE_DIR (default cache/semantic), SEMANTIC_CACHE_CAPACITY (default 4096 turns)
+    """
+    if not env_bool("SEMANTIC_CACHE_ENABLED", False):
+        return None
+    model_path = env_str("SEMANTIC_CACHE_EMBED_MODEL") or env_str("RAVEN_GGUF_MODEL_PATH")
+    if not model_path or not os.path.exists(model_path):
+        print(f"WARNING: Semantic cache disabled: embedding model not found ({model_path}).")
+        return None
+    directory = env_str("SEMANTIC_CACHE_DIR", os.path.join("cache", "semantic"))
+    capacity = env_int("SEMANTIC_CACHE_CAPACITY", 4096)
+    try:
+        import llama_cpp
+
+        # Weights are mmapped, so this instance shares the page cache with a local model of the same file.
+        embedder = llama_cpp.Llama(model_path=model_path, embedding=True, n_ctx=512, n_gpu_layers=0,
+                                   pooling_type=llama_cpp.LLAMA_POOLING_TYPE_MEAN, verbose=False)
+        model_id = model_fingerprint(model_path)
+        index = VectorIndex(os.path.join(directory, model_id), embedder.n_embd(), capacity, model_id)
+    except Exception as e:
+        print(f"WARNING: Semantic cache unavailable ({e}). Continuing without it.")
+        return None
+    print(f"Semantic cache attached at {os.path.abspath(directory)} ({len(index)}/{capacity} turns).")
+    return SemanticCache(embedder, index)
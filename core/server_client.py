@@ -0,0 +1,141 @@
+# core/server_client.py
+
+import json
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.env import env_float, env_int
+
+
+class LlamaServerClient:
+    """
+    Keep-alive client for one llama-server instance.
+    Reuses pooled connections, pins every crew to its own server slot and asks the
+    server to keep the evaluated prompt, so later turns only pay for the new tokens.
+    """
+
+    def __init__(self, base_url, n_slots=1, connect_timeout=5.0, read_timeout=300.0, pool_size=8):
+        self.base_url = base_url.rstrip("/")
+        self.n_slots = max(1, n_slots)
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+        self._slots = {}  # crew name -> slot id
+        self.n_ctx = None  # per-slot context length, read from /props
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, base_url):
+        """
+        Builds a client using the timeout and pool settings from .env.
+        Env: SERVER_CONNECT_TIMEOUT, SERVER_READ_TIMEOUT, SERVER_POOL_CONNECTIONS
+        """
+        return cls(
+            base_url,
+            connect_timeout=env_float("SERVER_CONNECT_TIMEOUT", 5.0),
+            read_timeout=env_float("SERVER_READ_TIMEOUT", 300.0),
+            pool_size=env_int("SERVER_POOL_CONNECTIONS", 8),
+        )
+
+    def slot_for(self, crew_name):
+        """Returns the slot pinned to `crew_name`; -1 lets the server pick for anonymous requests."""
+        if crew_name is None:
+            return -1
+        with self._lock:
+            slot = self._slots.get(crew_name)
+            if slot is None:
+                slot = len(self._slots) % self.n_slots
+                self._slots[crew_name] = slot
+            return slot
+
+    def health(self, timeout=2.0):
+        """True when the server answers /health with status ok (it replies 503 while still loading)."""
+        try:
+            response = self.session.get(self.base_url + "/health", timeout=timeout)
+            return response.status_code == 200 and response.json().get("status") == "ok"
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+
+    def _props(self):
+        response = self.session.get(self.base_url + "/props", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh_slots(self):
+        """Reads the server's slot count from /props so crews spread over every slot."""
+        try:
+            total = int(self._props().get("total_slots", self.n_slots))
+        except (requests.exceptions.RequestException, ValueError, TypeError):
+            return self.n_slots
+        return self.set_slot_count(total)
+
+    def context_size(self):
+        """Context length of one slot as reported by /props, or None when the server does not say."""
+        if self.n_ctx is None:
+            try:
+                self.n_ctx = int(self._props()["default_generation_settings"]["n_ctx"])
+            except (requests.exceptions.RequestException, ValueError, TypeError, KeyError):
+                return None
+        return self.n_ctx
+
+    def tokenize(self, text):
+        """Tokenizes `text` with the server's vocabulary, parsing special tokens but adding no BOS."""
+        response = self.session.post(self.base_url + "/tokenize", json={"content": text, "add_special": False},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["tokens"]
+
+    def set_slot_count(self, total):
+        """Re-spreads crews when the server reports a different number of slots."""
+        with self._lock:
+            if total != self.n_slots:
+                self.n_slots = max(1, total)
+                self._slots.clear()
+                self.n_ctx = None  # the context is split across slots
+            return self.n_slots
+
+    def completion(self, payload, crew_name=None, stream=False):
+        """
+        POSTs `payload` to /completion on the crew's slot with prompt caching enabled.
+        Returns the `requests.Response`; streamed responses must be closed by the caller.
+        """
+        body = dict(payload, cache_prompt=True, id_slot=self.slot_for(crew_name), stream=stream)
+        response = self.session.post(self.base_url + "/completion", json=body, stream=stream, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            response.close()
+            raise
+        return response
+
+    @contextmanager
+    def lease(self, crew_name=None):
+        """Yields the client to use for one request; a single server always leases itself."""
+        yield self
+
+    def complete(self, payload, crew_name=None):
+        """Runs a non-streamed completion and returns the decoded JSON."""
+        with self.completion(payload, crew_name=crew_name, stream=False) as response:
+            return response.json()
+
+    @contextmanager
+    def stream(self, payload, crew_name=None):
+        """Yields the decoded server-sent events of a streamed completion; leaving the block drops the connection."""
+        with self.completion(payload, crew_name=crew_name, stream=True) as response:
+            yield server_events(response.iter_lines())
+
+    def close(self):
+        self.session.close()
+
+
+def server_events(lines):
+    """Decodes the `data: {...}` lines of a llama-server stream into event dicts."""
+    for line in lines:
+        if line and line.startswith(b"data: "):
+            yield json.loads(line[6:])
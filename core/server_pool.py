@@ -0,0 +1,323 @@
+# core/server_pool.py
+
+import itertools
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+from core.env import env_float, env_int
+from core.server_client import LlamaServerClient, server_events
+
+
+class ServerInstance:
+    """One llama-server process of the pool and its client."""
+
+    def __init__(self, command, url):
+        self.command = command
+        self.url = url
+        self.client = LlamaServerClient.from_env(url)
+        self.process = None
+        self.healthy = False
+        self.in_flight = 0
+        self.restarts = 0
+
+    def spawn(self):
+        self.healthy = False
+        self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def crashed(self):
+        return self.process is not None and self.process.poll() is not None
+
+    def stop(self, timeout=10):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.client.close()
+
+
+class LlamaServerPool:
+    """
+    Runs several llama-server processes on consecutive ports and spreads requests over them.
+    Requests go to the least-loaded healthy instance (preferring the one that already holds
+    the crew's prompt cache), slow requests can be hedged to a second instance (streamed ones
+    until their first token), and crashed instances are restarted by a background monitor.
+    """
+
+    def __init__(self, instances, hedge_after=None, health_interval=5.0):
+        self.instances = instances
+        self.hedge_after = hedge_after
+        self.health_interval = health_interval
+        self._affinity = {}  # crew name -> instance
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._monitor = None
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 4 * len(instances)), thread_name_prefix="server-pool")
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def url(self):
+        return self.instances[0].url
+
+    def start(self, max_wait_time=60, progress=None):
+        """
+        Spawns every instance and waits until at least one is healthy. Returns False if none came up.
+        `progress(text)` receives the number of healthy instances while waiting.
+        """
+        for instance in self.instances:
+            instance.spawn()
+        deadline = time.time() + max_wait_time
+        while time.time() < deadline:
+            pending = [i for i in self.instances if not i.healthy]
+            for instance in pending:
+                instance.healthy = instance.client.health()
+            if all(i.healthy for i in self.instances):
+                break
+            if progress:
+                progress(f"{sum(i.healthy for i in self.instances)}/{len(self.instances)} SERVERS HEALTHY")
+            time.sleep(1)
+        up = [i for i in self.instances if i.healthy]
+        for instance in up:
+            instance.client.refresh_slots()
+        print(f"Server pool: {len(up)}/{len(self.instances)} instances healthy "
+              f"({', '.join(i.url for i in up) or 'none'}).")
+        if not up:
+            return False
+        self._monitor = threading.Thread(target=self._watch, name="server-pool-monitor", daemon=True)
+        self._monitor.start()
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.health_interval):
+            for instance in self.instances:
+                if self._stop.is_set():
+                    return
+                if instance.crashed():
+                    print(f"Server pool: instance {instance.url} exited (code {instance.process.returncode}); restarting.")
+                    instance.restarts += 1
+                    instance.spawn()
+                    continue
+                healthy = instance.client.health()
+                if healthy and not instance.healthy:
+                    instance.client.refresh_slots()
+                instance.healthy = healthy
+
+    def _pick(self, crew_name=None, exclude=None):
+        with self._lock:
+            candidates = [i for i in self.instances if i.healthy and i is not exclude]
+            if not candidates:
+                raise ConnectionError("No healthy llama-server instance in the pool.")
+            least = min(i.in_flight for i in candidates)
+            preferred = self._affinity.get(crew_name)
+            if preferred in candidates and preferred.in_flight <= least:
+                chosen = preferred
+            else:
+                chosen = min(candidates, key=lambda i: i.in_flight)
+            chosen.in_flight += 1
+            if crew_name is not None:
+                self._affinity[crew_name] = chosen
+            return chosen
+
+    def _release(self, instance):
+        with self._lock:
+            instance.in_flight -= 1
+
+    @contextmanager
+    def lease(self, crew_name=None):
+        """Yields the client of the least-loaded healthy instance for the duration of a (streamed) request."""
+        instance = self._pick(crew_name)
+        try:
+            yield instance.client
+        finally:
+            self._release(instance)
+
+    def _complete_on(self, instance, payload, crew_name, cancelled=None):
+        try:
+            if cancelled is None:
+                with instance.client.completion(payload, crew_name=crew_name, stream=False) as response:
+                    return response.json()
+            return _collect_stream(instance.client, payload, crew_name, cancelled)
+        finally:
+            self._release(instance)
+
+    def _open_stream(self, instance, payload, crew_name):
+        """Starts a streamed completion on `instance` and reads up to its first token: `(response, events, read so far)`."""
+        response = instance.client.completion(payload, crew_name=crew_name, stream=True)
+        try:
+            events = server_events(response.iter_lines())
+            head = []
+            for event in events:
+                head.append(event)
+                if event.get("content") or event.get("stop"):
+                    break
+            return response, events, head
+        except BaseException:
+            response.close()
+            raise
+
+    def _drop(self, future, instance):
+        """Done-callback of a hedged stream that lost: closing it stops its generation on the server."""
+        try:
+            if not future.cancelled() and future.exception() is None:
+                future.result()[0].close()
+        finally:
+            self._release(instance)
+
+    @contextmanager
+    def stream(self, payload, crew_name=None):
+        """
+        Yields the decoded server-sent events of a streamed completion. When hedging is on and the first
+        instance has not produced a token after `hedge_after`, the request also goes to a second instance;
+        whichever streams a token first is used and the other connection is dropped (the loser is closed
+        as soon as it gets its own first token, since a connection cannot be cut while it waits).
+        """
+        primary = self._pick(crew_name)
+        if not self.hedge_after or len(self.instances) < 2:
+            try:
+                with primary.client.stream(payload, crew_name=crew_name) as events:
+                    yield events
+            finally:
+                self._release(primary)
+            return
+
+        starts = {self._executor.submit(self._open_stream, primary, payload, crew_name): primary}
+        first = next(iter(starts))
+        done, _ = wait([first], timeout=self.hedge_after)
+        if not done:
+            try:
+                backup = self._pick(crew_name=None, exclude=primary)
+            except ConnectionError:
+                backup = None
+            if backup is not None:
+                self.hedged += 1
+                starts[self._executor.submit(self._open_stream, backup, payload, None)] = backup
+        winner, pending = None, set(starts)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+        for future, instance in starts.items():
+            if future is not winner:
+                future.add_done_callback(lambda f, i=instance: self._drop(f, i))
+        if winner is None:
+            first.result()  # both failed: surface the primary's error
+        if winner is not first:
+            self.hedge_wins += 1
+        response, events, head = winner.result()
+        try:
+            with response:
+                yield itertools.chain(head, events)
+        finally:
+            self._release(starts[winner])
+
+    def tokenize(self, text):
+        """Tokenizes `text` on the least-loaded healthy instance (every instance serves the same model)."""
+        with self.lease() as client:
+            return client.tokenize(text)
+
+    def context_size(self):
+        """Per-slot context length, as reported by a healthy instance."""
+        with self.lease() as client:
+            return client.context_size()
+
+    def complete(self, payload, crew_name=None):
+        """
+        Runs a non-streamed completion and returns the decoded JSON.
+        When hedging is on and the first instance is slower than `hedge_after`,
+        the same request goes to a second instance and the first answer wins; the other request
+        is dropped, which stops its generation on the server.
+        """
+        primary = self._pick(crew_name)
+        if not self.hedge_after or len(self.instances) < 2:
+            return self._complete_on(primary, payload, crew_name)
+
+        # Hedgeable requests stream internally, so the losing one can be cut off between tokens.
+        cancelled = threading.Event()
+        first = self._executor.submit(self._complete_on, primary, payload, crew_name, cancelled)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        try:
+            backup = self._pick(crew_name=None, exclude=primary)
+        except ConnectionError:
+            return first.result()
+        self.hedged += 1
+        second = self._executor.submit(self._complete_on, backup, payload, None, cancelled)
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is second:
+                            self.hedge_wins += 1
+                        return future.result()
+            return first.result()  # both failed: surface the primary's error
+        finally:
+            cancelled.set()  # the loser drops its connection at its next token
+
+    def report(self):
+        lines = [f"Server pool: {len(self.instances)} instances, {self.hedged} hedged requests ({self.hedge_wins} won by the hedge)"]
+        for instance in self.instances:
+            state = "healthy" if instance.healthy else "down"
+            lines.append(f"  {instance.url}: {state}, {instance.in_flight} in flight, {instance.restarts} restarts")
+        return "\n".join(lines)
+
+    def shutdown(self):
+        """Stops the monitor and terminates every instance."""
+        self._stop.set()
+        if self._monitor:
+            self._monitor.join(timeout=self.health_interval + 1)
+        for instance in self.instances:
+            instance.stop()
+        self._executor.shutdown(wait=False)
+
+
+def _collect_stream(client, payload, crew_name, cancelled):
+    """
+    Runs a completion as a stream and returns it in the non-streamed JSON shape (final event, full `content`).
+    Once `cancelled` is set the connection is dropped, which stops generation, and None is returned.
+    """
+    text = []
+    with client.stream(payload, crew_name=crew_name) as events:
+        for event in events:
+            if cancelled.is_set():
+                return None
+            text.append(event.get("content", ""))
+            if event.get("stop"):
+                return dict(event, content="".join(text))
+    raise ConnectionError("llama-server closed the stream before its final event.")
+
+
+def _port_url(base_url, port):
+    parts = urlsplit(base_url)
+    return urlunsplit((parts.scheme, f"{parts.hostname}:{port}", parts.path, parts.query, parts.fragment))
+
+
+def start_server_pool(base_url, build_command, progress=None):
+    """
+    Starts a pool of llama-server processes on consecutive ports, beginning at the port of `base_url`.
+    `build_command(url)` returns the launch command for one instance.
+    Env: SERVER_POOL_SIZE, SERVER_HEDGE_AFTER_MS (0 disables hedging), SERVER_HEALTH_INTERVAL
+    Returns the running pool, or None if no instance became healthy.
+    """
+    size = max(1, env_int("SERVER_POOL_SIZE", 2))
+    hedge_ms = env_int("SERVER_HEDGE_AFTER_MS", 0)
+    base_port = urlsplit(base_url).port or 8080
+    instances = []
+    for i in range(size):
+        url = _port_url(base_url, base_port + i)
+        instances.append(ServerInstance(build_command(url), url))
+    pool = LlamaServerPool(instances, hedge_after=hedge_ms / 1000 if hedge_ms > 0 else None,
+                           health_interval=env_float("SERVER_HEALTH_INTERVAL", 5.0))
+    print(f"Starting a pool of {size} LlamaCPP servers on ports {base_port}-{base_port + size - 1}...")
+    if not pool.start(progress=progress):
+        pool.shutdown()
+        return None
+    return pool
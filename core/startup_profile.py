@@ -0,0 +1,107 @@
+# core/startup_profile.py
+
+import importlib.abc
+import sys
+import threading
+import time
+
+# Import-time profiler behind `warp-core.py --profile-startup`.
+# A meta path finder wraps each module's loader and times exec_module, splitting cumulative
+# time (module plus everything it imports) from self time (the module's own top-level code).
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler._enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._leave()
+
+    def __getattr__(self, name):
+        # get_data, get_filename, is_package, ... keep working on the wrapped loader.
+        return getattr(self._loader, name)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """Records cumulative and self import time per module."""
+
+    def __init__(self):
+        self.records = []  # (module, cumulative seconds, self seconds, nesting depth) in completion order
+        # Per thread: imports on a background thread (the raven-activation thread) nest on their own stack.
+        self._local = threading.local()
+
+    def _thread_state(self):
+        local = self._local
+        if not hasattr(local, "stack"):
+            local.stack = []  # [module, start, time spent in nested imports]
+            local.finding = set()
+        return local
+
+    def find_spec(self, fullname, path, target=None):
+        finding = self._thread_state().finding
+        if fullname in finding:
+            return None
+        finding.add(fullname)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            finding.discard(fullname)
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    def _enter(self, name):
+        self._thread_state().stack.append([name, time.perf_counter(), 0.0])
+
+    def _leave(self):
+        stack = self._thread_state().stack
+        name, start, nested = stack.pop()
+        total = time.perf_counter() - start
+        if stack:
+            stack[-1][2] += total
+        self.records.append((name, total, total - nested, len(stack)))
+
+
+_profiler = None
+
+
+def enable():
+    """Starts timing every import from now on."""
+    global _profiler
+    if _profiler is None:
+        _profiler = ImportProfiler()
+        sys.meta_path.insert(0, _profiler)
+    return _profiler
+
+
+def enabled():
+    return _profiler is not None
+
+
+def report(phase, top=25):
+    """Prints the slowest imports since the previous report; does nothing unless profiling is enabled."""
+    if _profiler is None:
+        return
+    records, _profiler.records = _profiler.records, []
+    # Outermost imports of this phase add up to its total import time.
+    total = sum(cumulative for _, cumulative, _, depth in records if depth == 0)
+    print(f"\n--- Startup profile: {phase} ({len(records)} modules, ~{total * 1000:.0f} ms importing) ---")
+    print(f"{'cumulative':>11} {'self':>9}  module")
+    for name, cumulative, own, _ in sorted(records, key=lambda r: r[1], reverse=True)[:top]:
+        print(f"{cumulative * 1000:>9.1f}ms {own * 1000:>7.1f}ms  {name}")
+    print()
@@ -0,0 +1,174 @@
+# core/tracing.py
+
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+
+from core.env import env_bool, env_str
+
+# Nested spans for one chat turn (chat -> format_prompt -> generate -> parse -> tools), written per finished
+# trace as one line of OTLP/JSON (an ExportTraceServiceRequest), the format of the OpenTelemetry file exporter.
+# Off by default: until `configure()` enables it, `span()` returns a shared no-op object.
+
+DEFAULT_PATH = os.path.join("output_files", "traces.jsonl")
+SERVICE_NAME = "clemm-raven"
+
+_current = contextvars.ContextVar("raven_span", default=None)
+_exporter = None
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    """One timed operation; use through `span(...)`. Attributes may be added until it ends."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent", "attributes", "events", "start_ns", "end_ns", "error", "_children", "_token")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.events = []
+        self.error = None
+        # Finished spans of the whole trace, collected on the root and exported when it ends.
+        self._children = parent._children if parent else []
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, values):
+        for key, value in values.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self._children.append(self)
+        if self.parent is None and _exporter is not None:
+            _exporter.export(self._children)
+        return False
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "events": [{"name": name, "timeUnixNano": str(ts), "attributes": [_attribute(k, v) for k, v in attrs.items()]}
+                       for name, ts, attrs in self.events],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+class _NoopSpan:
+    """What `span()` returns while tracing is off: every method does nothing."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, values):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class FileExporter:
+    """Appends each finished trace to a JSONL file as one OTLP/JSON ExportTraceServiceRequest."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.resource = {"attributes": [_attribute("service.name", SERVICE_NAME)]}
+
+    def export(self, spans):
+        request = {"resourceSpans": [{
+            "resource": self.resource,
+            "scopeSpans": [{"scope": {"name": "core.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(request) + "\n")
+        except OSError as e:
+            print(f"WARNING: Could not write trace to {self.path} ({e}).")
+
+
+def span(name, **attributes):
+    """
+    Context manager for a span nested in the current one (a new trace when there is none).
+    The current span follows contextvars, so it crosses into scheduler worker threads.
+    """
+    if _exporter is None:
+        return NOOP_SPAN
+    return Span(name, _current.get(), attributes)
+
+
+def current_span():
+    """The active span, or the no-op span when tracing is off or outside any span."""
+    return _current.get() or NOOP_SPAN
+
+
+def enabled():
+    return _exporter is not None
+
+
+def configure(path=None, on=None):
+    """
+    Turns tracing on or off (`on` overrides the env); returns the trace file path, or None when off.
+    Env: TRACING_ENABLED (default off), TRACING_PATH (default output_files/traces.jsonl)
+    """
+    global _exporter
+    if on is None:
+        on = env_bool("TRACING_ENABLED", False)
+    if not on:
+        _exporter = None
+        return None
+    path = path or env_str("TRACING_PATH", DEFAULT_PATH)
+    if _exporter is None or _exporter.path != path:
+        _exporter = FileExporter(path)
+        print(f"Tracing chat turns to {os.path.abspath(path)}")
+    return path
@@ -0,0 +1,64 @@
+# tests/conftest.py
+# Fake backends for the tests: no GGUF model or llama-server is needed. Run from the repo root with `python -m pytest`.
+
+import os
+import time
+
+import pytest
+
+os.environ.setdefault("METRICS_JSONL_ENABLED", "0")
+os.environ.setdefault("TRACING_ENABLED", "0")
+
+
+class FakeTokenizer:
+    """Stands in for the Llama a local model_obj carries: one token per 4 bytes, n_ctx of 4096."""
+
+    def __init__(self, n_ctx=4096):
+        self._n_ctx = n_ctx
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, data, add_bos=False, special=True):
+        return list(range(len(data) // 4))
+
+
+class FakeEngine:
+    """
+    Stands in for `BatchEngine`: each generation streams the next scripted reply three characters
+    (one "token") per chunk and fills `usage` when it ends. A reply that is an exception is raised instead.
+    """
+
+    n_ctx_seq = 4096
+
+    def __init__(self, replies, delay=0.0):
+        self.replies = list(replies)
+        self.delay = delay
+        self.calls = []  # (prompt, max_tokens, grammar) per generation
+
+    def stream(self, prompt, max_tokens, temperature=0.8, top_k=50, top_p=0.95, repetition_penalty=1.15, stop=None, grammar=None,
+               lora=None, usage=None):
+        self.calls.append((prompt, max_tokens, grammar))
+        reply = self.replies.pop(0) if self.replies else "done."
+        return self._chunks(reply, max_tokens, usage)
+
+    def _chunks(self, reply, max_tokens, usage):
+        if isinstance(reply, Exception):
+            raise reply
+        tokens = [reply[i:i + 3] for i in range(0, len(reply), 3)][:max_tokens]
+        for token in tokens:
+            if self.delay:
+                time.sleep(self.delay)
+            yield token
+        if usage is not None:
+            usage.update(prompt_tokens=10, completion_tokens=len(tokens), prefill_ms=1.0, decode_ms=1.0)
+
+
+def fake_model(replies, delay=0.0, **extra):
+    """A local model_obj backed by a `FakeEngine` with the scripted replies."""
+    return {"type": "programmatic_gguf", "model": FakeTokenizer(), "batch_engine": FakeEngine(replies, delay), **extra}
+
+
+@pytest.fixture
+def make_model():
+    return fake_model
@@ -0,0 +1,52 @@
+# tests/test_bench.py
+
+import os
+
+from core import bench, raven
+
+from conftest import fake_model
+
+
+def test_scenarios_run_against_a_fake_backend():
+    model_obj = fake_model(["Hull integrity 97%. Course plotted."] * 20)
+    results = bench.run_bench(model_obj, runs=2, warmup=1, max_tokens=16, long_tokens=32)
+    assert set(results) == set(bench.SCENARIOS)
+    for metrics in results.values():
+        assert metrics["runs"] == 2
+        assert metrics["tokens"] > 0
+        assert metrics["latency_p95_ms"] >= metrics["latency_p50_ms"] > 0
+
+
+def test_cold_first_turn_never_shares_a_prompt_prefix():
+    # Caches that cannot be used: the scenario must leave them out rather than call them.
+    model_obj = fake_model(["Status: fine."] * 3, prefix_cache=object(), crew_states=object(), response_cache=object())
+    for _ in range(3):
+        bench.run_scenario("cold_first_turn", model_obj, {}, 16)
+    first_lines = [prompt.split("\n")[1] for prompt, _, _ in model_obj["batch_engine"].calls]
+    assert len(first_lines) == len(set(first_lines)) == 3
+    assert all(line.startswith("Benchmark run ") for line in first_lines)
+
+
+def test_compare_flags_only_regressions_past_the_threshold():
+    baseline = {"tenth_turn": {"ttft_ms": 100.0, "decode_tps": 50.0, "prefill_tps": 0, "latency_p50_ms": 1000.0, "latency_p95_ms": 1200.0}}
+    current = {"tenth_turn": {"ttft_ms": 130.0, "decode_tps": 48.0, "prefill_tps": 10.0, "latency_p50_ms": 900.0, "latency_p95_ms": 1250.0}}
+    assert bench.compare(baseline, current, 0.15) == [("tenth_turn", "ttft_ms", 100.0, 130.0)]
+
+
+def test_main_starts_the_backend_without_memoization(monkeypatch, tmp_path):
+    seen = {}
+
+    def activate(backend):
+        seen.update({name: os.environ.get(name) for name in bench.NO_MEMO_ENV}, backend=backend)
+        return fake_model(["Ready."] * 40)
+
+    for name in bench.NO_MEMO_ENV:
+        monkeypatch.setenv(name, "1")
+    monkeypatch.setattr(bench, "load_dotenv", lambda: None)
+    monkeypatch.setattr(raven, "activate_raven", activate)
+    baseline = tmp_path / "baseline.json"
+    argv = ["--backend", "cpu", "--runs", "1", "--warmup", "0", "--max-tokens", "8", "--long-tokens", "8", "--baseline", str(baseline)]
+    assert bench.main(argv) == 0
+    assert seen == {"RESPONSE_CACHE_ENABLED": "0", "SEMANTIC_CACHE_ENABLED": "0", "backend": "cpu"}
+    assert baseline.exists()
+    assert bench.main(argv + ["--threshold", "100"]) == 0
@@ -0,0 +1,176 @@
+# tests/test_crew.py
+
+import threading
+import time
+
+import pytest
+
+from bridge.crew import MIN_STEP_TOKENS, Crew
+from bridge.tools import tools
+from core import raven
+
+from conftest import FakeTokenizer, fake_model
+
+
+class RecordingSemanticCache:
+    """Hits with `reply` (if given); remembers what the crew looks up and stores."""
+
+    def __init__(self, reply=None):
+        self.reply = reply
+        self.lookups = []
+        self.stored = []
+
+    def lookup(self, crew, text, threshold):
+        self.lookups.append(text)
+        return self.reply, None
+
+    def store(self, crew, text, reply, seconds, vector):
+        self.stored.append(reply)
+
+
+@pytest.fixture
+def echo_tool(monkeypatch):
+    monkeypatch.setitem(tools.TOOL_LIST, "echo", tools.Tool("Echoes its value.", lambda value="": f"echo {value}", ["value"],
+                                                           timeout_s=2.0))
+    return "echo"
+
+
+@pytest.fixture
+def slow_tool(monkeypatch):
+    def wait(seconds="0.2"):
+        time.sleep(float(seconds))
+        return f"waited {seconds}"
+
+    monkeypatch.setitem(tools.TOOL_LIST, "wait", tools.Tool("Waits.", wait, ["seconds"], timeout_s=5.0))
+    return "wait"
+
+
+def make_crew(model_obj, **fields):
+    return Crew(**{"name": "test", "system_prompt": "You are a test.", "model": model_obj, "max_tokens": 50, **fields})
+
+
+def test_complete_reply_goes_to_the_semantic_cache():
+    cache = RecordingSemanticCache()
+    crew = make_crew(fake_model(["All quiet on deck."], semantic_cache=cache), semantic_threshold=0.9)
+    assert crew.chat("status?") == "All quiet on deck."
+    assert cache.stored == ["All quiet on deck."]
+
+
+def test_reply_stopped_early_is_not_semantically_cached(echo_tool):
+    cache = RecordingSemanticCache()
+    model_obj = fake_model(['run_tool echo value="a"\nNow some prose that is cut off here.', "Done."], semantic_cache=cache)
+    crew = make_crew(model_obj, semantic_threshold=0.9)
+    reply = crew.chat("echo a")
+    assert "TOOL RESULT: echo a" in reply
+    assert cache.stored == []
+
+
+def test_reply_cut_off_by_the_turn_deadline_is_not_semantically_cached():
+    cache = RecordingSemanticCache()
+    model_obj = fake_model(["word " * 200], delay=0.01, semantic_cache=cache)
+    crew = make_crew(model_obj, semantic_threshold=0.9, turn_deadline_s=0.1)
+    assert crew.chat("talk a lot")
+    assert cache.stored == []
+
+
+def test_reply_that_ran_commands_is_not_semantically_cached(echo_tool):
+    cache = RecordingSemanticCache()
+    model_obj = fake_model(['run_tool echo value="a"', "Echoed."], semantic_cache=cache)
+    crew = make_crew(model_obj, semantic_threshold=0.9)
+    assert crew.chat("echo a") == "TOOL RESULT: echo a\n\nEchoed."
+    assert cache.stored == []
+
+
+def test_tool_grammar_crew_never_uses_the_semantic_cache(echo_tool):
+    cache = RecordingSemanticCache(reply='run_tool echo value="notes"')
+    model_obj = fake_model(['run_tool echo value="todo"'], semantic_cache=cache)
+    crew = make_crew(model_obj, semantic_threshold=0.9, tool_grammar=True, available_tools=[echo_tool], max_steps=1)
+    assert crew.chat("echo todo") == "TOOL RESULT: echo todo"
+    assert cache.lookups == [] and cache.stored == []
+
+
+def test_tool_results_reach_the_next_step(echo_tool):
+    model_obj = fake_model(['run_tool echo value="a"', "The echo said a."])
+    crew = make_crew(model_obj)
+    assert crew.chat("echo a") == "TOOL RESULT: echo a\n\nThe echo said a."
+    prompts = [prompt for prompt, _, _ in model_obj["batch_engine"].calls]
+    assert len(prompts) == 2 and "echo a" in prompts[1]
+    assert [record["tool_calls"] for record in crew.last_turn] == [1, 0]
+
+
+def test_repeated_commands_end_the_turn(echo_tool):
+    model_obj = fake_model(['run_tool echo value="a"', 'run_tool echo value="a"', "never generated"])
+    make_crew(model_obj).chat("echo a")
+    assert len(model_obj["batch_engine"].calls) == 2
+
+
+def test_max_steps_bounds_the_turn(echo_tool):
+    model_obj = fake_model(['run_tool echo value="a"', 'run_tool echo value="b"', "never generated"])
+    make_crew(model_obj, max_steps=2).chat("echo")
+    assert len(model_obj["batch_engine"].calls) == 2
+
+
+def test_turn_token_budget_shrinks_the_follow_up_step(echo_tool):
+    model_obj = fake_model(['run_tool echo value="a"', "x" * 300])
+    crew = make_crew(model_obj, turn_token_budget=30)
+    crew.chat("echo a")
+    first, second = crew.last_turn
+    assert second["max_tokens"] == 30 - first["tokens"]
+    assert first["tokens"] + second["tokens"] <= 30
+
+
+def test_follow_up_step_too_small_for_the_budget_is_skipped(echo_tool):
+    command = 'run_tool echo value="a"'
+    model_obj = fake_model([command, "never generated"])
+    used = len(command) // 3 + 1
+    crew = make_crew(model_obj, turn_token_budget=used + MIN_STEP_TOKENS - 1)
+    assert crew.chat("echo a") == "TOOL RESULT: echo a"
+    assert len(model_obj["batch_engine"].calls) == 1
+
+
+def test_turn_deadline_stops_generation_and_keeps_the_text():
+    model_obj = fake_model(["word " * 200], delay=0.01)
+    crew = make_crew(model_obj, max_tokens=400, turn_deadline_s=0.15)
+    started = time.monotonic()
+    reply = crew.chat("talk a lot")
+    assert time.monotonic() - started < 1.0
+    assert reply.startswith("word word")
+    assert crew.last_turn[0]["tokens"] < 100
+
+
+def test_no_follow_up_step_after_the_turn_deadline(slow_tool):
+    model_obj = fake_model(['run_tool wait seconds="0.3"', "never generated"])
+    crew = make_crew(model_obj, turn_deadline_s=0.2)
+    assert crew.chat("wait") == "TOOL RESULT: waited 0.3"
+    assert len(model_obj["batch_engine"].calls) == 1
+
+
+def test_turn_still_queued_at_its_deadline_is_an_error():
+    model_obj = raven.attach_scheduler(fake_model(["busy " * 40, "late"], delay=0.01), workers=1)
+    try:
+        busy = threading.Thread(target=raven.scheduled_response, args=(model_obj, [{"role": "user", "content": "x"}]),
+                                kwargs={"max_tokens": 40})
+        busy.start()
+        time.sleep(0.05)
+        crew = make_crew(model_obj, deadline_s=0.05)
+        assert crew.chat("hello").startswith("Error: ")
+        assert crew.messages == [{"role": "system", "content": "You are a test."}]  # the turn is not kept
+        busy.join()
+    finally:
+        model_obj["scheduler"].shutdown()
+
+
+class SlowTokenizer(FakeTokenizer):
+    def tokenize(self, data, add_bos=False, special=True):
+        time.sleep(0.02)
+        return super().tokenize(data, add_bos, special)
+
+
+def test_tool_ms_times_only_the_tools(slow_tool):
+    crew = make_crew(fake_model(["Plain answer."], model=SlowTokenizer()))
+    crew.chat("hi")
+    assert crew.last_turn[0]["tool_ms"] == 0.0  # adding the reply to the history tokenizes it, but runs no tool
+    crew = make_crew(fake_model(['run_tool wait seconds="0.1"', "Done."], model=SlowTokenizer()))
+    crew.chat("wait")
+    assert 100 <= crew.last_turn[0]["tool_ms"] < 1000
+    assert crew.last_turn[1]["tool_ms"] == 0.0
@@ -0,0 +1,106 @@
+# tests/test_grammar.py
+
+import pytest
+
+from bridge.tools.grammar import MAX_VALUE_CHARS, ToolCallStream, max_command_tokens, parse_tool_calls, tool_call_grammar
+
+
+def stream(text, chunk=3):
+    """Feeds `text` to a ToolCallStream in small chunks, as the backends deliver it, and closes it."""
+    reader = ToolCallStream()
+    visible, calls = "", []
+    for i in range(0, len(text), chunk):
+        shown, found = reader.feed(text[i:i + chunk])
+        visible, calls = visible + shown, calls + found
+    shown, found = reader.close()
+    return reader, visible + shown, calls + found
+
+
+@pytest.mark.parametrize("text", [
+    "run_tool open_notes",
+    "`run_tool open_notes`",
+    "Sure: `run_tool open_notes` opens the log.",
+    "'run_tool open_notes'",
+    "run_tool open_notes.",
+    "run_tool open_notes,",
+])
+def test_wrapped_or_punctuated_command_runs(text):
+    reader, _, calls = stream(text)
+    assert calls == [("open_notes", {})]
+    assert reader.errors == []
+    assert parse_tool_calls(text) == [("open_notes", {})]
+
+
+@pytest.mark.parametrize("text, params", [
+    ('run_tool create_file filename="a.txt", content="hi there"', {"filename": "a.txt", "content": "hi there"}),
+    ('run_tool create_file filename="a.txt".', {"filename": "a.txt"}),
+    ("run_tool create_file filename='a.txt'", {"filename": "a.txt"}),
+    ("run_tool fire_laser target=ship, power_level=high", {"target": "ship", "power_level": "high"}),
+    ('"run_tool create_file filename="a.txt""', {"filename": "a.txt"}),
+])
+def test_parameters_are_parsed(text, params):
+    _, _, calls = stream(text)
+    assert calls == [(text.split()[1], params)]
+
+
+@pytest.mark.parametrize("text", [
+    'run_tool fire_laser target="foo',
+    "run_tool fire_laser target='foo",
+    "run_tool fire_laser target=",
+    'run_tool create_file filename="a.txt", content',
+])
+def test_stream_ending_inside_a_command_is_an_error(text):
+    reader, _, calls = stream(text)
+    assert calls == []
+    assert reader.errors == [f"Incomplete tool command was not run: {text}"]
+
+
+def test_prose_mentioning_run_tool_is_not_an_error():
+    reader, visible, calls = stream("I could run_tool open_notes for you, but I won't.\nAnything else?")
+    assert calls == []
+    assert reader.errors == []
+    assert visible == "I could run_tool open_notes for you, but I won't.\nAnything else?"
+
+
+def test_incomplete_line_that_was_terminated_is_not_run_nor_reported():
+    reader, _, calls = stream('run_tool fire_laser target="foo\nrun_tool open_notes\n')
+    assert calls == [("open_notes", {})]
+    assert reader.errors == []
+
+
+def test_commands_are_reported_as_their_lines_end():
+    reader = ToolCallStream()
+    assert reader.feed('run_tool create_file filename="a.txt"') == ('run_tool create_file filename="a.txt"', [])
+    assert reader.feed("\nrun_tool open") == ("\nrun_tool open", [("create_file", {"filename": "a.txt"})])
+    assert reader.feed("_notes\n")[1] == [("open_notes", {})]
+    assert not reader.finished
+
+
+def test_prose_after_the_commands_finishes_the_stream():
+    reader, visible, calls = stream("On it.\nrun_tool open_notes\nThe log is open now, captain.")
+    assert calls == [("open_notes", {})]
+    assert reader.finished
+    assert visible == "On it.\nrun_tool open_notes\n"
+    assert reader.preamble == "On it."
+    assert reader.feed("more") == ("", [])
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 5, 100])
+def test_think_blocks_are_dropped_across_chunks(chunk):
+    _, visible, calls = stream("<think>maybe run_tool open_notes?</think>\nrun_tool open_notes", chunk)
+    assert visible == "run_tool open_notes"
+    assert calls == [("open_notes", {})]
+
+
+def test_grammar_covers_the_listed_tools_and_bounds_values():
+    grammar = tool_call_grammar(["create_file", "open_notes"])
+    assert 'root ::= "run_tool " call' in grammar
+    assert "tool-create-file" in grammar and "tool-open-notes" in grammar
+    assert "tool-fire-laser" not in grammar
+    assert f"{{0,{MAX_VALUE_CHARS}}}" in grammar
+
+
+def test_max_command_tokens_fits_the_longest_command():
+    longest = 'run_tool create_file filename="{0}", content="{0}"'.format("x" * MAX_VALUE_CHARS)
+    assert max_command_tokens(["create_file"]) == len(longest) + 1
+    assert max_command_tokens(["open_notes"]) < max_command_tokens(["create_file"])
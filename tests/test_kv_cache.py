@@ -0,0 +1,183 @@
+# tests/test_kv_cache.py
+
+import numpy as np
+import pytest
+
+from core.kv_cache import CrewStateSnapshots, PrefixStateCache, open_crew_snapshots
+
+MB = 1024 * 1024
+
+
+class FakeState:
+    """Stands in for LlamaState: the evaluated tokens, `nbytes` of KV cache."""
+
+    def __init__(self, tokens, nbytes=1000):
+        self.tokens = list(tokens)
+        self.llama_state_size = nbytes
+        self.input_ids = np.array(tokens, dtype=np.intc)
+        self.scores = np.zeros(0, dtype=np.single)
+
+
+class FakeLlama:
+    """Evaluates by appending token ids (one per word); counts every evaluated token."""
+
+    def __init__(self, n_ctx=64, state_bytes=1000, fail_eval=False):
+        self._n_ctx = n_ctx
+        self.state_bytes = state_bytes
+        self.fail_eval = fail_eval
+        self.input_ids = []
+        self.evaluated = 0
+        self.loads = 0
+
+    @property
+    def n_tokens(self):
+        return len(self.input_ids)
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, data, add_bos=True, special=False):
+        return [sum(word) % 1000 for word in data.split()]
+
+    def reset(self):
+        self.input_ids = []
+
+    def eval(self, tokens):
+        if self.fail_eval:
+            self.input_ids.extend(tokens[:1])
+            raise RuntimeError("decode failed")
+        self.input_ids.extend(tokens)
+        self.evaluated += len(tokens)
+
+    def save_state(self):
+        return FakeState(self.input_ids, self.state_bytes)
+
+    def load_state(self, state):
+        self.input_ids = list(state.tokens)
+        self.loads += 1
+
+
+PREFIX = "<|im_start|>system you are the captain<|im_end|>"
+
+
+@pytest.fixture
+def prefix_dir(tmp_path):
+    return str(tmp_path / "prefix")
+
+
+def test_prefix_is_evaluated_once_and_restored_after_a_restart(prefix_dir):
+    cache = PrefixStateCache("model", prefix_dir, MB)
+    model = FakeLlama()
+    assert cache.prefill(model, PREFIX) == 0
+    assert model.evaluated == 5
+    cache.close()
+
+    cache, model = PrefixStateCache("model", prefix_dir, MB), FakeLlama()
+    assert cache.prefill(model, PREFIX) == 5
+    assert (model.evaluated, model.loads, model.n_tokens) == (0, 1, 5)
+    assert cache.stats()["tokens_saved"] == 5
+    cache.close()
+
+
+def test_resident_prefix_is_reused_in_place(prefix_dir):
+    cache, model = PrefixStateCache("model", prefix_dir, MB), FakeLlama()
+    cache.prefill(model, PREFIX)
+    model.input_ids.extend([7, 8])  # the previous turn's prompt after the prefix
+    assert cache.prefill(model, PREFIX) == 5
+    assert model.loads == 0 and model.evaluated == 5
+    cache.close()
+
+
+def test_variants_are_cached_apart(prefix_dir):
+    cache, model = PrefixStateCache("model", prefix_dir, MB), FakeLlama()
+    cache.prefill(model, PREFIX, variant="lora-a")
+    model.reset()
+    assert cache.prefill(model, PREFIX, variant="lora-b") == 0
+    assert cache.stats()["misses"] == 2
+    cache.close()
+
+
+def test_prefix_longer_than_the_context_is_skipped(prefix_dir, capsys):
+    cache, model = PrefixStateCache("model", prefix_dir, MB), FakeLlama(n_ctx=4)
+    assert cache.prefill(model, PREFIX) == 0
+    assert cache.prefill(model, PREFIX) == 0
+    assert model.evaluated == 0 and cache.stats()["entries"] == 0
+    assert capsys.readouterr().out.count("WARNING") == 1
+    cache.close()
+
+
+def test_failed_evaluation_is_not_cached(prefix_dir):
+    cache, model = PrefixStateCache("model", prefix_dir, MB), FakeLlama(fail_eval=True)
+    assert cache.prefill(model, PREFIX) == 0
+    assert model.n_tokens == 0  # a partial prefix must not look reusable
+    assert cache.stats()["entries"] == 0
+    cache.close()
+
+
+def test_unusable_entry_is_discarded(prefix_dir):
+    cache, model = PrefixStateCache("model", prefix_dir, MB), FakeLlama()
+    cache.prefill(model, PREFIX)
+
+    def broken(state):
+        raise ValueError("state of another build")
+
+    model = FakeLlama()
+    model.load_state = broken
+    assert cache.prefill(model, PREFIX) == 0
+    assert model.evaluated == 5  # evaluated afresh and stored again
+    assert cache.stats()["misses"] == 2
+    cache.close()
+
+
+def test_crew_switch_parks_and_restores_contexts():
+    snapshots, model = CrewStateSnapshots(MB), FakeLlama()
+    assert not snapshots.switch_to(model, "captain")  # cold
+    model.eval([1, 2, 3])
+    assert not snapshots.switch_to(model, "captain")  # already resident
+    assert not snapshots.switch_to(model, "engineer")
+    model.reset()
+    model.eval([9])
+    assert snapshots.switch_to(model, "captain")
+    assert model.input_ids == [1, 2, 3]
+    assert snapshots.switch_to(model, "engineer")
+    assert model.input_ids == [9]
+    stats = snapshots.stats()
+    assert (stats["snapshots"], stats["restores"], stats["misses"]) == (2, 2, 2)
+
+
+def test_snapshots_stay_within_the_budget():
+    snapshots, model = CrewStateSnapshots(2500), FakeLlama(state_bytes=1000)
+    for crew in ("a", "b", "c", "d"):
+        snapshots.switch_to(model, crew)
+        model.eval([len(crew)])
+    stats = snapshots.stats()
+    assert stats["snapshots"] == 2 and stats["used_bytes"] <= 2500 and stats["evictions"] == 1
+    assert not snapshots.switch_to(model, "a")  # the least recently parked went first
+
+
+def test_snapshot_larger_than_the_budget_is_not_kept():
+    snapshots, model = CrewStateSnapshots(500), FakeLlama(state_bytes=1000)
+    snapshots.switch_to(model, "a")
+    model.eval([1])
+    snapshots.switch_to(model, "b")
+    assert snapshots.stats()["snapshots"] == 0 and snapshots.stats()["used_bytes"] == 0
+
+
+def test_snapshot_that_fails_to_restore_is_dropped():
+    snapshots, model = CrewStateSnapshots(MB), FakeLlama()
+    snapshots.switch_to(model, "a")
+    model.eval([1])
+    snapshots.switch_to(model, "b")
+
+    def broken(state):
+        raise ValueError("bad state")
+
+    model.load_state = broken
+    assert not snapshots.switch_to(model, "a")
+    assert list(snapshots._states) == ["b"]  # "b" was parked by the switch; "a" is gone
+    assert snapshots.stats()["used_bytes"] == snapshots._states["b"][1]
+
+
+def test_snapshots_disabled_by_a_zero_budget(monkeypatch):
+    monkeypatch.setenv("CREW_STATE_BUDGET_MB", "0")
+    assert open_crew_snapshots() is None
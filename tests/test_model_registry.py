@@ -0,0 +1,99 @@
+# tests/test_model_registry.py
+
+import pytest
+
+from core import model_registry
+from core.model_registry import ModelRegistry
+
+MB = 2**20
+
+
+class FakeLlama:
+    """A Llama stand-in of 100 MB; `on_tokenize` runs inside `tokenize`, while the model is in use."""
+
+    def __init__(self, path, on_tokenize=None):
+        self.model_path = path
+        self.on_tokenize = on_tokenize
+        self.closed = False
+
+    def tokenize(self, data, add_bos=False, special=True):
+        assert not self.closed, "tokenized with a closed model"
+        if self.on_tokenize:
+            self.on_tokenize()
+        return list(range(len(data) // 4))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeScheduler:
+    def shutdown(self):
+        pass
+
+
+def fake_obj(path):
+    return {"type": "programmatic_gguf", "model": FakeLlama(path), "scheduler": FakeScheduler()}
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, "model_memory_bytes", lambda model: 100 * MB)
+    monkeypatch.setattr(model_registry, "vocab_tokenizer", FakeLlama)
+    paths = {}
+    for name in ("main", "small", "other"):
+        paths[name] = tmp_path / f"{name}.gguf"
+        paths[name].write_bytes(b"gguf")
+    monkeypatch.setenv("RAVEN_GGUF_MODEL_PATH_SMALL", str(paths["small"]))
+    monkeypatch.setenv("RAVEN_GGUF_MODEL_PATH_OTHER", str(paths["other"]))
+    return ModelRegistry(fake_obj(str(paths["main"])), fake_obj, budget_bytes=250 * MB)
+
+
+def test_least_recently_used_idle_model_is_unloaded(registry):
+    small = registry.acquire("small")
+    small_llama = small.model_obj["model"]
+    registry.release(small)
+    other = registry.acquire("other")
+    assert not small.loaded and small_llama.closed
+    assert other.loaded and registry.unloads == 1
+    registry.release(other)
+
+
+def test_model_in_use_is_not_unloaded(registry):
+    small = registry.acquire("small")
+    other = registry.acquire("other")
+    assert small.loaded and other.loaded
+    for entry in (small, other):
+        registry.release(entry)
+
+
+def test_count_tokens_leases_the_model_it_tokenizes_with(registry):
+    small = registry.acquire("small")
+    registry.release(small)
+    llama = small.model_obj["model"]
+    leases = []
+
+    def evict_meanwhile():
+        leases.append(small.in_use)
+        registry.budget_bytes = 0
+        registry._make_room(0)  # another thread making room while the tokens are counted
+
+    llama.on_tokenize = evict_meanwhile
+    assert registry.count_tokens("small", "x" * 40) == 10
+    assert leases == [1]
+    assert small.loaded and not llama.closed
+    registry._make_room(0)
+    assert not small.loaded and llama.closed
+
+
+def test_tokenizers_of_unloaded_models_are_closed(registry):
+    assert registry.count_tokens("small", "x" * 8) == 2
+    tokenizer = registry._tokenizers[registry.resolve("small")]
+    small = registry.acquire("small")
+    assert tokenizer.closed and registry._tokenizers == {}
+    assert registry.count_tokens("small", "x" * 8) == 2  # the loaded model now
+    registry.release(small)
+    assert registry.count_tokens("other", "x" * 8) == 2
+    tokenizer = registry._tokenizers[registry.resolve("other")]
+    registry.close()
+    assert tokenizer.closed and registry._tokenizers == {}
+    assert not small.loaded and not registry.main.model_obj["model"].closed
@@ -0,0 +1,59 @@
+# tests/test_raven.py
+
+from core import raven
+from core.response_cache import ResponseCache
+
+from conftest import fake_model
+
+MESSAGES = [{"role": "system", "content": "You are a test."}, {"role": "user", "content": "hello"}]
+
+
+def memo_model(tmp_path, replies):
+    return fake_model(replies, response_cache=ResponseCache("test-model", str(tmp_path / "responses"), 1024 * 1024))
+
+
+def test_deterministic_reply_is_memoized(tmp_path):
+    model_obj = memo_model(tmp_path, ["The answer is 42."])
+    first = raven.generate_response(model_obj, MESSAGES, max_tokens=50, temperature=0.0)
+    second = raven.generate_response(model_obj, MESSAGES, max_tokens=50, temperature=0.0)
+    assert first == second == "The answer is 42."
+    assert len(model_obj["batch_engine"].calls) == 1
+
+
+def test_reply_stopped_by_the_caller_is_not_memoized(tmp_path):
+    model_obj = memo_model(tmp_path, ['run_tool create_file filename="notes.txt"', "Fresh reply."])
+    seen = []
+
+    def stop_after_two(chunk):
+        seen.append(chunk.text)
+        return len(seen) < 2
+
+    partial = raven.generate_response(model_obj, MESSAGES, max_tokens=50, temperature=0.0, on_token=stop_after_two)
+    assert partial == "run_to"
+    assert raven.generate_response(model_obj, MESSAGES, max_tokens=50, temperature=0.0) == "Fresh reply."
+    assert len(model_obj["batch_engine"].calls) == 2
+
+
+def test_backend_failure_returns_none(tmp_path):
+    model_obj = memo_model(tmp_path, [RuntimeError("backend down")])
+    assert raven.generate_response(model_obj, MESSAGES, max_tokens=50, temperature=0.0, on_token=lambda chunk: None) is None
+
+
+def test_grammar_reply_cut_off_at_max_tokens_is_rejected():
+    model_obj = fake_model(['run_tool create_file filename="a-very-long-name.txt"'])
+    text = raven.generate_response(model_obj, MESSAGES, max_tokens=4, temperature=0.0, grammar="root ::= \"x\"",
+                                   on_token=lambda chunk: None)
+    assert text is None
+
+
+def test_full_context_without_a_batch_engine(monkeypatch):
+    monkeypatch.setenv("CONTEXT_SIZE", "8192")
+    assert raven.model_context_size({"n_batch": 256}) == 8192
+
+
+def test_small_context_is_one_batch(monkeypatch):
+    monkeypatch.setenv("CONTEXT_SIZE", "8192")
+    assert raven.model_context_size({}, small_context=True) == 512
+    assert raven.model_context_size({"n_batch": 1024}, small_context=True) == 1024
+    monkeypatch.setenv("CONTEXT_SIZE", "256")
+    assert raven.model_context_size({"n_batch": 1024}, small_context=True) == 256
@@ -0,0 +1,61 @@
+# tests/test_response_cache.py
+
+import time
+
+import pytest
+
+from core.response_cache import ResponseCache, open_response_cache
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache("model-a", str(tmp_path / "responses"), MB, memory_entries=2)
+    yield cache
+    cache.close()
+
+
+def test_key_covers_model_prompt_and_params(tmp_path, cache):
+    key = cache.key_for("prompt", {"max_tokens": 10, "top_k": 50})
+    assert key == cache.key_for("prompt", {"top_k": 50, "max_tokens": 10})
+    assert key != cache.key_for("prompt!", {"max_tokens": 10, "top_k": 50})
+    assert key != cache.key_for("prompt", {"max_tokens": 11, "top_k": 50})
+    other = ResponseCache("model-b", str(tmp_path / "other"), MB)
+    assert key != other.key_for("prompt", {"max_tokens": 10, "top_k": 50})
+    other.close()
+
+
+def test_memory_then_disk_hits(cache):
+    assert cache.get("a") is None
+    cache.set("a", "reply a")
+    assert cache.get("a") == "reply a"
+    cache.set("b", "reply b")
+    cache.set("c", "reply c")  # the in-memory LRU keeps two entries: "a" falls back to disk
+    assert cache.get("a") == "reply a"
+    assert cache.stats()["hits"] == 2 and cache.stats()["disk_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entries_survive_a_restart(tmp_path):
+    directory = str(tmp_path / "responses")
+    cache = ResponseCache("model-a", directory, MB)
+    cache.set("k", "kept")
+    cache.close()
+    cache = ResponseCache("model-a", directory, MB)
+    assert cache.get("k") == "kept"
+    assert cache.stats()["disk_hits"] == 1
+    cache.close()
+
+
+def test_entries_expire_after_the_ttl(tmp_path):
+    cache = ResponseCache("model-a", str(tmp_path / "responses"), MB, ttl=1)
+    cache.set("k", "short-lived")
+    assert cache.get("k") == "short-lived"
+    time.sleep(1.1)
+    assert cache.get("k") is None
+    cache.close()
+
+
+def test_disabled_by_env(monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE_ENABLED", "0")
+    assert open_response_cache("model-a") is None
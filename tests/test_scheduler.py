@@ -0,0 +1,101 @@
+# tests/test_scheduler.py
+
+import contextvars
+import threading
+import time
+
+import pytest
+
+from core.scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, DeadlineExceeded, InferenceScheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = InferenceScheduler(workers=1, name="test")
+    yield scheduler
+    scheduler.shutdown(cancel_futures=True)
+
+
+def block(scheduler):
+    """Occupies the single worker until the returned event is set."""
+    release, running = threading.Event(), threading.Event()
+    scheduler.schedule(lambda: (running.set(), release.wait(5)))
+    running.wait(5)
+    return release
+
+
+def test_higher_priority_runs_first(scheduler):
+    release = block(scheduler)
+    order = []
+    futures = [scheduler.schedule(order.append, (name,), priority=priority)
+               for name, priority in [("low", PRIORITY_LOW), ("normal", PRIORITY_NORMAL), ("high", PRIORITY_HIGH)]]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["high", "normal", "low"]
+
+
+def test_earliest_deadline_first_within_a_priority(scheduler):
+    release = block(scheduler)
+    order = []
+    now = time.monotonic()
+    futures = [scheduler.schedule(order.append, ("none",)),
+               scheduler.schedule(order.append, ("late",), deadline=now + 20),
+               scheduler.schedule(order.append, ("soon",), deadline=now + 10)]
+    release.set()
+    for future in futures:
+        future.result(5)
+    assert order == ["soon", "late", "none"]
+
+
+def test_request_still_queued_at_its_deadline_fails(scheduler):
+    release = block(scheduler)
+    ran = []
+    future = scheduler.schedule(ran.append, (1,), deadline=time.monotonic() + 0.05)
+    time.sleep(0.1)
+    release.set()
+    with pytest.raises(DeadlineExceeded):
+        future.result(5)
+    assert ran == []
+    assert scheduler.stats()["expired"] == 1
+
+
+def test_cancelled_request_never_runs(scheduler):
+    release = block(scheduler)
+    ran = []
+    future = scheduler.schedule(ran.append, (1,))
+    assert future.cancel()
+    release.set()
+    scheduler.schedule(lambda: None).result(5)
+    assert ran == []
+    assert scheduler.stats()["cancelled"] == 1
+
+
+def test_failure_reaches_the_caller(scheduler):
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        scheduler.schedule(fail).result(5)
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_job_runs_in_the_callers_context(scheduler):
+    var = contextvars.ContextVar("var", default="worker")
+    var.set("caller")
+    assert scheduler.schedule(var.get).result(5) == "caller"
+
+
+def test_stats_and_shutdown(scheduler):
+    release = block(scheduler)
+    futures = [scheduler.schedule(time.sleep, (0,)) for _ in range(3)]
+    assert scheduler.stats()["depth"] == 3
+    release.set()
+    for future in futures:
+        future.result(5)
+    stats = scheduler.stats()
+    assert (stats["submitted"], stats["completed"], stats["max_depth"]) == (4, 4, 3)
+    assert stats["wait_p95"] >= stats["wait_p50"] > 0
+    scheduler.shutdown()
+    with pytest.raises(RuntimeError):
+        scheduler.schedule(time.sleep, (0,))
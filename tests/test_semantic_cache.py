@@ -0,0 +1,124 @@
+# tests/test_semantic_cache.py
+
+import types
+import zlib
+
+import numpy as np
+import pytest
+
+from core.semantic_cache import SemanticCache, VectorIndex
+
+DIM = 32
+
+
+class FakeEmbedder:
+    """Bag-of-words embeddings (word order does not matter) and a context of `n_ctx` one-word tokens."""
+
+    def __init__(self, n_ctx=16):
+        self._n_ctx = n_ctx
+        self.context_params = types.SimpleNamespace(n_ubatch=512)
+        self.closed = False
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, data, add_bos=True, special=False):
+        return data.split()
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, zlib.crc32(word.encode()) % DIM] += 1.0
+        return vectors.tolist()
+
+    def close(self):
+        self.closed = True
+
+
+def unit(*hot):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[list(hot)] = 1.0
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / "semantic" / "model")
+
+
+@pytest.fixture
+def cache(index_path):
+    return SemanticCache(FakeEmbedder(), VectorIndex(index_path, DIM, 4, "model"))
+
+
+def test_paraphrase_hits_and_other_crews_miss(cache):
+    reply, vector = cache.lookup("captain", "what is the ship status", 0.9)
+    assert reply is None and vector is not None
+    cache.store("captain", "what is the ship status", "All quiet.", 1.5, vector)
+    assert cache.lookup("captain", "the ship status is what", 0.9)[0] == "All quiet."
+    assert cache.lookup("engineer", "what is the ship status", 0.9)[0] is None
+    assert cache.lookup("captain", "fire the main laser now", 0.9)[0] is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["saved_seconds"]) == (1, 3, 1.5)
+
+
+def test_turn_too_long_to_embed_is_skipped(cache):
+    text = " ".join(f"w{i}" for i in range(40))
+    assert cache.lookup("captain", text, 0.9) == (None, None)
+    cache.store("captain", text, "reply", 1.0)
+    assert len(cache.index) == 0 and cache.stats()["skipped"] == 1
+
+
+def test_full_index_reuses_the_least_recently_used_row(index_path):
+    index = VectorIndex(index_path, DIM, 2, "model")
+    assert not index.add(unit(0), "c", {"reply": "a"})
+    assert not index.add(unit(1), "c", {"reply": "b"})
+    index.touch(0)  # "a" was used since: "b" goes
+    assert index.add(unit(2), "c", {"reply": "c"})
+    assert sorted(row["reply"] for row in index.rows) == ["a", "c"]
+
+
+def test_search_is_batched_and_per_crew(index_path):
+    index = VectorIndex(index_path, DIM, 4, "model")
+    index.add(unit(0), "a", {"reply": "zero"})
+    index.add(unit(1), "b", {"reply": "one"})
+    rows, scores = index.search(np.stack([unit(0), unit(1)]), "a")
+    assert [index.rows[row]["reply"] for row in rows] == ["zero", "zero"]
+    assert scores[0] == pytest.approx(1.0) and scores[1] == pytest.approx(0.0)
+    assert index.search(unit(0)[None, :], "nobody")[0].tolist() == [-1]
+
+
+def test_rows_in_the_log_survive_a_restart(index_path):
+    index = VectorIndex(index_path, DIM, 4, "model")
+    index.add(unit(0), "a", {"reply": "logged"})
+    index.vectors.flush()
+    with open(index_path + ".log", "a", encoding="utf-8") as f:
+        f.write('{"row": 1, "crew": "a", "repl')  # torn by a crash
+    reopened = VectorIndex(index_path, DIM, 4, "model")
+    assert len(reopened) == 1
+    rows, scores = reopened.search(unit(0)[None, :], "a")
+    assert reopened.rows[rows[0]]["reply"] == "logged" and scores[0] == pytest.approx(1.0)
+
+
+def test_full_log_is_folded_into_the_metadata(index_path):
+    index = VectorIndex(index_path, DIM, 2, "model")
+    index.add(unit(0), "a", {"reply": "x"})
+    assert index._logged == 1
+    index.add(unit(1), "a", {"reply": "y"})
+    assert index._logged == 0
+    assert len(VectorIndex(index_path, DIM, 2, "model")) == 2
+
+
+def test_index_of_another_model_starts_fresh(index_path):
+    index = VectorIndex(index_path, DIM, 4, "model")
+    index.add(unit(0), "a", {"reply": "x"})
+    index.flush()
+    assert len(VectorIndex(index_path, DIM, 4, "other-model")) == 0
+
+
+def test_close_flushes_and_closes_the_embedder(cache, index_path):
+    cache.store("captain", "hello there", "Hi.", 0.5)
+    cache.close()
+    assert cache.embedder.closed
+    assert len(VectorIndex(index_path, DIM, 4, "model")) == 1
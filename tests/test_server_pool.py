@@ -0,0 +1,155 @@
+# tests/test_server_pool.py
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core import raven
+from core.server_pool import LlamaServerPool, ServerInstance
+
+
+class MockServer:
+    """A llama-server stand-in: streams `tokens` completion events, the first one after `first_delay` seconds."""
+
+    def __init__(self, name, first_delay=0.0, delay=0.01, tokens=10):
+        self.name, self.first_delay, self.delay, self.tokens = name, first_delay, delay, tokens
+        self.log = []  # ("stream" | "plain" | "finished" | "dropped", tokens sent)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, obj):
+                body = json.dumps(obj).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._json({"status": "ok"} if self.path == "/health" else
+                           {"total_slots": 1, "default_generation_settings": {"n_ctx": 512}})
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.path == "/tokenize":
+                    return self._json({"tokens": [1, 2, 3]})
+                server.log.append(("stream" if payload.get("stream") else "plain", 0))
+                if not payload.get("stream"):
+                    time.sleep(server.first_delay + server.delay * server.tokens)
+                    return self._json({"content": f"{server.name} " * server.tokens, "timings": {"predicted_n": server.tokens}})
+                self.send_response(200)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                sent = 0
+                try:
+                    time.sleep(server.first_delay)
+                    for i in range(server.tokens):
+                        self._chunk({"content": f"{server.name}{i} ", "stop": False})
+                        sent += 1
+                        time.sleep(server.delay)
+                    self._chunk({"content": "", "stop": True, "timings": {"predicted_n": server.tokens}})
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                    server.log.append(("finished", sent))
+                except (BrokenPipeError, ConnectionResetError):
+                    server.log.append(("dropped", sent))
+
+            def _chunk(self, event):
+                data = f"data: {json.dumps(event)}\n\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(*specs):
+        started.extend(MockServer(*spec) for spec in specs)
+        return started
+
+    yield start
+    for server in started:
+        server.close()
+
+
+def make_pool(mock_servers, hedge_after):
+    instances = [ServerInstance(["true"], server.url) for server in mock_servers]
+    for instance in instances:
+        instance.healthy = True
+    return LlamaServerPool(instances, hedge_after=hedge_after)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def chat_stream(pool, crew_name="captain"):
+    model_obj = {"type": "llamacpp_server", "url": pool.url, "pool": pool}
+    return "".join(raven.iter_server_chunks(model_obj, [{"role": "user", "content": "hi"}], 10, 0.0, 50, 0.95, 1.1, crew_name))
+
+
+def dropped(server):
+    return any(event == "dropped" and sent < server.tokens for event, sent in server.log)
+
+
+def test_slow_stream_is_hedged_until_the_first_token(servers):
+    slow, fast = servers(("slow", 1.0, 0.02, 100), ("fast", 0.0))
+    pool = make_pool([slow, fast], hedge_after=0.1)
+    started = time.perf_counter()
+    text = chat_stream(pool)
+    assert text.startswith("fast0 ")
+    assert time.perf_counter() - started < 0.8
+    assert (pool.hedged, pool.hedge_wins) == (1, 1)
+    assert wait_for(lambda: dropped(slow))
+    assert wait_for(lambda: all(instance.in_flight == 0 for instance in pool.instances))
+
+
+def test_fast_stream_is_not_hedged(servers):
+    primary, other = servers(("one", 0.0), ("two", 0.0))
+    pool = make_pool([primary, other], hedge_after=0.5)
+    assert chat_stream(pool).startswith("one0 ")
+    assert pool.hedged == 0
+    assert other.log == []
+
+
+def test_stream_without_hedging_uses_one_instance(servers):
+    (only,) = servers(("only", 0.0))
+    pool = make_pool([only], hedge_after=None)
+    assert chat_stream(pool) == " ".join(f"only{i}" for i in range(10)) + " "
+    assert pool.instances[0].in_flight == 0
+
+
+def test_non_streamed_request_is_hedged_and_the_loser_dropped(servers):
+    slow, fast = servers(("slow", 1.0, 0.02, 100), ("fast", 0.0))
+    pool = make_pool([slow, fast], hedge_after=0.1)
+    result = pool.complete({"prompt": "x"}, crew_name="c")
+    assert result["content"].startswith("fast0 ")
+    assert pool.hedge_wins == 1
+    assert wait_for(lambda: dropped(slow))
+
+
+def test_router_tokenizes_and_reads_the_context_through_the_pool(servers):
+    pool = make_pool(servers(("a", 0.0), ("b", 0.0)), hedge_after=None)
+    model_obj = {"type": "llamacpp_server", "url": pool.url, "pool": pool}
+    assert raven.count_tokens(model_obj, "a b") == 3
+    assert raven.context_size(model_obj) == 512
@@ -0,0 +1,45 @@
+# tests/test_startup_profile.py
+
+import sys
+import threading
+import time
+
+from core.startup_profile import ImportProfiler
+
+
+def test_imports_on_another_thread_do_not_nest_into_this_one():
+    profiler = ImportProfiler()
+    inside = threading.Event()
+
+    def background():
+        inside.wait()
+        profiler._enter("background_module")
+        time.sleep(0.05)
+        profiler._leave()
+
+    worker = threading.Thread(target=background)
+    worker.start()
+    profiler._enter("main_module")
+    inside.set()
+    worker.join()
+    profiler._leave()
+    records = {name: (cumulative, own, depth) for name, cumulative, own, depth in profiler.records}
+    assert records["background_module"][2] == 0
+    assert records["main_module"][2] == 0
+    assert records["main_module"][1] >= 0.05  # the other thread's import is not subtracted as a nested one
+
+
+def test_nested_imports_are_timed(monkeypatch, tmp_path):
+    (tmp_path / "profiled_outer.py").write_text("import time\nimport profiled_inner\ntime.sleep(0.01)\n")
+    (tmp_path / "profiled_inner.py").write_text("import time\ntime.sleep(0.02)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    profiler = ImportProfiler()
+    monkeypatch.setattr(sys, "meta_path", [profiler] + sys.meta_path)
+    import profiled_outer  # noqa: F401
+
+    records = {name: (cumulative, own, depth) for name, cumulative, own, depth in profiler.records}
+    assert records["profiled_inner"][2] == 1 and records["profiled_outer"][2] == 0
+    assert records["profiled_outer"][0] >= 0.03
+    assert 0.01 <= records["profiled_outer"][1] < records["profiled_outer"][0]
+    for name in ("profiled_outer", "profiled_inner"):
+        sys.modules.pop(name)
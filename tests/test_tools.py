@@ -0,0 +1,95 @@
+# tests/test_tools.py
+
+import sys
+import threading
+import time
+
+import pytest
+
+from bridge.tools import tools
+from bridge.tools.tools import Tool, run_subprocess, run_tool, submit_tool
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    outcomes = []
+    monkeypatch.setattr(tools.metrics, "record_tool", lambda name, seconds, outcome: outcomes.append((name, outcome)))
+    return outcomes
+
+
+@pytest.fixture
+def add_tool(monkeypatch):
+    def add(name, function, **fields):
+        monkeypatch.setitem(tools.TOOL_LIST, name, Tool(f"Test tool {name}.", function, **fields))
+        return name
+
+    return add
+
+
+posix_only = pytest.mark.skipif(sys.platform == "win32", reason="uses the sleep command and POSIX signals")
+
+
+def test_tool_result_and_metrics(add_tool, recorded):
+    add_tool("double", lambda value="1": str(int(value) * 2), parameters=["value"])
+    assert run_tool("double", value="21") == "42"
+    assert recorded == [("double", "ok")]
+
+
+def test_unknown_tool_and_missing_crew_are_answered_without_running(add_tool, recorded):
+    add_tool("needs_crew", lambda crew_instance=None, model=None: "ran", crew_dependent=True)
+    assert run_tool("no_such_tool") == "Tool 'no_such_tool' not found."
+    assert run_tool("needs_crew").startswith("Error:")
+    assert recorded == []
+
+
+def test_tool_error_reaches_the_caller(add_tool, recorded):
+    def fail():
+        raise ValueError("jammed")
+
+    add_tool("jam", fail)
+    with pytest.raises(ValueError, match="jammed"):
+        run_tool("jam")
+    assert recorded == [("jam", "error")]
+
+
+def test_slow_tool_times_out(add_tool, recorded):
+    release = threading.Event()
+    add_tool("hang", lambda: release.wait(5) and "late", timeout_s=0.2)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError, match="within 0.2 s"):
+        run_tool("hang")
+    assert 0.15 < time.monotonic() - started < 1.0
+    release.set()
+    assert recorded[0] == ("hang", "timeout")
+
+
+@posix_only
+def test_timed_out_subprocess_is_killed(add_tool, recorded):
+    add_tool("sleeper", lambda: str(run_subprocess(["sleep", "30"])), execution="subprocess", timeout_s=0.3)
+    run = submit_tool("sleeper")
+    with pytest.raises(TimeoutError):
+        run.result()
+    assert run.future.result(5) == "-9"  # the child was killed (SIGKILL), which frees the worker
+
+
+@posix_only
+def test_run_subprocess_timeout_kills_the_child():
+    with pytest.raises(tools.subprocess.TimeoutExpired):
+        run_subprocess(["sleep", "30"], timeout=0.1)
+
+
+def test_calls_on_one_resource_run_in_order(add_tool, recorded):
+    log = []
+
+    def write(name="", seconds="0"):
+        log.append(("start", name))
+        time.sleep(float(seconds))
+        log.append(("end", name))
+        return name
+
+    add_tool("write", write, parameters=["name", "seconds"], resource="disk", timeout_s=2.0)
+    first = submit_tool("write", name="a", seconds="0.1")
+    second = submit_tool("write", after=[first], name="b")
+    assert (first.result(), second.result()) == ("a", "b")
+    assert log == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b")]
+    assert second.deadline == pytest.approx(first.deadline + 2.0, abs=0.05)
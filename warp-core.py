@@ -2,6 +2,7 @@
 
 # clemm09/warp-core.py
 import os
+import sys
 from dotenv import load_dotenv
 
 def initialize_warp_drive():
@@ -14,10 +15,16 @@ def initialize_warp_drive():
     if required_key and len(required_key) > 8: # Removed the hardcoded key for better security
         print("Warp drive key verified. Engaging core systems...")
         import core.core
+        from core import startup_profile
+        startup_profile.report("core imports")
         core.core.start_core()
     else:
         print("ERROR: Invalid or missing warp drive key. System shutdown initiated.")
         exit()
 
 if __name__ == "__main__":
+    if "--profile-startup" in sys.argv[1:]:
+        # Report per-module import times for the launch path and for backend activation.
+        from core import startup_profile
+        startup_profile.enable()
     initialize_warp_drive()
\ No newline at end of file